@@ -0,0 +1,212 @@
+"""Модуль содержит класс для резервного копирования базы данных сервера без
+остановки сервера и программу для запуска резервного копирования.
+
+Копия создается функцией backup модуля sqlite3 (SQLite Online Backup API)
+небольшими шагами по заданному количеству страниц базы данных в отдельном
+потоке. Между шагами сервер обрабатывает запросы клиентов. Копирование
+идет через то же соединение с базой данных, что использует сервер, поэтому
+изменения, сделанные сервером во время копирования, попадают в копию, и
+копирование не начинается заново. Копия соответствует состоянию базы данных
+на момент окончания копирования.
+
+Запуск копирования: python backup.py [-p порт] [-a адрес] [--pages
+количество страниц за шаг]"""
+
+import os
+import sqlite3
+import time
+from array import array
+from price_statistics import percentile
+from utilities import thread
+from const import *
+
+
+class OnlineBackup:
+    """Класс резервного копирования базы данных SQLite по шагам."""
+
+    def __init__(self, connection, path, pages=BACKUP_PAGES,
+                 pause=BACKUP_PAUSE):
+        """Конструктор.
+        :param connection: соединение sqlite3 с копируемой базой данных.
+        Соединение должно допускать использование из другого потока;
+        :param path: путь к файлу копии;
+        :param pages: количество страниц, копируемых за один шаг;
+        :param pause: пауза между шагами в секундах, во время которой
+        соединение свободно для запросов сервера."""
+
+        self.connection = connection
+        self.path = path
+        self.pages = pages
+        self.pause = pause
+        self.state = RUNNING
+        self.error = None
+        # Количество страниц в базе данных, еще не скопированных страниц и
+        # выполненных шагов
+        self.total = 0
+        self.remaining = 0
+        self.steps = 0
+        self.started = time.monotonic()
+        self.finished = None
+        # Время обработки запросов клиентов в секундах: 99-й перцентиль до
+        # начала копирования и все значения во время копирования
+        self.p99_before = None
+        self.latencies = array('d')
+        self.thread = None
+
+    def add_latency(self, seconds):
+        """Метод запоминает время обработки запроса клиента во время
+        копирования.
+        :param seconds: время в секундах."""
+
+        self.latencies.append(seconds)
+
+    def get_stats(self):
+        """Метод возвращает состояние копирования.
+        :return: словарь с путем к копии (PATH), состоянием (STATE),
+        количеством страниц (PAGES), оставшихся страниц (REMAINING) и шагов
+        (STEPS), временем копирования в секундах (ELAPSED), 99-м
+        перцентилем времени обработки запросов в миллисекундах до и во
+        время копирования (P99_BEFORE, P99_DURING) и текстом ошибки
+        (ERROR), если копирование не удалось."""
+
+        end = self.finished if self.finished is not None else time.monotonic()
+        stats = {PATH: self.path, STATE: self.state, PAGES: self.total,
+                 REMAINING: self.remaining, STEPS: self.steps,
+                 ELAPSED: round(end - self.started, 3),
+                 P99_BEFORE: to_ms(self.p99_before),
+                 P99_DURING: to_ms(get_p99(self.latencies))}
+        if self.error is not None:
+            stats[ERROR] = self.error
+        return stats
+
+    def progress(self, status, remaining, total):
+        """Метод вызывается после каждого шага копирования.
+        :param status: код результата шага;
+        :param remaining: количество еще не скопированных страниц;
+        :param total: количество страниц в базе данных."""
+
+        self.steps += 1
+        self.remaining = remaining
+        self.total = total
+        if remaining and self.pause:
+            # Даем серверу выполнить запросы между шагами
+            time.sleep(self.pause)
+
+    @thread
+    def run(self):
+        """Метод копирует базу данных в отдельном потоке. Копия сначала
+        записывается во временный файл, который переименовывается после
+        окончания копирования, поэтому по пути копии никогда не лежит
+        незаконченная копия."""
+
+        temp_path = self.path + '.part'
+        try:
+            target = sqlite3.connect(temp_path)
+            try:
+                self.connection.backup(target, pages=self.pages,
+                                       progress=self.progress,
+                                       sleep=self.pause or BACKUP_PAUSE)
+            finally:
+                target.close()
+            os.replace(temp_path, self.path)
+            state = DONE
+        except Exception as exc:
+            self.error = str(exc)
+            state = FAILED
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.finished = time.monotonic()
+        # Состояние меняется последним: сервер считает копирование
+        # законченным, как только состояние перестает быть RUNNING
+        self.state = state
+
+    def start(self, latencies=()):
+        """Метод запускает копирование.
+        :param latencies: время обработки последних запросов клиентов до
+        начала копирования в секундах.
+        :return: объект OnlineBackup."""
+
+        self.p99_before = get_p99(latencies)
+        self.thread = self.run()
+        return self
+
+
+def get_p99(latencies):
+    """Функция вычисляет 99-й перцентиль времени обработки запросов.
+    :param latencies: время обработки запросов в секундах.
+    :return: 99-й перцентиль или None, если запросов не было."""
+
+    if not len(latencies):
+        return None
+    return percentile(sorted(latencies), 99)
+
+
+def to_ms(seconds):
+    """Функция переводит время в миллисекунды.
+    :param seconds: время в секундах или None.
+    :return: время в миллисекундах или None."""
+
+    return None if seconds is None else round(1000 * seconds, 3)
+
+
+def main():
+    """Функция просит сервер создать резервную копию базы данных и
+    показывает ход копирования."""
+
+    import queue
+    import sys
+    from client import Client
+
+    pages = BACKUP_PAGES
+    if '--pages' in sys.argv:
+        pages = int(sys.argv[sys.argv.index('--pages') + 1])
+    messages = queue.Queue()
+    client = Client(on_message=messages.put)
+    client.connect()
+    if not client.connected.wait(CONNECT_TIMEOUT):
+        print('Нет соединения с сервером')
+        client.close()
+        sys.exit(1)
+    client.create_msg({ACTION: BACKUP, CONTENT: {PAGES: pages}})
+    code = 1
+    polled = time.monotonic()
+    try:
+        while True:
+            if time.monotonic() - polled >= BACKUP_POLL_INTERVAL:
+                # Запрашиваем ход копирования
+                polled = time.monotonic()
+                client.create_msg({ACTION: GET_SERVER_STATS})
+            try:
+                msg = messages.get(timeout=BACKUP_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            stats = msg.get(CONTENT) or {}
+            if msg.get(ACTION) == GET_SERVER_STATS:
+                stats = stats.get(BACKUP) or {}
+                if stats.get(STATE) == RUNNING and stats.get(PAGES):
+                    done = 1 - stats[REMAINING] / stats[PAGES]
+                    print(f'Скопировано {done:.0%} из {stats[PAGES]} страниц '
+                          f'за {stats[STEPS]} шагов')
+                continue
+            if msg.get(ACTION) != BACKUP:
+                continue
+            if msg.get(STATUS) == 202:
+                print(f'Копирование начато: {stats.get(PATH)}')
+                continue
+            if msg.get(STATUS) == 200:
+                print(f'Копия создана: {stats[PATH]}, страниц {stats[PAGES]}, '
+                      f'шагов {stats[STEPS]}, {stats[ELAPSED]} с')
+                print(f'99-й перцентиль времени обработки запросов: до '
+                      f'копирования {stats[P99_BEFORE]} мс, во время '
+                      f'копирования {stats[P99_DURING]} мс')
+                code = 0
+            else:
+                print(f'Копия не создана: {msg}')
+            break
+    finally:
+        client.close()
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
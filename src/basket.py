@@ -0,0 +1,317 @@
+"""Модуль содержит индекс последних цен товаров в магазинах и функции для
+поиска самой дешевой покупки списка товаров: в одном магазине или в
+нескольких магазинах.
+
+Цены для поиска берутся из индекса, а не из всех оценок, поэтому время
+поиска зависит только от количества магазинов, в которых есть товары из
+списка."""
+
+from const import *
+
+# Стоимость товара, которого нет ни в одном выбранном магазине
+MISSING_PRICE = float('inf')
+# Максимальное количество проходов улучшения набора магазинов
+MAX_SWAP_PASSES = 10
+
+
+class PriceIndex:
+    """Класс индекса последних цен товаров по одному фильтру. Для каждого
+    товара хранится словарь адрес магазина -> цена из последней оценки
+    товара в этом магазине."""
+
+    __slots__ = ('prices', 'stale')
+
+    def __init__(self):
+        """Конструктор."""
+
+        # Словарь ID товара -> словарь адрес магазина -> цена
+        self.prices = {}
+        # ID товаров, цены которых устарели и должны быть загружены заново
+        self.stale = set()
+
+    def load(self, rows, product_id=None):
+        """Метод заполняет индекс последними ценами.
+        :param rows: кортежи (ID товара, адрес магазина, цена);
+        :param product_id: ID товара, если загружаются цены одного товара.
+        Если None, то загружаются цены всех товаров."""
+
+        if product_id is not None:
+            self.prices[product_id] = {}
+            self.stale.discard(product_id)
+        for row_product_id, address, price in rows:
+            self.prices.setdefault(row_product_id, {})[address] = price
+
+    def set(self, product_id, address, price):
+        """Метод запоминает новую последнюю цену товара в магазине.
+        :param product_id: ID товара;
+        :param address: адрес магазина;
+        :param price: цена."""
+
+        self.prices.setdefault(product_id, {})[address] = price
+
+
+def basket_plan(stores, names, prices):
+    """Функция описывает покупку товаров в наборе магазинов для клиента.
+    Каждый товар покупается в том магазине набора, где он дешевле.
+    :param stores: адреса магазинов;
+    :param names: названия товаров;
+    :param prices: список словарей адрес магазина -> цена для каждого
+    товара.
+    :return: словарь с общей стоимостью (TOTAL) и списком магазинов с
+    товарами, которые в них нужно купить (STORES)."""
+
+    items = {store: [] for store in stores}
+    total = 0
+    for name, product_prices in zip(names, prices):
+        price, store = min((product_prices[store], store) for store in stores
+                           if store in product_prices)
+        items[store].append({PRODUCT: name, RATING: price})
+        total += price
+    return {TOTAL: total,
+            STORES: [{ADDRESS: store, ITEMS: items[store]}
+                     for store in stores if items[store]]}
+
+
+def basket_cost(stores, prices):
+    """Функция вычисляет стоимость покупки товаров в наборе магазинов, если
+    каждый товар покупается там, где он дешевле.
+    :param stores: адреса магазинов;
+    :param prices: список словарей адрес магазина -> цена для каждого
+    товара.
+    :return: стоимость (MISSING_PRICE, если какого-то товара нет ни в одном
+    магазине)."""
+
+    return sum(min((product_prices.get(store, MISSING_PRICE)
+                    for store in stores), default=MISSING_PRICE)
+               for product_prices in prices)
+
+
+def cheapest_store(prices):
+    """Функция находит магазин, в котором покупка всех товаров дешевле всего.
+    Рассматриваются только магазины, в которых есть все товары.
+    :param prices: список словарей адрес магазина -> цена для каждого
+    товара.
+    :return: пара (стоимость, адрес магазина) или None, если ни в одном
+    магазине нет всех товаров."""
+
+    if not prices:
+        return None
+    # Магазины, в которых есть все товары, ищем начиная с самого редкого
+    # товара
+    ordered = sorted(prices, key=len)
+    stores = set(ordered[0])
+    for product_prices in ordered[1:]:
+        stores.intersection_update(product_prices)
+        if not stores:
+            return None
+    return min((sum(product_prices[store] for product_prices in prices), store)
+               for store in stores)
+
+
+def cheapest_split(prices, max_stores):
+    """Функция подбирает набор не больше чем из max_stores магазинов, в
+    которых покупка всех товаров дешевле всего. Точный подбор требует
+    перебора всех наборов магазинов, поэтому набор строится жадно (каждый
+    раз добавляется магазин, больше всего снижающий стоимость), а затем
+    улучшается заменой магазинов по одному. Результат не хуже покупки в
+    самом дешевом магазине (cheapest_store), но может быть не самым дешевым
+    из возможных.
+    :param prices: список словарей адрес магазина -> цена для каждого
+    товара;
+    :param max_stores: максимальное количество магазинов.
+    :return: пара (стоимость, список адресов магазинов) или None, если не
+    удалось найти набор магазинов, в которых есть все товары."""
+
+    if not prices or not all(prices):
+        return None
+    # Цены по магазинам: адрес -> список пар (номер товара, цена)
+    stores = {}
+    for i, product_prices in enumerate(prices):
+        for store, price in product_prices.items():
+            stores.setdefault(store, []).append((i, price))
+    # Стоимость набора магазинов - пара (количество товаров, которых нет в
+    # магазинах набора, стоимость остальных товаров). Наборы сравниваются
+    # сначала по первому элементу пары, потом по второму
+    chosen = []
+    best = [MISSING_PRICE] * len(prices)
+    while len(chosen) < max_stores:
+        store, gain = max(((store, gain_of(items, best))
+                           for store, items in stores.items()
+                           if store not in chosen),
+                          key=lambda x: x[1], default=(None, (0, 0)))
+        if store is None or gain <= (0, 0):
+            break
+        chosen.append(store)
+        add_store(stores[store], best)
+    cost = cost_of(best)
+    for _ in range(MAX_SWAP_PASSES):
+        improved = False
+        for k in range(len(chosen)):
+            # Лучшие цены без k-го магазина
+            rest = [MISSING_PRICE] * len(prices)
+            for store in chosen[:k] + chosen[k + 1:]:
+                add_store(stores[store], rest)
+            rest_cost = cost_of(rest)
+            for store, items in stores.items():
+                if store in chosen:
+                    continue
+                covered, saving = gain_of(items, rest)
+                new_cost = (rest_cost[0] - covered, rest_cost[1] - saving)
+                if new_cost < cost:
+                    # Заменяем k-ый магазин
+                    chosen[k] = store
+                    cost = new_cost
+                    improved = True
+        if not improved:
+            break
+    if cost[0]:
+        return None
+    single = cheapest_store(prices)
+    if single is not None and single[0] <= cost[1]:
+        return single[0], [single[1]]
+    return cost[1], chosen
+
+
+def add_store(items, best):
+    """Функция обновляет лучшие цены товаров после добавления магазина.
+    :param items: список пар (номер товара, цена) для магазина;
+    :param best: список лучших цен товаров."""
+
+    for i, price in items:
+        if price < best[i]:
+            best[i] = price
+
+
+def cost_of(best):
+    """Функция вычисляет стоимость набора магазинов по лучшим ценам.
+    :param best: список лучших цен товаров в магазинах набора.
+    :return: пара (количество товаров, которых нет в магазинах набора,
+    стоимость остальных товаров)."""
+
+    missing = best.count(MISSING_PRICE)
+    return missing, sum(price for price in best if price != MISSING_PRICE)
+
+
+def gain_of(items, best):
+    """Функция вычисляет, насколько снизится стоимость набора магазинов,
+    если добавить магазин.
+    :param items: список пар (номер товара, цена) для магазина;
+    :param best: список лучших цен товаров в магазинах набора.
+    :return: пара (количество товаров, которых не было в магазинах набора,
+    снижение стоимости остальных товаров). Цены товаров, которых не было в
+    наборе, вычитаются из снижения стоимости."""
+
+    covered = 0
+    saving = 0
+    for i, price in items:
+        if best[i] == MISSING_PRICE:
+            covered += 1
+            saving -= price
+        elif price < best[i]:
+            saving += best[i] - price
+    return covered, saving
+
+
+if __name__ == '__main__':
+
+    # Замер времени поиска самой дешевой покупки на синтетических данных:
+    # тысячи магазинов, в каждом из которых есть часть товаров. Качество
+    # приближенного подбора набора магазинов проверяется перебором на
+    # небольших данных
+    import itertools
+    import os
+    import random
+    import tempfile
+    import time
+    from datetime import datetime
+
+    def synthetic_prices(stores, products, share, seed=1):
+        """Функция создает словарь ID товара -> словарь адрес магазина ->
+        цена. Каждый товар есть в доле share магазинов."""
+
+        rng = random.Random(seed)
+        base = [rng.uniform(50, 500) for _ in range(products)]
+        prices = {}
+        for product_id in range(products):
+            prices[product_id] = {
+                f'Магазин {store}': round(base[product_id] *
+                                          rng.uniform(0.7, 1.3), 2)
+                for store in range(stores) if rng.random() < share}
+        return prices
+
+    def measure(function, repeat=5):
+        """Функция возвращает лучшее время вызова в миллисекундах и
+        результат."""
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+        return 1000 * min(times), result
+
+    # 1. Время поиска по индексу
+    for stores, share in ((1000, 0.5), (5000, 0.5), (5000, 0.9)):
+        index = synthetic_prices(stores, 200, share)
+        basket = [index[product_id] for product_id in range(0, 200, 10)]
+        print(f'{stores} магазинов, товар есть в {share:.0%} магазинов, '
+              f'{len(basket)} товаров в списке:')
+        ms, result = measure(lambda: cheapest_store(basket))
+        print(f'    один магазин       {ms:8.1f} мс')
+        for max_stores in (2, 3, 5):
+            ms, result = measure(lambda: cheapest_split(basket, max_stores))
+            print(f'    до {max_stores} магазинов      {ms:8.1f} мс, '
+                  f'магазинов {len(result[1])}')
+
+    # 2. Качество приближенного подбора в сравнении с перебором
+    for max_stores in (2, 3):
+        gaps = []
+        for seed in range(30):
+            index = synthetic_prices(40, 10, 0.5, seed)
+            basket = list(index.values())
+            found = cheapest_split(basket, max_stores)
+            exact = min(basket_cost(combination, basket)
+                        for k in range(1, max_stores + 1)
+                        for combination in itertools.combinations(
+                            {store for prices in basket for store in prices},
+                            k))
+            gaps.append(found[0] / exact - 1)
+        print(f'До {max_stores} магазинов (40 магазинов, 10 товаров, 30 '
+              f'наборов): точно в {sum(gap < 1e-9 for gap in gaps)}, '
+              f'максимальное превышение {max(gaps):.2%}')
+
+    # 3. Построение индекса последних цен по базе данных и поиск через
+    # хранилище
+    from database import Database
+    with tempfile.TemporaryDirectory() as path:
+        products = [f'Товар {i}' for i in range(100)]
+        db = Database(os.path.join(path, 'db.sqlite3'),
+                      estimations=((PRICE_FILTER, 0, None),),
+                      products=products)
+        estimation_id = db.get_estimation_id(PRICE_FILTER)
+        rng = random.Random(1)
+        # Оценки добавляются одной транзакцией, чтобы быстрее заполнить базу
+        # данных
+        for i in range(200000):
+            db.execute('insert_rating', product_id=rng.randint(1, 100),
+                       estimation_id=estimation_id,
+                       rating=round(rng.uniform(50, 500), 2),
+                       address=f'Магазин {rng.randrange(2000)}',
+                       date=datetime.now())
+        db.session.commit()
+        names = products[:20]
+        start = time.perf_counter()
+        db.get_cheapest_basket(names, PRICE_FILTER)
+        print(f'200000 оценок, 2000 магазинов: построение индекса и первый '
+              f'поиск {1000 * (time.perf_counter() - start):.1f} мс')
+        ms, _ = measure(lambda: db.get_cheapest_basket(names, PRICE_FILTER, 3))
+        print(f'    поиск по индексу (до 3 магазинов) {ms:.1f} мс')
+        db.add_rating(names[0], PRICE_FILTER, 10, 'Магазин 1')
+        ms, _ = measure(lambda: db.get_cheapest_basket(names, PRICE_FILTER, 3),
+                        1)
+        print(f'    поиск после добавления оценки {ms:.1f} мс')
+        db.delete_rating(db.get_ratings(names[0], PRICE_FILTER, limit=1)[0][ID])
+        ms, _ = measure(lambda: db.get_cheapest_basket(names, PRICE_FILTER, 3),
+                        1)
+        print(f'    поиск после удаления оценки {ms:.1f} мс')
+        db.session.close()
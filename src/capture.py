@@ -0,0 +1,121 @@
+"""Модуль содержит класс для записи сообщений, которые сервер получает от
+клиентов, в журнал и функцию для чтения журнала. Журнал нужен, чтобы
+воспроизвести реальную нагрузку на новом сервере программой replay.py.
+
+Журнал - набор файлов capture-<время создания>.bin в папке журнала. Файл
+начинается с CAPTURE_MAGIC, за которым идут записи. Запись - заголовок
+RECORD (время получения сообщения в микросекундах от начала эпохи, номер
+соединения, длина сообщения) и сообщение в том виде, в каком оно пришло по
+сети, но без сжатия. IP адреса клиентов в журнал не записываются."""
+
+import glob
+import os
+import struct
+import time
+from datetime import datetime
+from const import *
+
+# Начало файла журнала (с номером версии формата)
+CAPTURE_MAGIC = b'GIECAP1\n'
+# Заголовок записи
+RECORD = struct.Struct('>QII')
+
+
+class TrafficCapture:
+    """Класс записи сообщений от клиентов в журнал. Записи копятся в буфере
+    и сбрасываются на диск, когда буфер заполнится или пройдет
+    CAPTURE_FLUSH_INTERVAL секунд, поэтому запись сообщения почти не
+    замедляет сервер. Когда файл журнала вырастает до max_bytes, начинается
+    новый файл, а самые старые файлы сверх max_files удаляются."""
+
+    def __init__(self, dir_path, max_bytes=CAPTURE_FILE_SIZE,
+                 max_files=CAPTURE_FILES):
+        """Конструктор.
+        :param dir_path: папка журнала;
+        :param max_bytes: максимальный размер файла журнала в байтах;
+        :param max_files: максимальное количество файлов журнала."""
+
+        self.dir_path = dir_path
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        self.file = None
+        # Размер текущего файла и время последнего сброса буфера на диск
+        self.size = 0
+        self.flushed_at = time.monotonic()
+        # Количество записанных сообщений
+        self.count = 0
+        self.rotate()
+
+    def add(self, serial, data):
+        """Метод записывает сообщение в журнал.
+        :param serial: номер соединения, по которому пришло сообщение;
+        :param data: сообщение - байты JSON без сжатия."""
+
+        self.file.write(RECORD.pack(time.time_ns() // 1000, serial,
+                                    len(data)))
+        self.file.write(data)
+        self.size += RECORD.size + len(data)
+        self.count += 1
+        if self.size >= self.max_bytes:
+            self.rotate()
+            return
+        now = time.monotonic()
+        if now - self.flushed_at >= CAPTURE_FLUSH_INTERVAL:
+            self.flushed_at = now
+            self.file.flush()
+
+    def close(self):
+        """Метод сбрасывает буфер на диск и закрывает файл журнала."""
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def rotate(self):
+        """Метод начинает новый файл журнала и удаляет самые старые
+        файлы."""
+
+        self.close()
+        # Имена файлов упорядочены так же, как время их создания
+        name = datetime.now().strftime('capture-%Y%m%d-%H%M%S-%f.bin')
+        path = os.path.join(self.dir_path, name)
+        self.file = open(path, 'wb', buffering=CAPTURE_BUFFER_SIZE)
+        self.file.write(CAPTURE_MAGIC)
+        self.size = len(CAPTURE_MAGIC)
+        for old_path in list_capture_files(self.dir_path)[:-self.max_files]:
+            os.remove(old_path)
+
+
+def list_capture_files(path):
+    """Функция находит файлы журнала.
+    :param path: папка журнала или путь к файлу журнала.
+    :return: список путей к файлам в порядке создания."""
+
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, 'capture-*.bin')))
+    return [path]
+
+
+def read_capture(path):
+    """Функция читает записи журнала.
+    :param path: папка журнала или путь к файлу журнала.
+    :return: генератор кортежей (время получения в микросекундах от начала
+    эпохи, номер соединения, сообщение - байты JSON)."""
+
+    for file_path in list_capture_files(path):
+        with open(file_path, 'rb') as file:
+            if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                raise ValueError(f'{file_path} не является журналом')
+            while True:
+                header = file.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    # Конец файла или запись, которую сервер не успел
+                    # дописать
+                    break
+                timestamp, serial, length = RECORD.unpack(header)
+                data = file.read(length)
+                if len(data) < length:
+                    break
+                yield timestamp, serial, data
@@ -1,19 +1,18 @@
 """Программа-клиент."""
 
 import json
+import random
 import socket
 import sys
 import time
 import threading
+from collections import deque
 from datetime import datetime
-from PyQt5.QtCore import pyqtSignal, QObject
 import const as cn
 from messenger import Messenger
 from utilities import *
 
 
-# Семафор для потока с отправкой сообщений
-sender_semaphore = threading.Semaphore(0)
 # Ключи для потоков для установки соединения с сервером, для получения и
 # отправки сообщений на сервер
 TH_CONNECT = 'connect'
@@ -21,96 +20,260 @@ TH_PROCESS = 'process'
 TH_SEND = 'send'
 
 
-class Client(QObject):
-    """Класс для работы с клиентом."""
+class Client:
+    """Класс для работы с клиентом. Класс не зависит от PyQt5, поэтому
+    клиента можно использовать и без графического интерфейса.
 
-    # Сигнал для отправки сообщений в главное окно
-    signal_to_send = pyqtSignal(dict)
+    Соединением с сервером управляет один поток (TH_CONNECT). Он
+    подключается к серверу, запускает по одному потоку для чтения и для
+    отправки сообщений, а после разрыва соединения дожидается их завершения,
+    закрывает сокет и подключается заново.
 
-    def __init__(self):
+    Оценки (ADD_RATING) отправляются с ключами идемпотентности. Запрос, на
+    который не пришел ответ до разрыва соединения, отправляется заново
+    после переподключения раньше остальных сообщений. Сервер находит
+    оценки, уже добавленные с теми же ключами, и не добавляет их второй
+    раз."""
+
+    def __init__(self, on_message=None, on_connect=None):
         """Конструктор.
-        :param wnd: ссылка на окно приложения."""
+        :param on_message: функция, которая вызывается из потока чтения
+        сообщений для каждого сообщения от сервера. Если None, то сообщения
+        только выводятся в консоль;
+        :param on_connect: функция, которая вызывается после каждого
+        установления соединения с сервером."""
 
-        super().__init__()
+        # Функция для передачи сообщений из сервера, например, в главное окно
+        self.on_message = on_message
+        self.on_connect = on_connect
+        # Очередь сообщений для отправки на сервер
+        self.messages = deque()
+        # Отправленные запросы на добавление оценок, ответ на которые еще не
+        # получен, в порядке отправки, и словарь id(запрос) -> количество
+        # отправок запроса
+        self.in_flight = deque()
+        self.attempts = {}
+        # Условие, по которому потоки ждут сообщений для отправки и разрыва
+        # соединения
+        self.condition = threading.Condition()
         # Сигнал о наличии соединения с сервером
         self.connected = threading.Event()
+        # Сигнал о завершении работы клиента
+        self.stopped = threading.Event()
         # Объект для отправки/получения сообщений от сервера
-        self.messenger = Messenger()
+        self.messenger = Messenger(cn.MAX_RESPONSE_LENGTH)
         # Словарь с потоками
         self.threads = {TH_CONNECT: None, TH_PROCESS: None, TH_SEND: None}
+        # Сокет текущего соединения с сервером
+        self.server_sock = None
+        # Способ сжатия сообщений, согласованный с сервером
+        self.codec = None
+
+    def close(self):
+        """Метод закрывает соединение с сервером и завершает потоки
+        клиента."""
+
+        self.stopped.set()
+        self.drop_connection(self.server_sock)
+        supervisor = self.threads[TH_CONNECT]
+        if supervisor and supervisor is not threading.current_thread():
+            supervisor.join()
 
-    @thread
     def connect(self):
-        """Метод подключает клиента к серверу."""
+        """Метод запускает поток, который подключает клиента к серверу и
+        переподключает при разрыве соединения. Если поток уже запущен,
+        второй поток не запускается."""
 
-        printf('Запущено соединение с сервером')
-        self.connected.clear()  # нет соединения
-        while not self.connected.is_set():
-            # Определяются порт и IP адрес сервера
-            self.server_addr = determine_address()
-            self.server_port = determine_port()
-            # Инициализация сокета
-            self.server_sock = socket.socket(socket.AF_INET,
-                                             socket.SOCK_STREAM)
-            try:
-                self.server_sock.connect((self.server_addr, self.server_port))
-                self.connected.set()  # есть соединение
-                printf('Установлено соединение')
-            except ConnectionRefusedError:
-                # Ошибка при подключении к серверу
-                time.sleep(1)
-        # Создаем два потока: для чтения и для отправки сообщений
-        if not self.threads[TH_PROCESS] or not self.threads[TH_PROCESS].is_alive():
-            self.threads[TH_PROCESS] = self.process_msg()
-        if not self.threads[TH_SEND] or not self.threads[TH_SEND].is_alive():
-            self.threads[TH_SEND] = self.send_msg()
+        supervisor = self.threads[TH_CONNECT]
+        if supervisor is None or not supervisor.is_alive():
+            self.stopped.clear()
+            self.threads[TH_CONNECT] = self.supervise()
 
     def create_msg(self, data):
-        """Метод создает сообщение для отправки на сервер.
+        """Метод создает сообщение для отправки на сервер. Оценкам без ключа
+        идемпотентности выдаются ключи, а запросу на добавление оценок без
+        REQUEST_ID - идентификатор, по которому ответ сопоставляется с
+        запросом.
         :param data: данные для отправки."""
 
-        self.msg = data
-        sender_semaphore.release()
+        if data.get(cn.ACTION) == cn.ADD_RATING:
+            content = data.get(cn.CONTENT)
+            for rating in content if isinstance(content, list) else [content]:
+                if isinstance(rating, dict):
+                    rating.setdefault(cn.IDEMPOTENCY_KEY, create_key())
+            data.setdefault(cn.REQUEST_ID, create_key())
+        with self.condition:
+            self.messages.append(data)
+            self.condition.notify_all()
+
+    def complete_msg(self, msg):
+        """Метод отмечает запрос на добавление оценок, на который пришел
+        ответ. Сервер отвечает на запросы клиента по порядку, поэтому
+        ответ относится к первому отправленному запросу с тем же
+        REQUEST_ID.
+        :param msg: сообщение из сервера."""
+
+        request_id = msg.get(cn.REQUEST_ID)
+        with self.condition:
+            for sent in self.in_flight:
+                if sent.get(cn.REQUEST_ID) == request_id:
+                    self.in_flight.remove(sent)
+                    self.attempts.pop(id(sent), None)
+                    break
+
+    def drop_connection(self, sock):
+        """Метод отмечает разрыв соединения. Сокет закрывается на чтение и
+        запись, чтобы потоки, которые ждут данных из сокета, завершились.
+        :param sock: сокет соединения. Если соединение уже заменено новым,
+        ничего не происходит."""
+
+        with self.condition:
+            if sock is None or sock is not self.server_sock:
+                return
+            self.connected.clear()
+            self.condition.notify_all()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # Соединение уже разорвано
+            pass
+
+    def open_connection(self):
+        """Метод подключается к серверу и сообщает серверу, какие способы
+        сжатия сообщений доступны.
+        :return: сокет соединения."""
+
+        # Определяются порт и IP адрес сервера
+        self.server_addr = determine_address()
+        self.server_port = determine_port()
+        sock = socket.create_connection((self.server_addr, self.server_port),
+                                        cn.CONNECT_TIMEOUT)
+        try:
+            sock.settimeout(None)
+            self.messenger.send_msg(
+                sock, {cn.ACTION: cn.HELLO,
+                       cn.CONTENT: {cn.COMPRESSION: self.messenger.codecs}})
+        except OSError:
+            sock.close()
+            raise
+        return sock
 
     @thread
-    def process_msg(self):
-        """Метод разбирает сообщение из сервера."""
+    def process_msg(self, sock):
+        """Метод разбирает сообщения из сервера, пока соединение не
+        разорвано.
+        :param sock: сокет соединения."""
 
         printf('Запущен поток для чтения сообщений')
-        # Цикл продолжается, пока есть соединение с сервером
-        while self.connected.is_set():
-            try:
-                msg = self.messenger.get_msg(self.server_sock)
+        try:
+            while True:
+                msg = self.messenger.get_msg(sock)
                 action = msg.get(cn.ACTION)
-                if action:
+                if action == cn.HELLO:
+                    # Сервер выбрал способ сжатия сообщений
+                    self.codec = msg.get(cn.CONTENT, {}).get(cn.COMPRESSION)
+                elif action:
+                    if action == cn.ADD_RATING:
+                        self.complete_msg(msg)
                     printf(f'Клиент получил сообщение: {msg}')
-                    self.signal_to_send.emit(msg)
-            except BaseException:
-                # Произошла ошибка, которую считаем ошибкой подключения к
-                # серверу
-                self.connected.clear()
+                    if self.on_message:
+                        self.on_message(msg)
+        except BaseException:
+            # Произошла ошибка, которую считаем ошибкой подключения к
+            # серверу
+            self.drop_connection(sock)
         printf('Поток для чтения сообщений завершен')
-        # Запускаем соединение с сервером
-        self.connect()
+
+    def requeue_in_flight(self):
+        """Метод ставит запросы, ответ на которые не получен, в начало
+        очереди сообщений в прежнем порядке. Запрос, который уже был
+        отправлен MAX_WRITE_ATTEMPTS раз, больше не отправляется: возможно,
+        именно он приводит к разрыву соединения. Метод вызывается под
+        условием self.condition."""
+
+        while self.in_flight:
+            msg = self.in_flight.pop()
+            if self.attempts[id(msg)] < cn.MAX_WRITE_ATTEMPTS:
+                self.messages.appendleft(msg)
+            else:
+                del self.attempts[id(msg)]
+                printf(f'Запрос не будет отправлен заново: {msg}')
 
     @thread
-    def send_msg(self):
-        """Метод отправляет сообщения на сервер."""
+    def send_msg(self, sock):
+        """Метод отправляет сообщения на сервер, пока соединение не
+        разорвано.
+        :param sock: сокет соединения."""
 
         printf('Запущен поток для отправки сообщений')
-        # Цикл продолжается, пока есть соединение с сервером
-        while self.connected.is_set():
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.messages or not self.connected.is_set())
+                if not self.connected.is_set():
+                    break
+                msg = self.messages.popleft()
+                if msg.get(cn.ACTION) == cn.ADD_RATING:
+                    # Запрос будет отправлен заново, если ответ на него не
+                    # придет до разрыва соединения
+                    self.in_flight.append(msg)
+                    self.attempts[id(msg)] = self.attempts.get(id(msg), 0) + 1
             try:
-                sender_semaphore.acquire()
-                printf(f'Клиент отправляет сообщение: {self.msg}')
-                self.messenger.send_msg(self.server_sock, self.msg)
+                printf(f'Клиент отправляет сообщение: {msg}')
+                self.messenger.send_msg(sock, msg, self.codec)
             except BaseException:
                 # Произошла ошибка, которую считаем ошибкой подключения к
                 # серверу
-                self.connected.clear()
+                self.drop_connection(sock)
+                break
         printf('Поток для отправки сообщений завершен')
-        # Запускаем соединение с сервером
-        self.connect()
+
+    @thread
+    def supervise(self):
+        """Метод подключает клиента к серверу и переподключает при разрыве
+        соединения, пока клиент не будет закрыт методом close. Задержка
+        между неудачными попытками подключения растет от RECONNECT_DELAY до
+        MAX_RECONNECT_DELAY и выбирается случайно в пределах от половины до
+        целого значения, чтобы клиенты не подключались одновременно после
+        перезапуска сервера."""
+
+        printf('Запущено соединение с сервером')
+        attempt = 0
+        while not self.stopped.is_set():
+            try:
+                sock = self.open_connection()
+            except OSError:
+                # Ошибка при подключении к серверу
+                delay = min(cn.MAX_RECONNECT_DELAY,
+                            cn.RECONNECT_DELAY * 2 ** attempt)
+                attempt += 1
+                self.stopped.wait(random.uniform(delay / 2, delay))
+                continue
+            attempt = 0
+            with self.condition:
+                self.requeue_in_flight()
+                self.server_sock = sock
+                self.codec = None
+                self.connected.set()  # есть соединение
+            printf('Установлено соединение')
+            # Создаем два потока: для чтения и для отправки сообщений
+            self.threads[TH_PROCESS] = self.process_msg(sock)
+            self.threads[TH_SEND] = self.send_msg(sock)
+            if self.on_connect:
+                self.on_connect()
+            if self.stopped.is_set():
+                # Клиент закрыт во время подключения
+                self.drop_connection(sock)
+            # Ждем разрыва соединения и завершения потоков
+            with self.condition:
+                self.condition.wait_for(lambda: not self.connected.is_set())
+            self.threads[TH_PROCESS].join()
+            self.threads[TH_SEND].join()
+            with self.condition:
+                self.server_sock = None
+            sock.close()
+            printf('Соединение с сервером разорвано')
+        printf('Поток соединения с сервером завершен')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,176 @@
+"""Модуль содержит определение класса локального кэша клиента. В кэше
+хранятся фильтры и товары, последние просмотренные оценки и оценки,
+добавленные без соединения с сервером. Кэш позволяет показать данные сразу
+после запуска клиента, не дожидаясь ответа сервера.
+
+Для кэша используется модуль sqlite3 стандартной библиотеки, а не
+SQLAlchemy, чтобы не замедлять запуск клиента."""
+
+import json
+import os
+import sqlite3
+import time
+from utilities import create_key
+from const import *
+
+# Таблицы кэша
+SCHEMA = (
+    # Фильтры и товары (одна строка с id = 1)
+    'CREATE TABLE IF NOT EXISTS catalog (id INTEGER PRIMARY KEY, '
+    'version INTEGER, filters TEXT NOT NULL, products TEXT NOT NULL)',
+    # Оценки товара по фильтру в заданном порядке
+    'CREATE TABLE IF NOT EXISTS ratings (product TEXT NOT NULL, '
+    'filter TEXT NOT NULL, sort TEXT NOT NULL, "order" TEXT NOT NULL, '
+    'version INTEGER NOT NULL, rows TEXT NOT NULL, used REAL NOT NULL, '
+    'PRIMARY KEY (product, filter, sort, "order"))',
+    # Оценки, которые нужно отправить серверу
+    'CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY, '
+    'content TEXT NOT NULL)',
+)
+
+
+def create_cache_name():
+    """Функция создает путь к файлу кэша клиента."""
+
+    DIR_NAME = 'cache'  # имя папки, в которую поместим кэш
+    DIR_PATH = os.path.join(os.getcwd(), DIR_NAME)
+    if not os.path.exists(DIR_PATH):
+        # Если папки для кэша нет, создаем ее
+        os.mkdir(DIR_PATH)
+    CACHE_NAME = 'client.sqlite3'  # имя файла кэша
+    return os.path.join(DIR_PATH, CACHE_NAME)
+
+
+class ClientCache:
+    """Класс локального кэша клиента. Методы класса нужно вызывать из одного
+    потока."""
+
+    def __init__(self, path=None):
+        """Конструктор.
+        :param path: путь к файлу кэша. Если None, то файл создается в папке
+        cache в текущей папке."""
+
+        if path is None:
+            path = create_cache_name()
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        """Метод закрывает файл кэша."""
+
+        self.connection.close()
+
+    def delete_pending(self, pending_ids):
+        """Метод удаляет оценки, отправленные серверу.
+        :param pending_ids: список ID оценок в кэше."""
+
+        with self.connection:
+            self.connection.executemany('DELETE FROM pending WHERE id = ?',
+                                        [(i,) for i in pending_ids])
+
+    def get_catalog(self):
+        """Метод возвращает фильтры и товары из кэша.
+        :return: кортеж (версия, список данных фильтров, список данных
+        товаров) или None, если в кэше их нет."""
+
+        row = self.connection.execute(
+            'SELECT version, filters, products FROM catalog WHERE id = 1'
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), json.loads(row[2])
+
+    def get_pending(self, limit=OFFLINE_BATCH_SIZE):
+        """Метод возвращает оценки, которые нужно отправить серверу, в
+        порядке добавления.
+        :param limit: максимальное количество оценок.
+        :return: список пар (ID оценки в кэше, данные оценки для запроса
+        ADD_RATING)."""
+
+        rows = self.connection.execute(
+            'SELECT id, content FROM pending ORDER BY id LIMIT ?', (limit,))
+        return [(pending_id, json.loads(content))
+                for pending_id, content in rows]
+
+    def get_ratings(self, product_name, filter_name, sort, order):
+        """Метод возвращает оценки товара по фильтру из кэша.
+        :param product_name: название товара;
+        :param filter_name: название фильтра;
+        :param sort: поле сортировки;
+        :param order: направление сортировки.
+        :return: пара (версия, список оценок в компактном виде) или None,
+        если в кэше их нет."""
+
+        row = self.connection.execute(
+            'SELECT version, rows FROM ratings WHERE product = ? AND '
+            'filter = ? AND sort = ? AND "order" = ?',
+            (product_name, filter_name, sort, order)).fetchone()
+        if row is None:
+            return None
+        # Отмечаем, что оценки недавно просматривались
+        with self.connection:
+            self.connection.execute(
+                'UPDATE ratings SET used = ? WHERE product = ? AND '
+                'filter = ? AND sort = ? AND "order" = ?',
+                (time.time(), product_name, filter_name, sort, order))
+        return row[0], json.loads(row[1])
+
+    def has_ratings(self, product_name, filter_name, sort, order):
+        """Метод проверяет, есть ли в кэше оценки товара по фильтру. В
+        отличие от метода get_ratings оценки не отмечаются просмотренными.
+        :param product_name: название товара;
+        :param filter_name: название фильтра;
+        :param sort: поле сортировки;
+        :param order: направление сортировки.
+        :return: True, если оценки есть в кэше."""
+
+        return self.connection.execute(
+            'SELECT 1 FROM ratings WHERE product = ? AND filter = ? AND '
+            'sort = ? AND "order" = ?',
+            (product_name, filter_name, sort, order)).fetchone() is not None
+
+    def queue_rating(self, content):
+        """Метод сохраняет оценку, которую нужно отправить серверу, когда
+        появится соединение. Ключ идемпотентности сохраняется вместе с
+        оценкой, поэтому повторная отправка оценки не добавит ее на сервере
+        второй раз.
+        :param content: данные оценки для запроса ADD_RATING."""
+
+        content.setdefault(IDEMPOTENCY_KEY, create_key())
+        with self.connection:
+            self.connection.execute('INSERT INTO pending (content) VALUES (?)',
+                                    (json.dumps(content),))
+
+    def save_catalog(self, version, filters, products):
+        """Метод сохраняет фильтры и товары в кэше.
+        :param version: версия фильтров и товаров;
+        :param filters: список данных фильтров;
+        :param products: список данных товаров."""
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO catalog VALUES (1, ?, ?, ?)',
+                (version, json.dumps(filters), json.dumps(products)))
+
+    def save_ratings(self, product_name, filter_name, sort, order, version,
+                     rows):
+        """Метод сохраняет оценки товара по фильтру в кэше. В кэше остаются
+        оценки CACHED_RATING_SETS последних просмотренных наборов.
+        :param product_name: название товара;
+        :param filter_name: название фильтра;
+        :param sort: поле сортировки;
+        :param order: направление сортировки;
+        :param version: версия оценок;
+        :param rows: список оценок в компактном виде (сохраняются первые
+        CACHED_RATINGS оценок)."""
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (product_name, filter_name, sort, order, version,
+                 json.dumps(rows[:CACHED_RATINGS]), time.time()))
+            self.connection.execute(
+                'DELETE FROM ratings WHERE rowid NOT IN (SELECT rowid FROM '
+                'ratings ORDER BY used DESC LIMIT ?)', (CACHED_RATING_SETS,))
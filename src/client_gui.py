@@ -3,14 +3,34 @@
 
 import os
 import sys
+from array import array
 from datetime import datetime
 import PyQt5.QtWidgets as qt
-from PyQt5.QtCore import QRegExp, Qt, QObject, pyqtSignal, QEvent
+from PyQt5.QtCore import (QAbstractTableModel, QEvent, QModelIndex, QObject,
+                          QRegExp, Qt, QTimer, pyqtSignal)
 from PyQt5.QtGui import QIcon, QDoubleValidator, QRegExpValidator
 import const as cn
 from client import Client
+from client_cache import ClientCache
 from utilities import *
 
+# Столбцы таблицы с оценками в порядке пунктов выпадающего списка с полями
+# сортировки
+SORT_COLUMNS = (2, 1, 0)
+# Идентификатор запроса с оценками, сохраненными без соединения
+PENDING_REQUEST_ID = 'pending'
+# Начало идентификаторов запросов оценок соседних товаров
+PREFETCH_REQUEST_ID = 'prefetch'
+
+
+def get_retry_delay(msg):
+    """Функция определяет, через сколько миллисекунд можно повторить
+    запрос, отклоненный сервером из-за слишком частых запросов.
+    :param msg: ответ сервера со статусом 429.
+    :return: время в миллисекундах."""
+
+    return int(1000 * msg.get(cn.RETRY_AFTER, cn.OVERLOAD_RETRY_AFTER))
+
 
 class Filter_dialog(qt.QDialog):
     """Класс для диалогового окна для ввода данных о новом фильте."""
@@ -49,25 +69,295 @@ class Filter_dialog(qt.QDialog):
         self.setLayout(vbox)
 
 
+class Ratings_model(QAbstractTableModel):
+    """Класс модели таблицы с оценками товара. Оценки хранятся по столбцам и
+    запрашиваются у сервера страницами по мере прокрутки таблицы."""
+
+    # Заголовки столбцов и соответствующие им поля сортировки
+    HEADERS = ('Адрес', 'Дата', 'Оценка')
+    SORT_KEYS = (cn.ADDRESS, cn.DATE, cn.RATING)
+
+    def __init__(self, name, send, cache=None, parent=None):
+        """Конструктор.
+        :param name: название модели, используется в идентификаторах
+        запросов;
+        :param send: функция для отправки запроса на сервер;
+        :param cache: локальный кэш клиента. Если None, то оценки не
+        кэшируются;
+        :param parent: родительский объект."""
+
+        super().__init__(parent)
+        self.name = name
+        self.send = send
+        self.cache = cache
+        # Параметры запроса оценок: товар и фильтр
+        self.query = None
+        # Поле и направление сортировки
+        self.sort_key = cn.RATING
+        self.order = cn.ASC
+        # Идентификатор запроса, ответ на который ожидается, и счетчик
+        # запросов
+        self.request_id = None
+        self.counter = 0
+        # Параметры последнего запроса страницы: номер первой оценки и
+        # версия
+        self.requested = None
+        # Признак того, что все оценки получены
+        self.exhausted = True
+        # Версия оценок, которые есть в модели. Если None, то оценки нельзя
+        # проверить на актуальность по версии и при загрузке они
+        # запрашиваются заново
+        self.version = None
+        self.clear_columns()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        """Метод определяет, можно ли запросить у сервера следующую страницу
+        оценок."""
+
+        return (not parent.isValid() and self.query is not None and
+                not self.exhausted and self.request_id is None)
+
+    def add_rows(self, rows):
+        """Метод добавляет оценки в конец столбцов модели.
+        :param rows: список оценок в компактном виде - списков значений
+        полей RATING_COLUMNS."""
+
+        for rating_id, address, rating, date in rows:
+            self.ids.append(rating_id)
+            self.ratings.append(rating)
+            self.addresses.append(address)
+            self.dates.append(date)
+
+    def clear_columns(self):
+        """Метод удаляет все оценки из модели."""
+
+        self.ids = array('q')
+        self.ratings = array('d')
+        self.addresses = []
+        self.dates = []
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Метод возвращает значение ячейки таблицы."""
+
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        row = index.row()
+        column = index.column()
+        if column == 0:
+            return self.addresses[row]
+        if column == 1:
+            return self.dates[row]
+        return str(self.ratings[row])
+
+    def fetchMore(self, parent=QModelIndex()):
+        """Метод запрашивает у сервера следующую страницу оценок."""
+
+        if not self.canFetchMore(parent):
+            return
+        self.request_page(len(self.ids))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def load(self, product_name, filter_name, refresh=False):
+        """Метод очищает модель и запрашивает первую страницу оценок товара
+        по фильтру. Если в модели или в кэше уже есть оценки этого товара по
+        этому фильтру, то они сразу показываются, а у сервера запрашивается
+        первая страница с версией имеющихся оценок. Если оценки не
+        изменились, сервер ответит коротким сообщением со статусом 304.
+        :param product_name: название товара;
+        :param filter_name: название фильтра;
+        :param refresh: если False, то оценки не запрашиваются, когда ответ
+        на запрос оценок этого товара по этому фильтру еще не получен. Если
+        True, то оценки запрашиваются в любом случае (например, после
+        добавления оценки ответ на прежний запрос может быть устаревшим)."""
+
+        query = {cn.PRODUCT: product_name, cn.FILTER: filter_name}
+        if query == self.query and self.request_id is not None and \
+                not refresh:
+            # Оценки уже запрошены
+            return
+        if query == self.query and self.version is not None:
+            self.request_page(0, self.version)
+            return
+        self.version = None
+        self.beginResetModel()
+        self.clear_columns()
+        self.query = query
+        # Ответы на уже отправленные запросы больше не нужны
+        self.request_id = None
+        self.exhausted = False
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get_ratings(product_name, filter_name,
+                                            self.sort_key, self.order)
+        if cached is not None:
+            # Показываем оценки из кэша, пока сервер их проверяет
+            self.version, rows = cached
+            self.add_rows(rows)
+            self.exhausted = len(rows) < cn.RATINGS_PAGE_SIZE
+        self.endResetModel()
+        if self.version is None:
+            self.fetchMore()
+        else:
+            self.request_page(0, self.version)
+
+    def process_page(self, msg):
+        """Метод добавляет в модель страницу оценок из ответа сервера.
+        :param msg: сообщение из сервера.
+        :return: True, если ответ предназначен для этой модели."""
+
+        if self.request_id is None or msg.get(cn.REQUEST_ID) != self.request_id:
+            return False
+        self.request_id = None
+        if msg.get(cn.STATUS) == 304:
+            # Оценки в модели не устарели
+            return True
+        if msg.get(cn.STATUS) == 429:
+            # Сервер просит повторить запрос позже. Запрос повторяется, если
+            # после него модель не отправляла других запросов
+            counter = self.counter
+            offset, version = self.requested
+
+            def retry():
+                if self.counter == counter:
+                    self.request_page(offset, version)
+
+            QTimer.singleShot(get_retry_delay(msg), retry)
+            return True
+        rows = msg.get(cn.CONTENT) if msg.get(cn.STATUS) == 200 else []
+        if msg.get(cn.OFFSET, 0) == 0:
+            if len(self.ids):
+                # Оценки изменились, заменяем старые оценки новыми
+                self.beginResetModel()
+                self.clear_columns()
+                self.endResetModel()
+            self.version = msg.get(cn.VERSION)
+        elif msg.get(cn.VERSION) != self.version:
+            # Оценки изменились, пока модель получала их по страницам
+            self.version = None
+        self.exhausted = len(rows) < cn.RATINGS_PAGE_SIZE
+        if rows:
+            n = len(self.ids)
+            self.beginInsertRows(QModelIndex(), n, n + len(rows) - 1)
+            # Оценки приходят в компактном виде - списками значений полей
+            # RATING_COLUMNS
+            self.add_rows(rows)
+            self.endInsertRows()
+            if (self.cache is not None and self.version is not None and
+                    n < cn.CACHED_RATINGS):
+                self.save_to_cache()
+        return True
+
+    def reload(self):
+        """Метод заново запрашивает оценки с первой страницы."""
+
+        if self.query is not None:
+            self.load(self.query[cn.PRODUCT], self.query[cn.FILTER], True)
+
+    def request_page(self, offset, version=None):
+        """Метод отправляет серверу запрос страницы оценок.
+        :param offset: номер первой оценки страницы;
+        :param version: версия оценок, которые есть в модели. Если None, то
+        страница запрашивается без проверки версии."""
+
+        self.counter += 1
+        self.request_id = f'{self.name}:{self.counter}'
+        self.requested = offset, version
+        content = dict(self.query)
+        content.update({cn.SORT: self.sort_key, cn.ORDER: self.order,
+                        cn.LIMIT: cn.RATINGS_PAGE_SIZE, cn.OFFSET: offset,
+                        cn.COMPACT: True})
+        if version is not None:
+            content[cn.IF_VERSION] = version
+        self.send({cn.ACTION: cn.GET_RATINGS, cn.REQUEST_ID: self.request_id,
+                   cn.CONTENT: content})
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def save_to_cache(self):
+        """Метод сохраняет первые оценки модели в локальном кэше."""
+
+        n = min(len(self.ids), cn.CACHED_RATINGS)
+        rows = list(zip(self.ids[:n], self.addresses[:n], self.ratings[:n],
+                        self.dates[:n]))
+        self.cache.save_ratings(self.query[cn.PRODUCT], self.query[cn.FILTER],
+                                self.sort_key, self.order, self.version, rows)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Метод задает сортировку оценок и запрашивает их у сервера заново.
+        :param column: столбец, по которому сортируются оценки;
+        :param order: направление сортировки."""
+
+        sort_key = self.SORT_KEYS[column]
+        order = cn.ASC if order == Qt.AscendingOrder else cn.DESC
+        if sort_key == self.sort_key and order == self.order:
+            return
+        self.sort_key = sort_key
+        self.order = order
+        # Оценки нужны в другом порядке, поэтому версия имеющихся оценок не
+        # поможет
+        self.version = None
+        self.reload()
+
+
 class Window(qt.QMainWindow):
     """Класс окна клиента с графическим интерфейсом."""
 
-    # Сигнал для связи с объектом типа Client для обмена данными
+    # Сигналы для связи с объектом типа Client для обмена данными. Сигнал
+    # signal_to_receive испускается в потоке чтения сообщений клиента, а
+    # обрабатывается в главном потоке окна
     signal_to_send = pyqtSignal(dict)
+    signal_to_receive = pyqtSignal(dict)
+    # Сигнал об установлении соединения с сервером
+    signal_connected = pyqtSignal()
 
-    def __init__(self, client):
+    def __init__(self, client, cache=None):
         """Конструктор.
-        :param client: ссылка на объект для чтения/отправки сообщений."""
+        :param client: ссылка на объект для чтения/отправки сообщений;
+        :param cache: локальный кэш клиента. Если None, то используется кэш
+        в папке cache в текущей папке."""
 
         super().__init__()
+        self.client = client
+        self.cache = cache if cache is not None else ClientCache()
+        # Таймер для запроса оценок после того, как выбранные товар и фильтр
+        # перестанут меняться
+        self.ratings_timer = QTimer(self)
+        self.ratings_timer.setSingleShot(True)
+        self.ratings_timer.setInterval(cn.RATINGS_DEBOUNCE_INTERVAL)
+        self.ratings_timer.timeout.connect(self.get_ratings)
+        # Наборы оценок соседних товаров, которые уже запрашивались, - кортежи
+        # (товар, фильтр, поле сортировки, направление сортировки), словарь
+        # идентификатор запроса -> (поле сортировки, направление сортировки)
+        # и счетчик запросов
+        self.prefetched = set()
+        self.prefetch_requests = {}
+        self.prefetch_counter = 0
         self.init_ui()
         # Связываем взаимно сигналы
         self.signal_to_send.connect(client.create_msg)
-        client.signal_to_send.connect(self.process_data)
+        self.signal_to_receive.connect(self.process_data)
+        self.signal_connected.connect(self.process_connect)
+        client.on_message = self.signal_to_receive.emit
+        client.on_connect = self.signal_connected.emit
         # Задаем всем атрибутам окна исходные значения
         self.set_to_default()
+        if self.catalog_version is not None:
+            # Показываем фильтры и товары из кэша, пока сервер их проверяет
+            self.render_filters()
+            self.render_products()
         # Запрос на получение товаров и фильтров
-        self.signal_to_send.emit({cn.ACTION: cn.GET_FILTERS_AND_PRODUCTS})
+        self.get_filters_and_products()
+        if client.connected.is_set():
+            # Соединение установлено раньше, чем создано окно
+            self.send_pending()
 
     def add_filter(self):
         """Метод выполняется для добавления нового фильтра."""
@@ -131,8 +421,9 @@ class Window(qt.QMainWindow):
                 # Выбран пункт Другой товар
                 self.add_product()
                 return
-        # Получаем рейтинг товара по фильтру
-        self.get_ratings()
+        # Рейтинг товара по фильтру запрашивается, когда выбранные товар и
+        # фильтр перестанут меняться
+        self.ratings_timer.start()
 
     def check_rating(self):
         """Метод проверяет значение, введенное в поле оценки товара."""
@@ -171,27 +462,64 @@ class Window(qt.QMainWindow):
                                  'Нужно заполнить все поля')
             return
         # Формируем запрос
-        msg = {cn.ACTION: cn.ADD_RATING,
-               cn.CONTENT: {cn.PRODUCT: product,
-                            cn.FILTER: filter,
-                            cn.ADDRESS: address,
-                            cn.RATING: rating,
-                            cn.DATE: get_time()}}
+        content = {cn.PRODUCT: product,
+                   cn.FILTER: filter,
+                   cn.ADDRESS: address,
+                   cn.RATING: rating,
+                   cn.DATE: get_time()}
+        if not self.client.connected.is_set():
+            # Соединения нет, сохраняем оценку, чтобы отправить ее позже
+            self.cache.queue_rating(content)
+            qt.QMessageBox.about(self, 'Информация',
+                                 'Нет соединения с сервером. Оценка будет '
+                                 'отправлена, когда соединение появится')
+            return
+        self.signal_to_send.emit({cn.ACTION: cn.ADD_RATING,
+                                  cn.CONTENT: content})
+
+    def fill_combobox(self, combobox, items, other=False):
+        """Метод заменяет пункты выпадающего списка, не испуская сигналов об
+        изменении выбранного пункта. Если выбранный пункт есть среди новых
+        пунктов, то он остается выбранным.
+        :param combobox: выпадающий список;
+        :param items: названия пунктов;
+        :param other: если True, то в конец списка добавляется пункт
+        Другой."""
+
+        text = combobox.currentText()
+        combobox.blockSignals(True)
+        combobox.clear()
+        combobox.addItems(items)
+        if other:
+            combobox.addItem('Другой')
+        combobox.setCurrentIndex(items.index(text) if text in items else 0)
+        combobox.blockSignals(False)
+
+    def get_filters_and_products(self):
+        """Метод запрашивает у сервера фильтры и товары. Если они уже были
+        получены, то в запросе передается их версия, и сервер пришлет их
+        заново, только если они изменились."""
+
+        msg = {cn.ACTION: cn.GET_FILTERS_AND_PRODUCTS}
+        if self.catalog_version is not None:
+            msg[cn.CONTENT] = {cn.IF_VERSION: self.catalog_version}
         self.signal_to_send.emit(msg)
 
     def get_ratings(self):
-        """Метод отправляет запрос для получения рейтинга товара по фильтру."""
+        """Метод отправляет запрос для получения рейтинга товара по фильтру и
+        загружает в кэш оценки соседних товаров."""
 
         if self.stacked_layout.currentIndex() == 0:
-            product_name = self.wnd_0_products.currentText()
-            filter_name = self.wnd_0_filters.currentText()
+            model, products, filters = (self.wnd_0_model, self.wnd_0_products,
+                                        self.wnd_0_filters)
         else:
-            product_name = self.wnd_1_products.currentText()
-            filter_name = self.wnd_1_filters.currentText()
-        msg = {cn.ACTION: cn.GET_RATINGS,
-               cn.CONTENT: {cn.PRODUCT: product_name,
-                            cn.FILTER: filter_name}}
-        self.signal_to_send.emit(msg)
+            model, products, filters = (self.wnd_1_model, self.wnd_1_products,
+                                        self.wnd_1_filters)
+        if not products.currentText() or not filters.currentText():
+            # Фильтры и товары еще не получены
+            return
+        model.load(products.currentText(), filters.currentText())
+        self.prefetch(model, products.currentIndex(), filters.currentText())
 
     def init_menu(self):
         """Метод создает меню и панель инструментов."""
@@ -293,15 +621,25 @@ class Window(qt.QMainWindow):
         self.wnd_0_sorting.addItems(['По возрастанию', 'По убыванию'])
         self.wnd_0_sorting.currentIndexChanged.connect(self.sort)
         form.addRow('Сотировать', self.wnd_0_sorting)
+        # Поле, по которому сортируются оценки
+        self.wnd_0_sort_key = qt.QComboBox()
+        self.wnd_0_sort_key.setStyleSheet('background-color: white;')
+        self.wnd_0_sort_key.addItems(['Оценка', 'Дата', 'Адрес'])
+        self.wnd_0_sort_key.currentIndexChanged.connect(self.sort)
+        form.addRow('Сортировать по', self.wnd_0_sort_key)
         # Помещаем в группу
         group = qt.QGroupBox('Выберите товар и фильтр')
         group.setLayout(form)
-        # Добавляем таблицу
-        self.wnd_0_tbl = qt.QTableWidget()
-        self.wnd_0_tbl.setColumnCount(3)
-        self.wnd_0_tbl.setRowCount(0)
+        # Добавляем таблицу, сортировка по столбцу выполняется сервером
+        self.wnd_0_model = Ratings_model('wnd_0', self.signal_to_send.emit,
+                                         self.cache, self)
+        self.wnd_0_tbl = qt.QTableView()
+        self.wnd_0_tbl.setModel(self.wnd_0_model)
         self.wnd_0_tbl.setStyleSheet('background-color: white;')
-        self.wnd_0_tbl.setHorizontalHeaderLabels(['Адрес', 'Дата', 'Оценка'])
+        self.wnd_0_tbl.setSortingEnabled(True)
+        self.wnd_0_tbl.sortByColumn(2, Qt.AscendingOrder)
+        self.wnd_0_tbl.horizontalHeader().sortIndicatorChanged.connect(
+            self.sync_sorting)
         for i in range(3):
             self.wnd_0_tbl.horizontalHeader().setSectionResizeMode(
                 i, qt.QHeaderView.Stretch)
@@ -349,11 +687,11 @@ class Window(qt.QMainWindow):
         group = qt.QGroupBox('Оцените товар')
         group.setLayout(form)
         # Добавляем таблицу
-        self.wnd_1_tbl = qt.QTableWidget()
-        self.wnd_1_tbl.setColumnCount(3)
-        self.wnd_1_tbl.setRowCount(0)
+        self.wnd_1_model = Ratings_model('wnd_1', self.signal_to_send.emit,
+                                         self.cache, self)
+        self.wnd_1_tbl = qt.QTableView()
+        self.wnd_1_tbl.setModel(self.wnd_1_model)
         self.wnd_1_tbl.setStyleSheet('background-color: white;')
-        self.wnd_1_tbl.setHorizontalHeaderLabels(['Адрес', 'Дата', 'Оценка'])
         for i in range(3):
             self.wnd_1_tbl.horizontalHeader().setSectionResizeMode(
                 i, qt.QHeaderView.Stretch)
@@ -389,12 +727,47 @@ class Window(qt.QMainWindow):
         """Метод обрабатывает ответ на добавление оценки товара.
         :param msg: сообщение из сервера."""
 
+        if msg.get(cn.REQUEST_ID) == PENDING_REQUEST_ID:
+            if self.pending_ids is None:
+                # Ответ на оценки, отправленные до разрыва соединения
+                return
+            if msg.get(cn.STATUS) == 429:
+                # Сервер просит отправить оценки позже
+                self.pending_ids = None
+                QTimer.singleShot(get_retry_delay(msg), self.send_pending)
+                return
+            # Ответ на отправку оценок, сохраненных без соединения. Сервер
+            # их обработал, поэтому из кэша они удаляются
+            self.cache.delete_pending(self.pending_ids)
+            self.pending_ids = None
+            self.wnd_0_model.reload()
+            self.wnd_1_model.reload()
+            # Отправляем следующие сохраненные оценки
+            return self.send_pending()
+        if msg.get(cn.STATUS) == 429:
+            # Клиент отправляет оценки слишком часто
+            qt.QMessageBox.about(self, 'Информация',
+                                 'Сервер перегружен. Оценка не сохранена, '
+                                 'повторите позже')
+            return
         if msg.get(cn.STATUS) != 200:
             # Оценка не была добавлена
             qt.QMessageBox.about(self, 'Информация', f'Оценка не сохранена')
             return
-        self.ratings = msg.get(cn.CONTENT)
-        self.render_ratings(self.wnd_1_tbl, self.ratings)
+        # Запрашиваем первую страницу оценок заново
+        self.wnd_1_model.reload()
+
+    def process_connect(self):
+        """Метод выполняется при каждом установлении соединения с сервером.
+        Метод проверяет, не изменились ли фильтры, товары и показанные
+        оценки, и отправляет оценки, сохраненные без соединения."""
+
+        # Оценки, отправленные до разрыва соединения, клиент отправит заново
+        # сам, поэтому новые оценки отправляются только после ответа на них
+        self.get_filters_and_products()
+        self.wnd_0_model.reload()
+        self.wnd_1_model.reload()
+        self.send_pending()
 
     def process_data(self, msg):
         """Метод обрабатывает сообщения, пришедшие из сервера.
@@ -413,66 +786,131 @@ class Window(qt.QMainWindow):
         if action == cn.GET_RATINGS:
             # Обрабатываем ответ на получение рейтинга товара
             return self.process_get_ratings(msg)
+        if action == cn.GET_RATINGS_BATCH:
+            # Обрабатываем ответ с оценками соседних товаров
+            return self.process_get_ratings_batch(msg)
 
     def process_get_filters_and_products(self, msg):
         """Метод обрабатывает ответ на получение фильтров и товаров.
         :param msg: сообщение из сервера."""
 
+        if msg.get(cn.STATUS) == 429:
+            # Сервер просит повторить запрос позже
+            QTimer.singleShot(get_retry_delay(msg),
+                              self.get_filters_and_products)
+            return
         if msg.get(cn.STATUS) != 200:
+            # При статусе 304 фильтры и товары не изменились
             return
         # Запрос обработан
+        self.catalog_version = msg.get(cn.VERSION)
         content = msg.get(cn.CONTENT, {})
         self.filters = content.get(cn.FILTER)
         self.products = content.get(cn.PRODUCT)
+        self.cache.save_catalog(self.catalog_version, self.filters,
+                                self.products)
         self.render_filters()
         self.render_products()
 
+    def process_get_ratings_batch(self, msg):
+        """Метод сохраняет в кэше оценки соседних товаров.
+        :param msg: сообщение из сервера."""
+
+        sorting = self.prefetch_requests.pop(msg.get(cn.REQUEST_ID), None)
+        if sorting is None or msg.get(cn.STATUS) != 200:
+            # При статусе 429 оценки не запрашиваются повторно: они нужны
+            # только для ускорения переключения товаров
+            return
+        for item in msg.get(cn.CONTENT, []):
+            if item.get(cn.STATUS) == 200 and item.get(cn.VERSION) is not None:
+                self.cache.save_ratings(item[cn.PRODUCT], item[cn.FILTER],
+                                        *sorting, item[cn.VERSION],
+                                        item[cn.CONTENT])
+
     def process_get_ratings(self, msg):
         """Метод обрабатывает ответ на получение рейтинга товара.
         :param msg: сообщение из сервера."""
 
-        if msg.get(cn.STATUS) != 200:
-            self.wnd_0_tbl.setRowCount(0)
-            self.ratings = []
+        # Передаем страницу оценок модели, которая ее запрашивала
+        for model in (self.wnd_0_model, self.wnd_1_model):
+            if model.process_page(msg):
+                return
+
+    def prefetch(self, model, i, filter_name):
+        """Метод одним запросом загружает в кэш первую страницу оценок
+        товаров, соседних с выбранным в выпадающем списке, чтобы при выборе
+        соседнего товара оценки были показаны сразу. Оценки каждого товара
+        запрашиваются не больше одного раза и только если их нет в кэше.
+        Потом при выборе товара сервер только проверит их версию.
+        :param model: модель таблицы, в которой показываются оценки;
+        :param i: номер выбранного товара;
+        :param filter_name: название выбранного фильтра."""
+
+        if not self.client.connected.is_set():
             return
-        # Запрос обработан
-        self.ratings = msg.get(cn.CONTENT)
-        self.sort()
+        items = []
+        for j in range(i - cn.PREFETCH_NEIGHBOURS,
+                       i + cn.PREFETCH_NEIGHBOURS + 1):
+            if j == i or not 0 <= j < len(self.products):
+                continue
+            product_name = self.products[j][cn.PRODUCT]
+            key = product_name, filter_name, model.sort_key, model.order
+            if key in self.prefetched or self.cache.has_ratings(*key):
+                continue
+            self.prefetched.add(key)
+            items.append({cn.PRODUCT: product_name, cn.FILTER: filter_name})
+        if not items:
+            return
+        self.prefetch_counter += 1
+        request_id = f'{PREFETCH_REQUEST_ID}:{self.prefetch_counter}'
+        self.prefetch_requests[request_id] = model.sort_key, model.order
+        self.signal_to_send.emit(
+            {cn.ACTION: cn.GET_RATINGS_BATCH, cn.REQUEST_ID: request_id,
+             cn.CONTENT: {cn.ITEMS: items, cn.SORT: model.sort_key,
+                          cn.ORDER: model.order,
+                          cn.LIMIT: cn.RATINGS_PAGE_SIZE, cn.COMPACT: True}})
 
     def render_filters(self):
-        """Метод перерисовывает выпадающие списки с фильтрами."""
+        """Метод перерисовывает выпадающие списки с фильтрами. Оценки
+        запрашиваются один раз после перерисовки, а не при каждом изменении
+        выбранного пункта."""
 
         items = [filter[cn.FILTER] for filter in self.filters]
         # Выпадающий список на странице показа рейтинга товара
-        self.wnd_0_filters.clear()
-        self.wnd_0_filters.addItems(items)
+        self.fill_combobox(self.wnd_0_filters, items)
         # Выпадающий список на странице оценивания товара
-        self.wnd_1_filters.clear()
-        self.wnd_1_filters.addItems(items)
-        self.wnd_1_filters.addItem('Другой')
+        self.fill_combobox(self.wnd_1_filters, items, True)
+        self.check_rating()
+        self.ratings_timer.start()
 
     def render_products(self):
-        """Метод перерисовывает выпадающие списки с товарами."""
+        """Метод перерисовывает выпадающие списки с товарами. Оценки
+        запрашиваются один раз после перерисовки, а не при каждом изменении
+        выбранного пункта."""
 
         items = [product[cn.PRODUCT] for product in self.products]
         # Выпадающий список на странице показа рейтинга товара
-        self.wnd_0_products.clear()
-        self.wnd_0_products.addItems(items)
+        self.fill_combobox(self.wnd_0_products, items)
         # Выпадающий список на странице оценивания товара
-        self.wnd_1_products.clear()
-        self.wnd_1_products.addItems(items)
-        self.wnd_1_products.addItem('Другой')
+        self.fill_combobox(self.wnd_1_products, items, True)
+        self.ratings_timer.start()
 
-    def render_ratings(self, tbl, data):
-        """Метод перерисовывает таблицы с оценками.
-        :patam tbl: таблица;
-        :param data: данные, которые нужно отобразить в таблице."""
+    def send_pending(self):
+        """Метод отправляет серверу одним запросом до OFFLINE_BATCH_SIZE
+        оценок, сохраненных без соединения. Следующие оценки отправляются
+        после ответа сервера."""
 
-        tbl.setRowCount(len(data))
-        for row, item in enumerate(data):
-            tbl.setItem(row, 0, qt.QTableWidgetItem(item[cn.ADDRESS]))
-            tbl.setItem(row, 1, qt.QTableWidgetItem(item[cn.DATE]))
-            tbl.setItem(row, 2, qt.QTableWidgetItem(str(item[cn.RATING])))
+        if self.pending_ids is not None:
+            # Ответ на предыдущие оценки еще не получен
+            return
+        pending = self.cache.get_pending(cn.OFFLINE_BATCH_SIZE)
+        if not pending:
+            return
+        self.pending_ids = [pending_id for pending_id, _ in pending]
+        self.signal_to_send.emit({cn.ACTION: cn.ADD_RATING,
+                                  cn.REQUEST_ID: PENDING_REQUEST_ID,
+                                  cn.CONTENT: [content for _, content in
+                                               pending]})
 
     def set_to_default(self):
         """Метод задает всем атрибутам исходные значения."""
@@ -481,8 +919,15 @@ class Window(qt.QMainWindow):
         self.filters = []
         # Список с товарами
         self.products = []
-        # Список с оценками
-        self.ratings = []
+        # Версия полученных фильтров и товаров
+        self.catalog_version = None
+        # Фильтры и товары из кэша
+        cached = self.cache.get_catalog()
+        if cached is not None:
+            self.catalog_version, self.filters, self.products = cached
+        # ID в кэше оценок, отправленных серверу, ответ на которые еще не
+        # получен
+        self.pending_ids = None
 
     def show_info(self):
         """Метод выводит окно с краткой информацией о программе."""
@@ -492,15 +937,29 @@ class Window(qt.QMainWindow):
         qt.QMessageBox.about(self, 'Информация', info)
 
     def sort(self):
-        """Метод сортирует рейтинг по возрастанию или убыванию."""
+        """Метод сортирует рейтинг по выбранному полю по возрастанию или
+        убыванию."""
 
+        column = SORT_COLUMNS[self.wnd_0_sort_key.currentIndex()]
         if self.wnd_0_sorting.currentText() == 'По возрастанию':
-            reverse = False
-            data = self.ratings
+            order = Qt.AscendingOrder
         else:
-            data = sorted(
-                self.ratings, key=lambda x: x[cn.RATING], reverse=True)
-        self.render_ratings(self.wnd_0_tbl, data)
+            order = Qt.DescendingOrder
+        # Модель таблицы запросит отсортированные оценки у сервера
+        self.wnd_0_tbl.sortByColumn(column, order)
+
+    def sync_sorting(self, column, order):
+        """Метод обновляет выпадающие списки сортировки при клике по
+        заголовку столбца таблицы.
+        :param column: столбец, по которому сортируются оценки;
+        :param order: направление сортировки."""
+
+        for combobox, i in ((self.wnd_0_sort_key, SORT_COLUMNS.index(column)),
+                            (self.wnd_0_sorting,
+                             int(order == Qt.DescendingOrder))):
+            combobox.blockSignals(True)
+            combobox.setCurrentIndex(i)
+            combobox.blockSignals(False)
 
     def switch_wnd(self):
         """Метод переключает окно при выборе пунктов меню 'Показать рейтинг
@@ -512,10 +971,16 @@ class Window(qt.QMainWindow):
             self.stacked_layout.setCurrentIndex(0)
         elif (self.sender().text() == 'Оценить' and
                 self.stacked_layout.currentIndex() != 1):
-            # Запрашиваем фильтры и товары
-            self.signal_to_send.emit({cn.ACTION: cn.GET_FILTERS_AND_PRODUCTS})
+            # Проверяем, не изменились ли фильтры и товары
+            self.get_filters_and_products()
             # Переключаем на окно с оцениванием товара
             self.stacked_layout.setCurrentIndex(1)
+        else:
+            return
+        # Загружаем оценки для открытого окна. Если фильтры и товары не
+        # изменились, сервер отвечает статусом 304, и оценки больше ничем
+        # не загружаются
+        self.ratings_timer.start()
 
 
 if __name__ == '__main__':
@@ -527,4 +992,7 @@ if __name__ == '__main__':
     app = qt.QApplication(sys.argv)
     w = Window(client)
 
-    sys.exit(app.exec_())
+    code = app.exec_()
+    # Закрываем соединение, чтобы потоки клиента не мешали завершению
+    client.close()
+    sys.exit(code)
@@ -0,0 +1,141 @@
+"""Модуль содержит определение классов для учета соединений клиентов с
+сервером. Параметры соединения (адрес клиента, способ сжатия сообщений,
+время последней активности) запоминаются при подключении, чтобы не
+запрашивать их у сокета при каждом сообщении."""
+
+import socket
+from const import *
+
+
+class Connection:
+    """Класс состояния соединения с клиентом."""
+
+    __slots__ = ('sock', 'fd', 'address', 'ip', 'name', 'codec',
+                 'connected_at', 'active_at', 'serial')
+
+    def __init__(self, sock, address, now, serial=0):
+        """Конструктор.
+        :param sock: сокет клиента;
+        :param address: адрес клиента (IP адрес и порт);
+        :param now: текущее время по time.monotonic();
+        :param serial: порядковый номер соединения."""
+
+        self.sock = sock
+        # Порядковый номер соединения. В отличие от номера файлового
+        # дескриптора, не повторяется после закрытия соединения
+        self.serial = serial
+        # Номер файлового дескриптора сокета. Запоминается, потому что
+        # после закрытия сокета fileno() возвращает -1
+        self.fd = sock.fileno()
+        self.address = address
+        self.ip = address[0]
+        # Адрес клиента для вывода в журнал
+        self.name = str(address)
+        # Способ сжатия сообщений для клиента
+        self.codec = None
+        self.connected_at = now
+        # Время последнего сообщения от клиента или клиенту
+        self.active_at = now
+
+
+class ConnectionRegistry:
+    """Класс для учета соединений с клиентами. Соединения можно найти по
+    сокету (номеру файлового дескриптора) и по адресу клиента. Соединения
+    хранятся в порядке последней активности, поэтому для поиска простаивающих
+    соединений не нужно просматривать все соединения."""
+
+    def __init__(self):
+        """Конструктор."""
+
+        # Словарь номер файлового дескриптора -> соединение. Соединение, у
+        # которого была активность, перемещается в конец словаря
+        self.by_fd = {}
+        # Словарь адрес клиента -> соединение
+        self.by_address = {}
+        # Количество зарегистрированных соединений
+        self.added = 0
+
+    def __len__(self):
+        return len(self.by_fd)
+
+    def add(self, sock, address, now):
+        """Метод регистрирует новое соединение. Для сокета включается
+        проверка соединения (TCP keepalive), чтобы соединение с пропавшим
+        клиентом было закрыто, даже если клиент не присылает сообщений.
+        :param sock: сокет клиента;
+        :param address: адрес клиента (IP адрес и порт);
+        :param now: текущее время.
+        :return: объект Connection."""
+
+        set_keepalive(sock)
+        self.added += 1
+        connection = Connection(sock, address, now, self.added)
+        self.by_fd[connection.fd] = connection
+        self.by_address[address] = connection
+        return connection
+
+    def find(self, address):
+        """Метод находит соединение по адресу клиента.
+        :param address: адрес клиента (IP адрес и порт).
+        :return: объект Connection или None, если соединения нет."""
+
+        return self.by_address.get(address)
+
+    def get(self, sock):
+        """Метод находит соединение по сокету.
+        :param sock: сокет клиента.
+        :return: объект Connection или None, если соединения нет."""
+
+        connection = self.by_fd.get(sock.fileno())
+        if connection is None or connection.sock is not sock:
+            return None
+        return connection
+
+    def get_idle(self, now, timeout):
+        """Метод находит соединения, в которых не было активности дольше
+        timeout секунд.
+        :param now: текущее время;
+        :param timeout: время простоя в секундах.
+        :return: список объектов Connection."""
+
+        idle = []
+        for connection in self.by_fd.values():
+            if now - connection.active_at < timeout:
+                # Остальные соединения были активны еще позже
+                break
+            idle.append(connection)
+        return idle
+
+    def remove(self, connection):
+        """Метод удаляет соединение.
+        :param connection: объект Connection."""
+
+        if self.by_fd.get(connection.fd) is connection:
+            del self.by_fd[connection.fd]
+        if self.by_address.get(connection.address) is connection:
+            del self.by_address[connection.address]
+
+    def touch(self, connection, now):
+        """Метод отмечает активность в соединении.
+        :param connection: объект Connection;
+        :param now: текущее время."""
+
+        connection.active_at = now
+        # Перемещаем соединение в конец словаря
+        del self.by_fd[connection.fd]
+        self.by_fd[connection.fd] = connection
+
+
+def set_keepalive(sock):
+    """Функция включает для сокета проверку соединения (TCP keepalive).
+    Параметры проверки задаются там, где операционная система это
+    позволяет.
+    :param sock: сокет."""
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                          ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_PROBES)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option),
+                            value)
@@ -3,29 +3,116 @@
 # Параметры сетевого соединения
 DEFAULT_PORT = 7777  # порт по умолчанию
 DEFAULT_IP_ADDRESS = '127.0.0.1'  # IP адрес по умолчанию
-MAX_CONNECTIONS = 5  # максимальная очередь подключений
-MAX_PACKAGE_LENGTH = 1024  # максимальная длинна сообщения в байтах
+MAX_CONNECTIONS = 128  # максимальная очередь подключений
+MAX_PACKAGE_LENGTH = 65536  # максимальная длинна запроса в байтах
+MAX_RESPONSE_LENGTH = 16777216  # максимальная длинна ответа в байтах
+# Параметры переподключения клиента к серверу: время ожидания подключения,
+# начальная и максимальная задержка между попытками в секундах. Задержка
+# удваивается после каждой неудачной попытки
+CONNECT_TIMEOUT = 5
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30
+# Максимальное количество отправок запроса на добавление оценок, ответ на
+# который не пришел до разрыва соединения
+MAX_WRITE_ATTEMPTS = 5
 
 # Кодировка проекта
 ENCODING = 'utf-8'
 
+# Параметры сжатия сообщений
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+# Сообщения короче этого размера в байтах не сжимаются
+COMPRESSION_THRESHOLD = 512
+# Уровень сжатия zlib
+COMPRESSION_LEVEL = 6
+
 # Протокол JSON Instant Messaging, основные ключи
 ACTION = 'action'  # тип сообщения
 ADDRESS = 'address'
+ADMITTED = 'admitted'  # количество принятых запросов
+CLIENTS = 'clients'  # количество подключенных клиентов
+COLUMNS = 'columns'  # названия полей в строках ответа в компактном виде
+COMPACT = 'compact'  # признак ответа со строками-списками вместо словарей
+COMPRESSION = 'compression'  # способы сжатия сообщений
 CONTENT = 'content'
+COUNT = 'count'  # количество
 DATE = 'date'
+EDGES = 'edges'  # границы интервалов гистограммы
+ELAPSED = 'elapsed'  # время выполнения в секундах
+ERROR = 'error'  # текст ошибки
 FILTER = 'filter'  # фильтр
+GRANULARITY = 'granularity'  # уровень детализации истории оценок
+HISTOGRAM = 'histogram'  # гистограмма оценок
 ID = 'id'  # идентификатор
+IDEMPOTENCY_KEY = 'idempotency_key'  # ключ для защиты от повторной записи
+IF_VERSION = 'if_version'  # версия данных, которые уже есть у клиента
 IP = 'ip'
+ITEMS = 'items'  # список элементов запроса
+LIMITED = 'limited'  # количество запросов, отклоненных из-за частоты
+LIMIT = 'limit'  # максимальное количество записей в ответе
 MAX = 'max' # максимальное значение оценки
+MEAN = 'mean'  # среднее значение оценки
+MEDIAN = 'median'  # медиана оценок
 MIN = 'min' # минимальное значение оценки
+MONTHS = 'months'  # количество месяцев в интервале истории оценок
+MISSING = 'missing'  # товары, для которых нет данных
+MORE = 'more'  # признак того, что за частью ответа последуют другие части
 MSG = 'msg'
+OFFSET = 'offset'  # смещение первой записи в ответе
+ORDER = 'order'  # направление сортировки
+SINCE = 'since'  # начало периода времени
+SINGLE = 'single'  # покупка в одном магазине
+UNTIL = 'until'  # конец периода времени
+P10 = 'p10'  # 10-й перцентиль оценок
+OVERLOADED = 'overloaded'  # количество запросов, отклоненных из-за очереди
+P99_BEFORE = 'p99_before'  # 99-й перцентиль времени обработки до
+P99_DURING = 'p99_during'  # и во время резервного копирования
+PAGES = 'pages'  # количество страниц базы данных
+PATH = 'path'  # путь к файлу
+P90 = 'p90'  # 90-й перцентиль оценок
+POINTS = 'points'  # точки истории оценок
 PRODUCT = 'product'  # товар
+QUEUED = 'queued'  # количество запросов в очереди
 RATING = 'rating'
+READ = 'read'  # запросы на чтение
+REMAINING = 'remaining'  # количество оставшихся страниц
+REAPED = 'reaped'  # количество соединений, закрытых из-за простоя
+REQUEST_ID = 'request_id'  # идентификатор запроса, возвращается в ответе
+RETRY_AFTER = 'retry_after'  # через сколько секунд можно повторить запрос
 SOCKET = 'socket'
+SORT = 'sort'  # поле, по которому сортируются оценки
+SPLIT = 'split'  # покупка в нескольких магазинах
+STATE = 'state'  # состояние резервного копирования
 STATUS = 'status'  # статус
+STD = 'std'  # стандартное отклонение оценок
+STEPS = 'steps'  # количество шагов резервного копирования
+STORES = 'stores'  # данные по магазинам
+STREAM = 'stream'  # признак ответа, передаваемого по частям
+TOTAL = 'total'  # общая стоимость
+VERSION = 'version'  # версия набора данных
+WRITE = 'write'  # запросы на запись
+
+# Порядок полей оценки в строках ответа GET_RATINGS в компактном виде
+RATING_COLUMNS = (ID, ADDRESS, RATING, DATE)
+
+# Значения поля GRANULARITY:
+DAY = 'day'  # по дням
+WEEK = 'week'  # по неделям (с понедельника)
+MONTH = 'month'  # по месяцам (или по нескольким месяцам)
+
+# Значения поля STATE:
+RUNNING = 'running'  # копирование выполняется
+DONE = 'done'  # копия создана
+FAILED = 'failed'  # копию не удалось создать
+
+# Значения поля ORDER:
+ASC = 'asc'  # по возрастанию
+DESC = 'desc'  # по убыванию
 
 # Значения поля ACTION:
+# Согласование параметров соединения (способа сжатия сообщений)
+HELLO = 'hello'
 # Добавление нового фильтра
 ADD_FILTER = 'add_filter'
 # Добавление нового товара
@@ -36,3 +123,159 @@ ADD_RATING = 'add_rating'
 GET_FILTERS_AND_PRODUCTS = 'get_filters_and_products'
 # Получение оценок товара по заданному фильтру
 GET_RATINGS = 'get_ratings'
+# Получение первых оценок сразу для нескольких товаров и фильтров
+GET_RATINGS_BATCH = 'get_ratings_batch'
+# Получение статистики оценок товара по заданному фильтру
+GET_STATISTICS = 'get_statistics'
+# Поиск магазинов, где покупка списка товаров дешевле всего
+GET_CHEAPEST_BASKET = 'get_cheapest_basket'
+# Получение истории оценок (цен) товара по фильтру
+GET_PRICE_HISTORY = 'get_price_history'
+# Поиск товаров по названию
+SEARCH_PRODUCTS = 'search_products'
+# Удаление оценки (или списка оценок) товара
+DELETE_RATING = 'delete_rating'
+# Получение статистики работы сервера
+GET_SERVER_STATS = 'get_server_stats'
+# Резервное копирование базы данных сервера без остановки сервера
+BACKUP = 'backup'
+
+# Запросы на запись, остальные запросы считаются запросами на чтение
+WRITE_ACTIONS = (ADD_FILTER, ADD_PRODUCT, ADD_RATING, DELETE_RATING, BACKUP)
+
+# Параметры ограничения частоты запросов
+# Количество запросов на чтение и на запись в секунду от одного соединения
+# по умолчанию (0 - без ограничения)
+READ_RATE = 20
+WRITE_RATE = 5
+# Во сколько раз ограничение для одного IP адреса больше ограничения для
+# одного соединения
+IP_RATE_FACTOR = 4
+# Количество секунд, за которое накапливается максимальная пачка запросов
+RATE_BURST_SECONDS = 2
+# Максимальное количество запросов, обрабатываемых за один проход цикла
+# сервера. Запросы клиентов обрабатываются по очереди
+MAX_REQUESTS_PER_PASS = 16
+# Максимальное количество запросов в очереди сервера и в очереди одного
+# клиента. Когда очередь сервера заполнена, отклоняются запросы клиентов,
+# у которых в очереди больше всего запросов
+MAX_QUEUED_REQUESTS = 256
+MAX_CLIENT_QUEUED_REQUESTS = 16
+# Через сколько секунд можно повторить запрос, отклоненный из-за очереди
+OVERLOAD_RETRY_AFTER = 1
+
+# Параметры ключей идемпотентности оценок
+# Максимальная длина ключа
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+# Время хранения ключа на сервере в секундах. Повтор оценки с тем же ключом
+# в течение этого времени не добавляет ее второй раз
+IDEMPOTENCY_KEY_TTL = 86400
+# Период удаления устаревших ключей в секундах
+KEY_EXPIRY_INTERVAL = 600
+# Максимальное количество ключей, удаляемых за один раз
+KEY_EXPIRY_BATCH_SIZE = 1000
+
+# Параметры соединений с клиентами
+# Время простоя в секундах, после которого сервер закрывает соединение, по
+# умолчанию (0 - соединения не закрываются)
+IDLE_TIMEOUT = 900
+# Период поиска простаивающих соединений в секундах
+REAP_INTERVAL = 10
+# Параметры проверки соединения (TCP keepalive): время простоя перед первой
+# проверкой и интервал между проверками в секундах, количество проверок без
+# ответа, после которого соединение считается разорванным
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_PROBES = 5
+
+# Параметры резервного копирования базы данных
+# Количество страниц базы данных, копируемых за один шаг, по умолчанию.
+# Во время шага запросы к базе данных ждут, поэтому чем меньше шаг, тем
+# меньше задержка запросов и тем дольше копирование
+BACKUP_PAGES = 64
+# Пауза между шагами копирования в секундах
+BACKUP_PAUSE = 0.005
+# Количество последних запросов, по времени обработки которых считается
+# 99-й перцентиль до начала копирования
+LATENCY_SAMPLES = 1000
+# Период запроса хода копирования программой backup.py в секундах
+BACKUP_POLL_INTERVAL = 0.5
+
+# Параметры записи сообщений от клиентов в журнал (параметр сервера
+# --capture)
+# Максимальный размер файла журнала в байтах и количество файлов. Когда
+# файл вырастает до этого размера, начинается новый файл, а самые старые
+# файлы удаляются
+CAPTURE_FILE_SIZE = 64 * 1024 * 1024
+CAPTURE_FILES = 16
+# Размер буфера записи в байтах и период сброса буфера на диск в секундах
+CAPTURE_BUFFER_SIZE = 256 * 1024
+CAPTURE_FLUSH_INTERVAL = 1
+
+# Параметры удаления оценок
+# Период фонового сжатия базы данных (удаления помеченных оценок) в секундах
+COMPACTION_INTERVAL = 60
+# Максимальное количество помеченных оценок, удаляемых за одно сжатие
+COMPACTION_BATCH_SIZE = 1000
+
+# Количество оценок, запрашиваемых клиентом за один раз
+RATINGS_PAGE_SIZE = 200
+# Количество оценок в одной части ответа, передаваемого по частям
+STREAM_CHUNK_SIZE = 500
+# Максимальное количество оценок в ответе, передаваемом целиком
+MAX_RATINGS_PER_RESPONSE = 10000
+# Количество оценок для каждой пары (товар, фильтр) в ответе на запрос
+# GET_RATINGS_BATCH по умолчанию
+BATCH_RATINGS_LIMIT = 10
+# Максимальное количество пар (товар, фильтр) в запросе GET_RATINGS_BATCH
+# и товаров в запросе GET_CHEAPEST_BASKET
+MAX_BATCH_ITEMS = 100
+
+# Параметры поиска самой дешевой покупки
+# Фильтр, оценки по которому считаются ценами, по умолчанию
+PRICE_FILTER = 'Стоимость'
+# Максимальное количество магазинов, между которыми делится покупка
+MAX_BASKET_STORES = 5
+
+# Параметры локального кэша клиента
+# Количество наборов оценок (товар, фильтр, сортировка), хранящихся в кэше
+CACHED_RATING_SETS = 20
+# Максимальное количество оценок одного набора, хранящихся в кэше
+CACHED_RATINGS = 1000
+# Количество оценок, добавленных без соединения с сервером, которые
+# отправляются серверу одним запросом
+OFFLINE_BATCH_SIZE = 100
+
+# Параметры запросов оценок из окна клиента
+# Задержка в миллисекундах между последним изменением выбранного товара или
+# фильтра и запросом оценок. Изменения за это время дают один запрос
+RATINGS_DEBOUNCE_INTERVAL = 150
+# Количество соседних товаров в выпадающем списке с каждой стороны от
+# выбранного, оценки которых заранее загружаются в кэш
+PREFETCH_NEIGHBOURS = 1
+
+# Параметры истории оценок
+# Количество точек истории по умолчанию и максимальное количество точек
+HISTORY_POINTS = 100
+MAX_HISTORY_POINTS = 1000
+
+# Количество интервалов гистограммы оценок
+HISTOGRAM_BINS = 10
+# Максимальное количество статистик (товар, фильтр, период), хранящихся в
+# кэше сервера
+STATISTICS_CACHE_SIZE = 1000
+
+# Параметры поиска товаров
+SEARCH_LIMIT = 10  # количество найденных товаров по умолчанию
+MAX_SEARCH_LIMIT = 100  # максимальное количество найденных товаров
+
+# Параметры хранения оценок
+# Период переноса устаревших оценок в архивные базы данных в секундах
+ARCHIVE_INTERVAL = 3600
+# Максимальное количество оценок, переносимых в архив за один раз
+ARCHIVE_BATCH_SIZE = 1000
+# Версия схемы базы данных сервера. Записывается в базу данных после создания
+# таблиц и должна увеличиваться при каждом изменении моделей
+SCHEMA_VERSION = 5
+# Формат даты в сообщениях
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
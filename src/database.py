@@ -1,13 +1,58 @@
 """Модуль содержит класс для работы с базой данных на стороне сервера."""
 
 import os
-from datetime import datetime
-from sqlalchemy import create_engine
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, select
 from sqlalchemy.orm import sessionmaker
-from models import Base, Estimation, Product, Rating
+from sqlalchemy.pool import StaticPool
+from backup import OnlineBackup
+from price_statistics import compute_statistics
+from queries import BATCH, CompiledQueries, SORT_INDEXES, escape_like
+from rating_store import RatingStore
+from storage import Storage, limit_rating, rating_data
+from history import DAY_FORMAT
+from models import (ArchiveBase, ArchivedRating, Base, Estimation, Product,
+                    Rating, RatingDay, RatingKey)
 from const import *
 
 
+# Столбцы, добавленные в уже существующие таблицы: (таблица, столбец) ->
+# запросы. create_all не добавляет столбцы в существующие таблицы, поэтому
+# при подготовке базы данных запросы выполняются для каждого столбца,
+# которого еще нет, до изменений данных из MIGRATIONS
+COLUMNS = {
+    # Признак удаленной оценки для мягкого удаления
+    ('rating', 'deleted'): (
+        'ALTER TABLE rating ADD COLUMN deleted BOOLEAN NOT NULL DEFAULT 0',
+        'CREATE INDEX IF NOT EXISTS ix_rating_deleted ON rating (deleted)'),
+}
+
+# Изменения при переходе на новую версию схемы: версия -> запрос или
+# кортеж запросов. Выполняются при подготовке базы данных с более старой
+# версией схемы. Индексы создаются здесь, потому что create_all не добавляет
+# индексы в существующие таблицы
+MIGRATIONS = {
+    # Даты оценок хранятся без микросекунд
+    2: 'UPDATE rating SET date = substr(date, 1, 19) WHERE length(date) > 19',
+    # Дневные сводки оценок для истории оценок
+    4: 'INSERT INTO rating_day (product_id, estimation_id, day, count, total, '
+       'min_rating, max_rating) SELECT product_id, estimation_id, '
+       'substr(date, 1, 10), count(*), sum(rating), min(rating), '
+       'max(rating) FROM rating WHERE deleted = 0 AND rating IS NOT NULL '
+       'GROUP BY product_id, estimation_id, substr(date, 1, 10)',
+    # Индексы для выборки оценок товара по фильтру за период и сортировки
+    5: ('CREATE INDEX IF NOT EXISTS ix_rating_product_estimation_date ON '
+        'rating (product_id, estimation_id, date)',
+        'CREATE INDEX IF NOT EXISTS ix_rating_product_estimation_rating ON '
+        'rating (product_id, estimation_id, rating)',
+        'CREATE INDEX IF NOT EXISTS ix_rating_product_estimation_address ON '
+        'rating (product_id, estimation_id, address)',
+        # Индекс для сортировки оценок по дате
+        'CREATE INDEX IF NOT EXISTS ix_rating_date ON rating (date)'),
+}
+
+
 def create_database_name():
     """Функция создает путь к базе данных для сервера."""
 
@@ -21,18 +66,80 @@ def create_database_name():
     return os.path.join(DIR_PATH, DATABASE_NAME)
 
 
-class Database:
-    """Класс для работы с базой данных на стороне сервера."""
+def create_backup_name(db_name, date):
+    """Функция создает путь к резервной копии базы данных.
+    :param db_name: путь к основной базе данных;
+    :param date: время создания копии.
+    :return: путь к резервной копии."""
+
+    DIR_PATH = os.path.join(os.path.dirname(db_name), 'backup')
+    if not os.path.exists(DIR_PATH):
+        os.mkdir(DIR_PATH)
+    return os.path.join(DIR_PATH, date.strftime('db-%Y%m%d-%H%M%S.sqlite3'))
 
-    def __init__(self):
-        """Конструктор."""
 
-        db_name = create_database_name()  # получаем путь к базе данных
-        engine = create_engine(f'sqlite:///{db_name}')
-        Base.metadata.create_all(engine)
+def create_archive_name(db_name, date):
+    """Функция создает путь к архивной базе данных, в которую переносятся
+    оценки за месяц.
+    :param db_name: путь к основной базе данных;
+    :param date: дата, месяц которой определяет архивную базу данных.
+    :return: путь к архивной базе данных."""
+
+    DIR_PATH = os.path.join(os.path.dirname(db_name), 'archive')
+    if not os.path.exists(DIR_PATH):
+        os.mkdir(DIR_PATH)
+    return os.path.join(DIR_PATH, date.strftime('%Y-%m.sqlite3'))
+
+
+class Database(Storage):
+    """Класс для работы с базой данных на стороне сервера."""
+
+    def __init__(self, db_name=None, soft_delete=False, memory_store=False,
+                 estimations=(), products=()):
+        """Конструктор.
+        :param db_name: путь к базе данных. Если None, то база данных
+        создается в папке database текущей директории;
+        :param soft_delete: если True, то оценки при удалении только
+        помечаются удаленными, а физически удаляются при сжатии базы данных
+        методом compact;
+        :param memory_store: если True, то оценки загружаются в хранилище в
+        памяти, из которого выполняются запросы на чтение оценок;
+        :param estimations: фильтры, которые добавляются в новую базу данных,
+        - список кортежей (название фильтра, минимальная оценка,
+        максимальная оценка);
+        :param products: названия товаров, которые добавляются в новую базу
+        данных."""
+
+        super().__init__(soft_delete)
+        # Получаем путь к базе данных
+        if db_name is None:
+            db_name = create_database_name()
+        self.db_name = db_name
+        # Все запросы выполняются через одно соединение. Через него же
+        # идет резервное копирование в отдельном потоке: изменения, сделанные
+        # через то же соединение, сразу попадают в копию, а изменения через
+        # другое соединение заставили бы копирование начаться заново
+        engine = create_engine(f'sqlite:///{db_name}', poolclass=StaticPool,
+                               connect_args={'check_same_thread': False})
+        self.bootstrap(engine, estimations, products)
         # Создаем сессию
         Session = sessionmaker(bind=engine)
         self.session = Session()
+        # Скомпилированные запросы для частых операций
+        self.queries = CompiledQueries(engine.dialect)
+        # Заполняем индекс названий товаров
+        for product_id, name in self.session.query(Product.id, Product.name):
+            self.product_index.add(product_id, name)
+        # Хранилище оценок в памяти
+        self.store = None
+        if memory_store:
+            self.store = RatingStore()
+            for row in self.session.query(
+                    Rating.product_id, Rating.estimation_id, Rating.id,
+                    Rating.rating, Rating.date, Rating.address).filter_by(
+                    deleted=False).order_by(Rating.product_id,
+                                            Rating.estimation_id, Rating.id):
+                self.store.add(*row)
 
     def __del__(self):
         """Деструктор."""
@@ -49,15 +156,14 @@ class Database:
         :return: данные добавленного фильтра, иначе None."""
 
         # Ищем фильтр в таблице фильтров
-        n = self.session.query(Estimation).filter_by(
-            name=estimation_name).count()
-        if n:
+        if self.get_estimation_row(estimation_name):
             # Фильтр уже записан в базу данных
             return None
         # Фильтра в базе данных нет, добавляем
         e = Estimation(estimation_name, min_value, max_value)
         self.session.add(e)
         self.session.commit()
+        self.catalog_changed()
         return e.get()
 
     def add_product(self, product_name):
@@ -66,41 +172,187 @@ class Database:
         :return product: данные добавленного товара, иначе None."""
 
         # Ищем товар в таблице с товарами
-        n = self.session.query(Product).filter_by(name=product_name).count()
-        if n:
+        if self.get_product_id(product_name) is not None:
             # Товар уже записан в базу данных
             return None
         # Товара в базе данных нет, добавляем
         product = Product(product_name)
         self.session.add(product)
         self.session.commit()
+        self.product_index.add(product.id, product.name)
+        self.catalog_changed()
         return product.get()
 
-    def add_rating(self, product_name, estimation_name, rating, address):
+    def add_rating(self, product_name, estimation_name, rating, address,
+                   key=None):
         """Метод добавляет оценку товара.
         :param product_name: наименование товара;
         :param estimation_name: фильтр, по которому оценивается товар;
         :param rating: оценка по фильтру;
         :param address: адрес магазина, в котором приобретен оцениваемый
-        товар."""
-
+        товар;
+        :param key: ключ идемпотентности оценки. Ключ записывается в той же
+        транзакции, что и оценка. Если оценка с таким ключом уже добавлена,
+        то новая оценка не добавляется.
+        :return: ID добавленной (или ранее добавленной с тем же ключом)
+        оценки или None, если оценку добавить нельзя."""
+
+        if key is not None:
+            rating_id = self.get_rating_id_by_key(key)
+            if rating_id is not None:
+                # Оценка уже добавлена, клиент повторил запрос
+                return rating_id
+        # Ищем фильтр в таблице фильтров
+        e = self.get_estimation_row(estimation_name)
+        if not e:
+            # Фильтра нет, оценку добавить нельзя
+            return
+        estimation_id, min_value, max_value = e
         # Ищем товар в таблице товаров
-        p = self.session.query(Product).filter_by(name=product_name).first()
-        if not p:
+        product_id = self.get_product_id(product_name)
+        if product_id is None:
             # Товара нет, нужно добавить
-            p = self.add_product(product_name)
-        # Ищем фильтр в таблице фильтров
-        e = self.session.query(Estimation).filter_by(
-            name=estimation_name).first()
-        if e.min_value != None and rating < e.min_value:
-            # Оценка по фильтру не может быть меньше минимального значения
-            rating = e.min_value
-        if e.max_value != None and rating > e.max_value:
-            # Оценка по фильтру не может быть больше максимального значения
-            rating = e.max_value
+            product_id = self.add_product(product_name)[ID]
+        rating = limit_rating(rating, min_value, max_value)
         # Добавляем оценку товара
-        self.session.add(Rating(p, e, rating, address))
+        date = datetime.now()
+        result = self.execute(
+            'insert_rating', product_id=product_id,
+            estimation_id=estimation_id, rating=rating, address=address,
+            date=date)
+        rating_id = result.inserted_primary_key[0]
+        if rating is not None:
+            # Обновляем дневную сводку оценок в той же транзакции
+            self.execute('add_rating_day', product_id=product_id,
+                         estimation_id=estimation_id,
+                         day=date.strftime(DAY_FORMAT), rating=rating)
+        if key is not None:
+            self.execute('insert_rating_key', idempotency_key=key,
+                         rating_id=rating_id, created=date)
+        self.session.commit()
+        if self.store is not None:
+            self.store.add(product_id, estimation_id, rating_id, rating, date,
+                           address)
+        self.rating_added(product_id, estimation_id, rating, address)
+        return rating_id
+
+    def archive_ratings(self, days, batch_size=ARCHIVE_BATCH_SIZE):
+        """Метод переносит оценки старше заданного количества дней в архивные
+        базы данных, по одной на каждый месяц.
+        :param days: количество дней, в течение которых оценки хранятся в
+        основной базе данных;
+        :param batch_size: максимальное количество оценок, переносимых за
+        один вызов.
+        :return: количество перенесенных оценок."""
+
+        cutoff = datetime.now() - timedelta(days=days)
+        # Устаревшие оценки, помеченные удаленными, в архив не переносятся,
+        # а сразу удаляются. Из хранилища в памяти и из дневных сводок они
+        # уже убраны при пометке
+        ids = [rating_id for rating_id, in self.session.query(
+            Rating.id).filter(Rating.date < cutoff).filter_by(
+            deleted=True).limit(batch_size)]
+        if ids:
+            self.session.query(Rating).filter(Rating.id.in_(ids)).delete(
+                synchronize_session=False)
+            self.session.commit()
+        ratings = self.session.query(Rating).filter(
+            Rating.date < cutoff).filter_by(deleted=False).order_by(
+            Rating.date).limit(batch_size).all()
+        if not ratings:
+            return 0
+        # Группируем оценки по месяцам
+        months = {}
+        for rating in ratings:
+            months.setdefault((rating.date.year, rating.date.month),
+                              []).append(rating)
+        for month_ratings in months.values():
+            archive_name = create_archive_name(self.db_name,
+                                               month_ratings[0].date)
+            engine = create_engine(f'sqlite:///{archive_name}')
+            ArchiveBase.metadata.create_all(engine)
+            session = sessionmaker(bind=engine)()
+            try:
+                # merge, чтобы повторный перенос после сбоя не падал на
+                # уже записанных в архив оценках
+                for rating in month_ratings:
+                    session.merge(ArchivedRating(rating))
+                session.commit()
+            finally:
+                session.close()
+                engine.dispose()
+        # Удаляем перенесенные оценки из основной базы данных. Дневные
+        # сводки оценок остаются, чтобы история оценок включала архивные
+        # оценки
+        ids = [rating.id for rating in ratings]
+        for rating in ratings:
+            if self.store is not None:
+                self.store.remove(rating.product_id, rating.estimation_id,
+                                  rating.id, rating.rating)
+            self.ratings_changed(rating.product_id, rating.estimation_id)
+        self.session.query(Rating).filter(Rating.id.in_(ids)).delete(
+            synchronize_session=False)
         self.session.commit()
+        return len(ids)
+
+    def bootstrap(self, engine, estimations=(), products=()):
+        """Метод создает таблицы, добавляет в существующие таблицы столбцы
+        из COLUMNS, которых в них нет, выполняет изменения из MIGRATIONS для
+        версий схемы новее записанной в базе данных (в том числе создает
+        индексы) и добавляет начальные фильтры и товары одной транзакцией,
+        после чего записывает в базу данных версию схемы. База данных без
+        версии (например, созданная первой версией сервера) проходит все
+        изменения. Если в базе данных уже записана версия SCHEMA_VERSION,
+        то метод ничего не делает, поэтому повторный запуск сервера не
+        тратит время на проверку таблиц и начальных данных.
+        :param engine: движок базы данных;
+        :param estimations: список кортежей (название фильтра, минимальная
+        оценка, максимальная оценка);
+        :param products: список названий товаров.
+        :return: True, если база данных подготовлена, иначе False."""
+
+        with engine.connect() as connection:
+            version = connection.execute('PRAGMA user_version').scalar()
+            if version == SCHEMA_VERSION:
+                return False
+            with connection.begin():
+                # Драйвер sqlite3 сам начинает транзакцию только перед
+                # изменением данных, поэтому создание таблиц без явного
+                # BEGIN выполнилось бы вне транзакции
+                connection.execute('BEGIN')
+                Base.metadata.create_all(connection)
+                # Добавляем столбцы, которых нет в таблицах, созданных
+                # более старой версией сервера
+                for (table, column), statements in COLUMNS.items():
+                    names = {row[1] for row in connection.execute(
+                        f'PRAGMA table_info({table})')}
+                    if column not in names:
+                        for statement in statements:
+                            connection.execute(statement)
+                for number in sorted(MIGRATIONS):
+                    if version < number:
+                        statements = MIGRATIONS[number]
+                        if isinstance(statements, str):
+                            statements = (statements,)
+                        for statement in statements:
+                            connection.execute(statement)
+                # Добавляем только те фильтры и товары, которых еще нет
+                names = {name for name, in connection.execute(
+                    select([Estimation.name]))}
+                rows = [{'name': name, 'min_value': min_value,
+                         'max_value': max_value}
+                        for name, min_value, max_value in estimations
+                        if name not in names]
+                if rows:
+                    connection.execute(Estimation.__table__.insert(), rows)
+                names = {name for name, in connection.execute(
+                    select([Product.name]))}
+                rows = [{'name': name} for name in products
+                        if name not in names]
+                if rows:
+                    connection.execute(Product.__table__.insert(), rows)
+                connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        return True
 
     def change_estimation(self, estimation_name, min_value=None,
                           max_value=None):
@@ -114,6 +366,26 @@ class Database:
             {Estimation.min_value: min_value, Estimation.max_value: max_value},
             synchronize_session=False)
         self.session.commit()
+        self.catalog_changed()
+
+    def expire_rating_keys(self, max_age=IDEMPOTENCY_KEY_TTL,
+                           batch_size=KEY_EXPIRY_BATCH_SIZE):
+        """Метод удаляет ключи идемпотентности оценок старше max_age секунд.
+        :param max_age: время хранения ключа в секундах;
+        :param batch_size: максимальное количество ключей, удаляемых за один
+        вызов.
+        :return: количество удаленных ключей."""
+
+        cutoff = datetime.now() - timedelta(seconds=max_age)
+        keys = [key for key, in self.session.query(RatingKey.key).filter(
+            RatingKey.created < cutoff).order_by(RatingKey.created).limit(
+            batch_size)]
+        if not keys:
+            return 0
+        self.session.query(RatingKey).filter(RatingKey.key.in_(keys)).delete(
+            synchronize_session=False)
+        self.session.commit()
+        return len(keys)
 
     def get_estimation(self, estimation_name):
         """Метод возвращает фильтр с заданным названием.
@@ -123,23 +395,38 @@ class Database:
         return self.session.query(Estimation).filter_by(
             name=estimation_name).first()
 
+    def get_estimation_row(self, estimation_name):
+        """Метод возвращает ID и пределы значений оценки фильтра.
+        :param estimation_name: название фильтра.
+        :return: кортеж (ID, минимальная оценка, максимальная оценка) или
+        None, если фильтра нет."""
+
+        return self.execute('estimation', name=estimation_name).first()
+
+    def get_estimation_id(self, estimation_name):
+        """Метод возвращает ID фильтра.
+        :param estimation_name: название фильтра.
+        :return: ID или None, если фильтра нет."""
+
+        e = self.get_estimation_row(estimation_name)
+        return e[0] if e else None
+
     def get_estimations(self):
         """Метод возвращает все фильтры.
         :return: список с названиями и пределами оценов для фильтров."""
 
-        estimations = self.session.query(Estimation).all()
-        return [e.get() for e in estimations]
+        return [{ID: row[0], FILTER: row[1], MIN: row[2], MAX: row[3]}
+                for row in self.execute('estimations')]
 
     def get_estimation_limits(self, estimation_name):
         """Метод получает пределы значений оценки по фильтру.
         :param estimation_name: название фильтра;
         :return: кортеж из пределов значений оценки по фильтру."""
 
-        e = self.session.query(Estimation).filter_by(
-            name=estimation_name).first()
+        e = self.get_estimation_row(estimation_name)
         if not e:
             return (None, None)
-        return (e.min_value, e.max_value)
+        return (e[1], e[2])
 
     def get_estimations_names(self):
         """Метод возвращает названия всех фильтров.
@@ -156,44 +443,390 @@ class Database:
         return self.session.query(Product).filter_by(
             name=product_name).first()
 
+    def get_product_id(self, product_name):
+        """Метод возвращает ID товара с заданным названием.
+        :param product_name: название товара.
+        :return: ID товара или None, если товара нет."""
+
+        return self.execute('product_id', name=product_name).scalar()
+
     def get_products(self):
         """Метод возвращает все названия товаров.
         :return: список с названиями всех товаров."""
 
-        products = self.session.query(Product).all()
-        return [product.get() for product in products]
+        return [{ID: row[0], PRODUCT: row[1]}
+                for row in self.execute('products')]
 
-    def get_ratings(self, product_name, estimation_name):
-        """Метод возвращает товары с определенным названием, оцененные по
-        определенному фильтру.
+    def get_key(self, product_name, estimation_name):
+        """Метод возвращает пару (ID товара, ID фильтра).
         :param product_name: название товара;
         :param estimation_name: название фильтра.
-        :return: список товаров с оценками."""
+        :return: пара ID или None, если товара или фильтра нет."""
 
-        p = self.session.query(Product).filter_by(name=product_name).first()
-        e = self.session.query(Estimation).filter_by(
-            name=estimation_name).first()
-        if not p or not e:
+        product_id = self.get_product_id(product_name)
+        e = self.get_estimation_row(estimation_name)
+        if product_id is None or not e:
+            return None
+        return (product_id, e[0])
+
+    def get_keys(self, pairs):
+        """Метод возвращает пары ID для списка пар названий. Все названия
+        ищутся одним запросом.
+        :param pairs: список пар (название товара, название фильтра).
+        :return: список пар (ID товара, ID фильтра) в том же порядке. Для
+        пар, у которых нет товара или фильтра, - None."""
+
+        if not pairs:
             return []
-        ratings = self.session.query(Rating).filter_by(
-            product_id=p.id, estimation_id=e.id).order_by(Rating.rating).all()
-        return [rating.get() for rating in ratings]
+        rows = self.execute(
+            'keys', products=list({product for product, _ in pairs}),
+            estimations=list({estimation for _, estimation in pairs}))
+        ids = {(product, estimation): (product_id, estimation_id)
+               for product_id, product, estimation_id, estimation in rows}
+        return [ids.get(tuple(pair)) for pair in pairs]
+
+    def get_latest_prices(self, estimation_id, product_id=None):
+        """Метод возвращает последние оценки товаров по фильтру в каждом
+        магазине.
+        :param estimation_id: ID фильтра;
+        :param product_id: ID товара. Если None, то возвращаются оценки всех
+        товаров.
+        :return: список кортежей (ID товара, адрес магазина, оценка)."""
+
+        connection = self.session.connection()
+        if product_id is None:
+            return self.queries.fetch(connection, 'latest_prices',
+                                      estimation_id=estimation_id)
+        return self.queries.fetch(connection, 'latest_product_prices',
+                                  product_id=product_id,
+                                  estimation_id=estimation_id)
+
+    def get_statistics(self, product_name, estimation_name, since=None,
+                       until=None):
+        """Метод возвращает статистику оценок товара по фильтру: перцентили,
+        стандартное отклонение, гистограмму и минимальные оценки по
+        магазинам. Статистика кэшируется до изменения оценок.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра;
+        :param since, until: начало и конец (не включительно) периода времени.
+        Если None, то период не ограничен.
+        :return: словарь со статистикой или None, если оценок нет."""
 
-    def delete_product(self, product_name):
-        """Метод удаляет товар из таблицы с названиями товаров.
-        :param product_name: название удаляемого товара."""
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            return None
+        product_id, estimation_id = key
+        try:
+            return self.get_cached_statistics(key, (since, until))
+        except KeyError:
+            pass
+        if self.store is not None:
+            columns = self.store.columns.get(key)
+            if columns is None:
+                return None
+            ratings = columns.ratings
+            dates = columns.dates
+            addresses = columns.addresses
+            address_list = self.store.address_list
+        else:
+            # Загружаем столбцы оценок, отсортированных по значению
+            ratings = array('d')
+            dates = array('q')
+            addresses = array('i')
+            address_list = []
+            address_ids = {}
+            for rating, date, address in self.session.query(
+                    Rating.rating, Rating.date, Rating.address).filter_by(
+                    product_id=product_id, estimation_id=estimation_id,
+                    deleted=False).order_by(Rating.rating, Rating.id):
+                if address not in address_ids:
+                    address_ids[address] = len(address_list)
+                    address_list.append(address)
+                ratings.append(rating)
+                dates.append(int(date.timestamp()))
+                addresses.append(address_ids[address])
+        statistics = compute_statistics(
+            ratings, dates, addresses, address_list,
+            since.timestamp() if since else None,
+            until.timestamp() if until else None)
+        self.cache_statistics(key, (since, until), statistics)
+        return statistics
+
+    def get_summary(self, product_name, estimation_name):
+        """Метод возвращает сводку оценок товара по фильтру.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра.
+        :return: словарь с количеством, минимальной, максимальной и средней
+        оценками или None, если оценок нет."""
 
-        self.session.query(Product).filter_by(name == product_name).delete(
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            return None
+        if self.store is not None:
+            return self.store.summary(*key)
+        count, min_rating, max_rating, mean = self.session.query(
+            func.count(Rating.id), func.min(Rating.rating),
+            func.max(Rating.rating), func.avg(Rating.rating)).filter_by(
+            product_id=key[0], estimation_id=key[1], deleted=False).one()
+        if not count:
+            return None
+        return {COUNT: count, MIN: min_rating, MAX: max_rating, MEAN: mean}
+
+    def get_rating_days(self, key, first=None, last=None):
+        """Метод возвращает дневные сводки оценок товара по фильтру за
+        период. Сводки читаются по первичному ключу таблицы rating_day.
+        :param key: пара (ID товара, ID фильтра);
+        :param first, last: первый и последний дни периода - строки в
+        формате DAY_FORMAT. Если None, то период не ограничен.
+        :return: список кортежей (день, количество, сумма, минимум,
+        максимум), упорядоченный по дням."""
+
+        return self.queries.fetch(
+            self.session.connection(), 'rating_days', product_id=key[0],
+            estimation_id=key[1], first=first or '0001-01-01',
+            last=last or '9999-12-31')
+
+    def get_rating_id_by_key(self, key):
+        """Метод находит оценку, добавленную с ключом идемпотентности.
+        :param key: ключ идемпотентности.
+        :return: ID оценки или None, если оценки с таким ключом нет."""
+
+        return self.execute('rating_key', idempotency_key=key).scalar()
+
+    def get_rating_rows(self, product_name, estimation_name, since=None,
+                        until=None, sort=RATING, order=ASC, min_rating=None,
+                        max_rating=None, address=None, limit=None,
+                        offset=0):
+        """Метод возвращает оценки товара с определенным названием по
+        определенному фильтру в виде строк, полученных прямо из базы данных,
+        без создания объектов ORM и словарей.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра;
+        :param since, until: начало и конец (не включительно) периода времени,
+        за который нужны оценки. Если None, то период не ограничен;
+        :param sort: поле, по которому сортируются оценки (RATING, DATE или
+        ADDRESS);
+        :param order: направление сортировки (ASC или DESC);
+        :param min_rating, max_rating: пределы значений оценок. Если None, то
+        предела нет;
+        :param address: подстрока, которую должен содержать адрес магазина;
+        :param limit: максимальное количество оценок. Если None, то
+        возвращаются все оценки;
+        :param offset: количество пропускаемых первых оценок.
+        :return: список кортежей (ID, адрес, оценка, дата)."""
+
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            return []
+        if self.store is not None and sort == RATING:
+            # Оценки, отсортированные по значению, берем из хранилища в памяти
+            return self.store.select(*key, since, until, sort, order,
+                                     min_rating, max_rating, address, limit,
+                                     offset)
+        return self.select_ratings(key, since, until, sort, order, min_rating,
+                                   max_rating, address, limit, offset)
+
+    def get_rating_rows_batch(self, keys, sort=RATING, order=ASC,
+                              limit=BATCH_RATINGS_LIMIT):
+        """Метод возвращает первые оценки сразу для нескольких пар (товар,
+        фильтр) одним запросом.
+        :param keys: список пар (ID товара, ID фильтра);
+        :param sort: поле, по которому сортируются оценки;
+        :param order: направление сортировки;
+        :param limit: количество оценок для каждой пары.
+        :return: словарь пара ID -> список кортежей (ID, адрес, оценка,
+        дата)."""
+
+        if not keys:
+            return {}
+        if self.store is not None and sort == RATING:
+            # Оценки, отсортированные по значению, берем из хранилища в памяти
+            return {key: self.store.select(*key, sort=sort, order=order,
+                                           limit=limit) for key in keys}
+        keys = list(dict.fromkeys(keys))
+        # Количество пар в запросе округляется вверх до степени двойки, а
+        # лишние пары заполняются несуществующими ID. Так для списков разной
+        # длины компилируется всего несколько запросов
+        count = 1 << (len(keys) - 1).bit_length()
+        params = {'limit': limit}
+        for i, (product_id, estimation_id) in enumerate(
+                keys + [(0, 0)] * (count - len(keys))):
+            params[f'product_id_{i}'] = product_id
+            params[f'estimation_id_{i}'] = estimation_id
+        result = {key: [] for key in keys}
+        for row in self.queries.fetch(self.session.connection(),
+                                      (BATCH, sort, order, count), **params):
+            result[row[:2]].append(row[2:])
+        return result
+
+    def select_ratings(self, key, since=None, until=None, sort=RATING,
+                       order=ASC, min_rating=None, max_rating=None,
+                       address=None, limit=None, offset=0, after=None):
+        """Метод выполняет скомпилированный запрос оценок товара по фильтру.
+        Параметры отбора и сортировки такие же, как у метода
+        get_rating_rows.
+        :param key: пара (ID товара, ID фильтра);
+        :param after: пара из значения поля сортировки и ID оценки, после
+        которой продолжается выборка. Если None, то выборка с начала.
+        :return: список кортежей (ID, адрес, оценка, дата)."""
+
+        # Запрос выполняется курсором драйвера, поэтому даты передаются
+        # строками в том виде, в котором хранятся в базе данных
+        params = {'product_id': key[0], 'estimation_id': key[1],
+                  'since': since and since.strftime(DATE_FORMAT),
+                  'until': until and until.strftime(DATE_FORMAT),
+                  'min_rating': min_rating,
+                  'max_rating': max_rating,
+                  'limit': -1 if limit is None else limit, 'offset': offset}
+        if address:
+            params['address'] = f'%{escape_like(address)}%'
+        if after is not None:
+            params['last_value'], params['last_id'] = after
+        query_key = (sort, order, bool(since), bool(until),
+                     min_rating is not None, max_rating is not None,
+                     bool(address), after is not None)
+        return self.queries.fetch(self.session.connection(), query_key,
+                                  **params)
+
+    def iter_ratings(self, product_name, estimation_name,
+                     chunk_size=STREAM_CHUNK_SIZE, since=None, until=None,
+                     sort=RATING, order=ASC, min_rating=None, max_rating=None,
+                     address=None, compact=False):
+        """Метод возвращает оценки товара по фильтру частями. Каждая часть
+        запрашивается отдельным запросом, который продолжает выборку после
+        последней оценки предыдущей части (без OFFSET), поэтому время
+        получения части не зависит от ее номера. Параметры и возвращаемое
+        значение описаны в методе Storage.iter_ratings."""
+
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            yield []
+            return
+        if self.store is not None and sort == RATING:
+            # Части берем срезами из хранилища в памяти
+            yield from super().iter_ratings(
+                product_name, estimation_name, chunk_size, since=since,
+                until=until, sort=sort, order=order, min_rating=min_rating,
+                max_rating=max_rating, address=address, compact=compact)
+            return
+        index = SORT_INDEXES[sort]
+        last = None  # значение поля сортировки и ID последней оценки
+        while True:
+            rows = self.select_ratings(key, since, until, sort, order,
+                                       min_rating, max_rating, address,
+                                       chunk_size, after=last)
+            yield rows if compact else [rating_data(row) for row in rows]
+            if len(rows) < chunk_size:
+                return
+            last = (rows[-1][index], rows[-1][0])
+
+    def execute(self, key, **params):
+        """Метод выполняет скомпилированный запрос в текущей транзакции
+        сессии.
+        :param key: ключ запроса (см. CompiledQueries.get);
+        :param params: значения параметров запроса.
+        :return: результат выполнения запроса."""
+
+        return self.queries.execute(self.session.connection(), key, **params)
+
+    def compact(self, batch_size=COMPACTION_BATCH_SIZE):
+        """Метод физически удаляет оценки, помеченные удаленными.
+        :param batch_size: максимальное количество оценок, удаляемых за один
+        вызов (чтобы сжатие не блокировало надолго обработку запросов).
+        :return: количество удаленных оценок."""
+
+        ids = [rating_id for rating_id, in self.session.query(
+            Rating.id).filter_by(deleted=True).limit(batch_size)]
+        if not ids:
+            return 0
+        self.session.query(RatingKey).filter(
+            RatingKey.rating_id.in_(ids)).delete(synchronize_session=False)
+        self.session.query(Rating).filter(Rating.id.in_(ids)).delete(
             synchronize_session=False)
         self.session.commit()
+        return len(ids)
 
-    def delete_rating(self, rating_id):
-        """Метод удаляет оценку товара.
-        :param rating_id: ID оценки товара."""
+    def create_backup(self, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+        """Метод готовит резервное копирование базы данных без остановки
+        сервера. Копирование запускается методом start объекта OnlineBackup.
+        :param pages: количество страниц, копируемых за один шаг;
+        :param pause: пауза между шагами в секундах.
+        :return: объект OnlineBackup."""
 
-        self.session.query(Rating).filter_by(id == rating_id).delete(
+        # Соединение sqlite3, которое использует сессия
+        connection = self.session.connection().connection.connection
+        return OnlineBackup(connection,
+                            create_backup_name(self.db_name, datetime.now()),
+                            pages, pause)
+
+    def delete_product(self, product_name):
+        """Метод удаляет товар из таблицы с названиями товаров вместе со всеми
+        его оценками.
+        :param product_name: название удаляемого товара.
+        :return: True, если товар удален, иначе False."""
+
+        p = self.session.query(Product).filter_by(name=product_name).first()
+        if not p:
+            return False
+        # Ключи идемпотентности удаляются вместе с оценками, чтобы повтор
+        # запроса не возвращал ID удаленной оценки
+        rating_ids = self.session.query(Rating.id).filter_by(
+            product_id=p.id).subquery()
+        self.session.query(RatingKey).filter(
+            RatingKey.rating_id.in_(rating_ids)).delete(
+            synchronize_session=False)
+        self.session.query(Rating).filter_by(product_id=p.id).delete(
             synchronize_session=False)
+        self.session.query(RatingDay).filter_by(product_id=p.id).delete(
+            synchronize_session=False)
+        self.session.delete(p)
+        self.session.commit()
+        self.product_index.remove(p.id)
+        if self.store is not None:
+            self.store.remove_product(p.id)
+        self.catalog_changed()
+        self.ratings_changed(p.id)
+        return True
+
+    def delete_ratings(self, rating_ids):
+        """Метод удаляет несколько оценок товаров в одной транзакции.
+        :param rating_ids: список ID оценок.
+        :return: список ID удаленных оценок."""
+
+        # Находим существующие и еще не удаленные оценки
+        rows = self.session.query(
+            Rating.product_id, Rating.estimation_id, Rating.id,
+            Rating.rating, Rating.date).filter(Rating.id.in_(rating_ids),
+                                               Rating.deleted == False).all()
+        if not rows:
+            return []
+        ids = [row[2] for row in rows]
+        query = self.session.query(Rating).filter(Rating.id.in_(ids))
+        if self.soft_delete:
+            # Только помечаем оценки удаленными
+            query.update({Rating.deleted: True}, synchronize_session=False)
+        else:
+            query.delete(synchronize_session=False)
+        # Ключи идемпотентности удаляются и при мягком удалении, чтобы повтор
+        # запроса не возвращал ID удаленной оценки
+        self.session.query(RatingKey).filter(
+            RatingKey.rating_id.in_(ids)).delete(synchronize_session=False)
+        # Минимум и максимум нельзя уменьшить на удаленную оценку, поэтому
+        # дневные сводки составляются заново по оставшимся оценкам дня
+        for product_id, estimation_id, day in {
+                (row[0], row[1], row[4].date()) for row in rows}:
+            params = {'product_id': product_id,
+                      'estimation_id': estimation_id,
+                      'day': day.strftime(DAY_FORMAT)}
+            self.execute('delete_rating_day', **params)
+            self.execute('rollup_rating_day', **params, next_day=(
+                day + timedelta(days=1)).strftime(DAY_FORMAT))
         self.session.commit()
+        for row in rows:
+            if self.store is not None:
+                self.store.remove(*row[:4])
+            self.ratings_changed(row[0], row[1])
+        return ids
 
 
 if __name__ == "__main__":
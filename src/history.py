@@ -0,0 +1,179 @@
+"""Модуль содержит функции для построения истории оценок (цен) товара по
+фильтру. История строится по дневным сводкам оценок: количеству, сумме,
+минимуму и максимуму оценок за день. Недельные и месячные точки получаются
+объединением дневных сводок, поэтому время построения истории зависит от
+количества дней в периоде, а не от количества оценок."""
+
+import math
+from datetime import date, timedelta
+from const import *
+
+# Формат дня в сводках и в точках истории
+DAY_FORMAT = '%Y-%m-%d'
+
+
+class DailyRollup:
+    """Класс дневных сводок оценок в памяти (для хранилища MemoryDatabase).
+    Сводка дня - список [количество, сумма, минимум, максимум]."""
+
+    def __init__(self):
+        """Конструктор."""
+
+        # Словарь (ID товара, ID фильтра) -> словарь день -> сводка. День -
+        # строка в формате DAY_FORMAT
+        self.days = {}
+
+    def add(self, key, day, rating):
+        """Метод добавляет оценку в сводку дня.
+        :param key: пара (ID товара, ID фильтра);
+        :param day: день оценки;
+        :param rating: оценка."""
+
+        rating = float(rating)
+        days = self.days.setdefault(key, {})
+        summary = days.get(day)
+        if summary is None:
+            days[day] = [1, rating, rating, rating]
+            return
+        summary[0] += 1
+        summary[1] += rating
+        if rating < summary[2]:
+            summary[2] = rating
+        if rating > summary[3]:
+            summary[3] = rating
+
+    def get_rows(self, key, first=None, last=None):
+        """Метод возвращает сводки за период.
+        :param key: пара (ID товара, ID фильтра);
+        :param first, last: первый и последний дни периода. Если None, то
+        период не ограничен.
+        :return: список кортежей (день, количество, сумма, минимум,
+        максимум), упорядоченный по дням."""
+
+        days = self.days.get(key, {})
+        return [(day, *days[day]) for day in sorted(days)
+                if (first is None or day >= first) and
+                (last is None or day <= last)]
+
+    def remove_product(self, product_id):
+        """Метод удаляет сводки всех оценок товара.
+        :param product_id: ID товара."""
+
+        for key in [key for key in self.days if key[0] == product_id]:
+            del self.days[key]
+
+    def set_day(self, key, day, ratings):
+        """Метод заново составляет сводку дня, например, после удаления
+        оценки.
+        :param key: пара (ID товара, ID фильтра);
+        :param day: день;
+        :param ratings: оставшиеся оценки за день."""
+
+        days = self.days.setdefault(key, {})
+        if ratings:
+            days[day] = [len(ratings), sum(ratings), min(ratings),
+                         max(ratings)]
+        else:
+            days.pop(day, None)
+
+
+def get_bucket(day, granularity, months=1):
+    """Функция определяет первый день интервала, в который попадает день.
+    :param day: день - объект date;
+    :param granularity: уровень детализации (DAY, WEEK или MONTH);
+    :param months: количество месяцев в интервале для уровня MONTH.
+    :return: первый день интервала."""
+
+    if granularity == DAY:
+        return day
+    if granularity == WEEK:
+        return day - timedelta(days=day.weekday())
+    index = (day.year * 12 + day.month - 1) // months * months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def count_buckets(first, last, granularity, months=1):
+    """Функция считает количество интервалов в периоде.
+    :param first, last: первый и последний дни периода;
+    :param granularity: уровень детализации (DAY, WEEK или MONTH);
+    :param months: количество месяцев в интервале для уровня MONTH.
+    :return: количество интервалов."""
+
+    if granularity == DAY:
+        return (last - first).days + 1
+    if granularity == WEEK:
+        return (get_bucket(last, WEEK) - get_bucket(first, WEEK)).days // 7 + 1
+    return ((last.year * 12 + last.month - 1) // months -
+            (first.year * 12 + first.month - 1) // months + 1)
+
+
+def choose_granularity(first, last, max_points):
+    """Функция выбирает самый подробный уровень детализации, при котором в
+    периоде не больше max_points интервалов. Если даже месяцев в периоде
+    больше, то интервалы состоят из нескольких месяцев.
+    :param first, last: первый и последний дни периода;
+    :param max_points: максимальное количество интервалов.
+    :return: пара (уровень детализации, количество месяцев в интервале)."""
+
+    for granularity in (DAY, WEEK):
+        if count_buckets(first, last, granularity) <= max_points:
+            return granularity, 1
+    months = math.ceil(count_buckets(first, last, MONTH) / max_points)
+    while count_buckets(first, last, MONTH, months) > max_points:
+        months += 1
+    return MONTH, months
+
+
+def build_history(rows, first=None, last=None, max_points=HISTORY_POINTS):
+    """Функция строит историю оценок из дневных сводок. Количество точек
+    не больше max_points: дневные сводки объединяются в недельные или
+    месячные, если дней в периоде больше.
+    :param rows: дневные сводки за период - кортежи (день, количество,
+    сумма, минимум, максимум), упорядоченные по дням;
+    :param first, last: первый и последний дни периода - объекты date.
+    Если None, то период начинается с первой сводки или заканчивается
+    последней сводкой;
+    :param max_points: максимальное количество точек.
+    :return: словарь с уровнем детализации (GRANULARITY), количеством
+    месяцев в интервале для уровня MONTH (MONTHS) и списком точек
+    (POINTS). Точка - словарь с первым днем интервала (DATE), количеством
+    (COUNT), минимумом (MIN), средним (MEAN) и максимумом (MAX) оценок за
+    интервал. Интервалы без оценок пропускаются."""
+
+    if not rows:
+        return {GRANULARITY: DAY, POINTS: []}
+    if first is None:
+        first = parse_day(rows[0][0])
+    if last is None:
+        last = parse_day(rows[-1][0])
+    granularity, months = choose_granularity(first, last, max(1, max_points))
+    points = []
+    bucket = None
+    for day, count, total, min_rating, max_rating in rows:
+        start = get_bucket(parse_day(day), granularity, months)
+        if start != bucket:
+            bucket = start
+            points.append([start, count, total, min_rating, max_rating])
+            continue
+        point = points[-1]
+        point[1] += count
+        point[2] += total
+        point[3] = min(point[3], min_rating)
+        point[4] = max(point[4], max_rating)
+    history = {GRANULARITY: granularity,
+               POINTS: [{DATE: start.strftime(DAY_FORMAT), COUNT: count,
+                         MIN: min_rating, MEAN: total / count,
+                         MAX: max_rating}
+                        for start, count, total, min_rating, max_rating
+                        in points]}
+    if granularity == MONTH:
+        history[MONTHS] = months
+    return history
+
+
+def parse_day(text):
+    """Функция преобразует день из сводки в объект date.
+    :param text: день в формате DAY_FORMAT.
+    :return: объект date."""
+
+    return date(int(text[:4]), int(text[5:7]), int(text[8:10]))
@@ -0,0 +1,166 @@
+"""Модуль содержит определение классов для ограничения частоты запросов
+клиентов. Для каждого соединения и для каждого IP адреса заводятся
+отдельные ведра токенов для запросов на чтение и на запись. Запрос
+принимается, только если токенов хватает в обоих ведрах."""
+
+import time
+from const import *
+
+
+class TokenBucket:
+    """Класс ведра токенов. Ведро пополняется с постоянной скоростью до
+    своей вместимости, а каждый запрос забирает из него токены."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        """Конструктор.
+        :param rate: количество токенов, добавляемых в ведро за секунду;
+        :param capacity: вместимость ведра (максимальная пачка запросов);
+        :param now: текущее время по time.monotonic()."""
+
+        self.rate = rate
+        self.capacity = capacity
+        # Новое ведро полное
+        self.tokens = capacity
+        self.updated = now
+
+    def is_full(self, now):
+        """Метод проверяет, пополнилось ли ведро до вместимости. Полное ведро
+        можно удалить: новое ведро будет таким же.
+        :param now: текущее время.
+        :return: True, если ведро полное."""
+
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+    def refill(self, now):
+        """Метод пополняет ведро токенами, накопившимися с последнего
+        обращения.
+        :param now: текущее время."""
+
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost):
+        """Метод вычисляет, через сколько секунд в ведре будет достаточно
+        токенов.
+        :param cost: количество токенов (не больше вместимости ведра).
+        :return: время в секундах (0, если токенов уже достаточно)."""
+
+        return max(0, (cost - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """Класс для ограничения частоты запросов на чтение и на запись от
+    каждого соединения и от каждого IP адреса."""
+
+    def __init__(self, rates, ip_factor=IP_RATE_FACTOR):
+        """Конструктор.
+        :param rates: словарь вид запросов (READ или WRITE) -> количество
+        запросов в секунду от одного соединения. Если 0, то запросы этого
+        вида не ограничиваются;
+        :param ip_factor: во сколько раз ограничение для IP адреса больше
+        ограничения для одного соединения."""
+
+        self.rates = rates
+        self.ip_factor = ip_factor
+        # Словари (вид запросов, сокет или IP адрес) -> ведро токенов
+        self.connection_buckets = {}
+        self.ip_buckets = {}
+        # Словарь сокет -> IP адрес для соединений, от которых были запросы,
+        # и словарь IP адрес -> количество таких соединений
+        self.ips = {}
+        self.ip_counts = {}
+        # Количество принятых и отклоненных запросов каждого вида
+        self.admitted = {READ: 0, WRITE: 0}
+        self.limited = {READ: 0, WRITE: 0}
+
+    def forget(self, sock):
+        """Метод удаляет ведра отключившегося соединения. Ведра IP адреса
+        остаются, пока не пополнятся, чтобы ограничение нельзя было обойти
+        переподключением.
+        :param sock: сокет клиента."""
+
+        ip = self.ips.pop(sock, None)
+        if ip is None:
+            return
+        for kind in (READ, WRITE):
+            self.connection_buckets.pop((kind, sock), None)
+        self.ip_counts[ip] -= 1
+        if self.ip_counts[ip]:
+            return
+        del self.ip_counts[ip]
+        now = time.monotonic()
+        for kind in (READ, WRITE):
+            bucket = self.ip_buckets.get((kind, ip))
+            if bucket is not None and bucket.is_full(now):
+                del self.ip_buckets[(kind, ip)]
+
+    def get_bucket(self, buckets, key, rate, now):
+        """Метод возвращает ведро токенов, создавая его при первом запросе.
+        :param buckets: словарь с ведрами;
+        :param key: ключ ведра;
+        :param rate: количество запросов в секунду;
+        :param now: текущее время.
+        :return: объект TokenBucket."""
+
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, max(1, rate * RATE_BURST_SECONDS), now)
+            buckets[key] = bucket
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def get_stats(self):
+        """Метод возвращает счетчики запросов.
+        :return: словарь с количеством принятых (ADMITTED) и отклоненных
+        из-за превышения частоты (LIMITED) запросов каждого вида."""
+
+        return {ADMITTED: dict(self.admitted), LIMITED: dict(self.limited)}
+
+    def prune(self):
+        """Метод удаляет ведра IP адресов без соединений, которые успели
+        пополниться."""
+
+        now = time.monotonic()
+        for key in [key for key, bucket in self.ip_buckets.items()
+                    if key[1] not in self.ip_counts and bucket.is_full(now)]:
+            del self.ip_buckets[key]
+
+    def take(self, sock, ip, kind, cost=1):
+        """Метод проверяет, можно ли принять запрос, и забирает токены из
+        ведер соединения и IP адреса.
+        :param sock: сокет клиента;
+        :param ip: IP адрес клиента;
+        :param kind: вид запроса (READ или WRITE);
+        :param cost: стоимость запроса в токенах. Стоимость больше
+        вместимости ведра уменьшается до вместимости, чтобы большой запрос
+        можно было принять хотя бы при полном ведре.
+        :return: 0, если запрос принят, иначе время в секундах, через
+        которое запрос можно повторить."""
+
+        rate = self.rates.get(kind)
+        if not rate:
+            self.admitted[kind] += 1
+            return 0
+        now = time.monotonic()
+        if sock not in self.ips:
+            self.ips[sock] = ip
+            self.ip_counts[ip] = self.ip_counts.get(ip, 0) + 1
+        buckets = (
+            self.get_bucket(self.connection_buckets, (kind, sock), rate, now),
+            self.get_bucket(self.ip_buckets, (kind, ip),
+                            rate * self.ip_factor, now))
+        costs = [min(cost, bucket.capacity) for bucket in buckets]
+        wait = max(bucket.wait_time(bucket_cost)
+                   for bucket, bucket_cost in zip(buckets, costs))
+        if wait:
+            self.limited[kind] += 1
+            return wait
+        for bucket, bucket_cost in zip(buckets, costs):
+            bucket.tokens -= bucket_cost
+        self.admitted[kind] += 1
+        return 0
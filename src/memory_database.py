@@ -0,0 +1,291 @@
+"""Модуль содержит класс хранилища данных сервера, которое полностью
+находится в памяти. Хранилище не обращается к диску и используется для тестов
+и замеров производительности сетевой части сервера."""
+
+import time
+from datetime import datetime, timedelta
+from history import DAY_FORMAT, DailyRollup
+from price_statistics import compute_statistics
+from rating_store import RatingStore
+from storage import Storage, limit_rating
+from const import *
+
+
+class MemoryDatabase(Storage):
+    """Класс хранилища данных сервера в памяти. Параметры и возвращаемые
+    значения методов описаны в классе Storage."""
+
+    def __init__(self, soft_delete=False, estimations=(), products=(),
+                 **kwargs):
+        """Конструктор.
+        :param soft_delete: принимается для совместимости с Database. Оценки
+        в памяти удаляются сразу, поэтому помечать их не нужно;
+        :param estimations: начальные фильтры - список кортежей (название
+        фильтра, минимальная оценка, максимальная оценка);
+        :param products: названия начальных товаров;
+        :param kwargs: остальные параметры Database, которые для хранилища в
+        памяти не имеют смысла."""
+
+        super().__init__(soft_delete)
+        # Словарь название фильтра -> данные фильтра
+        self.estimations = {}
+        # Словарь название товара -> ID товара
+        self.products = {}
+        # Оценки и словарь ID оценки -> (ID товара, ID фильтра, оценка, день
+        # оценки)
+        self.store = RatingStore()
+        self.ratings = {}
+        # Дневные сводки оценок для истории оценок
+        self.rollup = DailyRollup()
+        # Словарь ключ идемпотентности -> (ID оценки, время добавления по
+        # time.monotonic()). Ключи расположены в порядке добавления
+        self.rating_keys = {}
+        # Последние выданные ID
+        self.last_ids = {FILTER: 0, PRODUCT: 0, RATING: 0}
+        # Добавляем начальные фильтры и товары
+        for estimation in estimations:
+            self.add_estimation(*estimation)
+        for product_name in products:
+            self.add_product(product_name)
+
+    def next_id(self, table):
+        """Метод выдает следующий ID для записи.
+        :param table: тип записи (FILTER, PRODUCT или RATING).
+        :return: ID."""
+
+        self.last_ids[table] += 1
+        return self.last_ids[table]
+
+    def remove_ratings(self, rating_ids, history=True):
+        """Метод удаляет оценки.
+        :param rating_ids: список ID оценок;
+        :param history: если True, то дневные сводки оценок составляются
+        заново без удаленных оценок.
+        :return: список ID удаленных оценок."""
+
+        ids = []
+        days = set()
+        for rating_id in rating_ids:
+            row = self.ratings.pop(rating_id, None)
+            if row is None:
+                continue
+            product_id, estimation_id, rating, day = row
+            self.store.remove(product_id, estimation_id, rating_id, rating)
+            self.ratings_changed(product_id, estimation_id)
+            days.add((product_id, estimation_id, day))
+            ids.append(rating_id)
+        if ids:
+            # Ключи идемпотентности удаляются вместе с оценками
+            removed = set(ids)
+            for key in [key for key, (rating_id, _) in self.rating_keys.items()
+                        if rating_id in removed]:
+                del self.rating_keys[key]
+        if history:
+            for product_id, estimation_id, day in days:
+                columns = self.store.columns.get((product_id, estimation_id))
+                start = datetime.strptime(day, DAY_FORMAT)
+                end = (start + timedelta(days=1)).timestamp()
+                start = start.timestamp()
+                ratings = [] if columns is None else [
+                    columns.ratings[k] for k in range(len(columns))
+                    if start <= columns.dates[k] < end]
+                self.rollup.set_day((product_id, estimation_id), day, ratings)
+        return ids
+
+    def add_estimation(self, estimation_name, min_value=None, max_value=None):
+        if estimation_name in self.estimations:
+            return None
+        estimation = {ID: self.next_id(FILTER), FILTER: estimation_name,
+                      MIN: min_value, MAX: max_value}
+        self.estimations[estimation_name] = estimation
+        self.catalog_changed()
+        return dict(estimation)
+
+    def add_product(self, product_name):
+        if product_name in self.products:
+            return None
+        product_id = self.next_id(PRODUCT)
+        self.products[product_name] = product_id
+        self.product_index.add(product_id, product_name)
+        self.catalog_changed()
+        return {ID: product_id, PRODUCT: product_name}
+
+    def add_rating(self, product_name, estimation_name, rating, address,
+                   key=None):
+        if key is not None and key in self.rating_keys:
+            return self.rating_keys[key][0]
+        e = self.estimations.get(estimation_name)
+        if not e:
+            return
+        if product_name not in self.products:
+            self.add_product(product_name)
+        product_id = self.products[product_name]
+        rating = limit_rating(rating, e[MIN], e[MAX])
+        rating_id = self.next_id(RATING)
+        date = datetime.now()
+        day = date.strftime(DAY_FORMAT)
+        self.store.add(product_id, e[ID], rating_id, rating, date, address)
+        self.ratings[rating_id] = (product_id, e[ID], rating, day)
+        self.rollup.add((product_id, e[ID]), day, rating)
+        if key is not None:
+            self.rating_keys[key] = (rating_id, time.monotonic())
+        self.rating_added(product_id, e[ID], rating, address)
+        return rating_id
+
+    def archive_ratings(self, days, batch_size=ARCHIVE_BATCH_SIZE):
+        """Метод удаляет оценки старше заданного количества дней. Архивных
+        баз данных у хранилища в памяти нет, но дневные сводки оценок, как и
+        в Database, остаются."""
+
+        cutoff = (datetime.now() - timedelta(days=days)).timestamp()
+        old = []
+        for columns in self.store.columns.values():
+            old.extend(columns.ids[k] for k in range(len(columns))
+                       if columns.dates[k] < cutoff)
+        return len(self.remove_ratings(sorted(old)[:batch_size], False))
+
+    def change_estimation(self, estimation_name, min_value=None,
+                          max_value=None):
+        e = self.estimations.get(estimation_name)
+        if e:
+            e[MIN] = min_value
+            e[MAX] = max_value
+            self.catalog_changed()
+
+    def compact(self, batch_size=COMPACTION_BATCH_SIZE):
+        # Помеченных оценок в памяти не бывает
+        return 0
+
+    def create_backup(self, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+        # Данные в памяти не сохраняются в файл, копировать нечего
+        return None
+
+    def delete_product(self, product_name):
+        product_id = self.products.pop(product_name, None)
+        if product_id is None:
+            return False
+        self.store.remove_product(product_id)
+        self.rollup.remove_product(product_id)
+        rating_ids = {rating_id for rating_id, row in self.ratings.items()
+                      if row[0] == product_id}
+        for rating_id in rating_ids:
+            del self.ratings[rating_id]
+        # Ключи идемпотентности удаляются вместе с оценками
+        for key in [key for key, (rating_id, _) in self.rating_keys.items()
+                    if rating_id in rating_ids]:
+            del self.rating_keys[key]
+        self.product_index.remove(product_id)
+        self.catalog_changed()
+        self.ratings_changed(product_id)
+        return True
+
+    def delete_ratings(self, rating_ids):
+        return self.remove_ratings(rating_ids)
+
+    def expire_rating_keys(self, max_age=IDEMPOTENCY_KEY_TTL,
+                           batch_size=KEY_EXPIRY_BATCH_SIZE):
+        # Ключи добавлены по порядку, поэтому устаревшие ключи - в начале
+        # словаря
+        cutoff = time.monotonic() - max_age
+        expired = []
+        for key, (_, created) in self.rating_keys.items():
+            if created >= cutoff or len(expired) == batch_size:
+                break
+            expired.append(key)
+        for key in expired:
+            del self.rating_keys[key]
+        return len(expired)
+
+    def get_estimation_id(self, estimation_name):
+        e = self.estimations.get(estimation_name)
+        return e[ID] if e else None
+
+    def get_estimation_limits(self, estimation_name):
+        e = self.estimations.get(estimation_name)
+        if not e:
+            return (None, None)
+        return (e[MIN], e[MAX])
+
+    def get_estimations(self):
+        return [dict(e) for e in self.estimations.values()]
+
+    def get_latest_prices(self, estimation_id, product_id=None):
+        rows = []
+        for (key_product_id, key_estimation_id), columns in \
+                self.store.columns.items():
+            if key_estimation_id != estimation_id or \
+                    product_id not in (None, key_product_id):
+                continue
+            # Для каждого магазина - номер последней оценки в столбцах
+            latest = {}
+            for k, address_id in enumerate(columns.addresses):
+                i = latest.get(address_id)
+                if i is None or columns.ids[k] > columns.ids[i]:
+                    latest[address_id] = k
+            rows.extend((key_product_id, self.store.address_list[address_id],
+                         columns.ratings[k])
+                        for address_id, k in latest.items())
+        return rows
+
+    def get_products(self):
+        return [{ID: product_id, PRODUCT: name}
+                for name, product_id in self.products.items()]
+
+    def get_rating_days(self, key, first=None, last=None):
+        return self.rollup.get_rows(key, first, last)
+
+    def get_rating_id_by_key(self, key):
+        row = self.rating_keys.get(key)
+        return None if row is None else row[0]
+
+    def get_rating_rows(self, product_name, estimation_name, since=None,
+                        until=None, sort=RATING, order=ASC, min_rating=None,
+                        max_rating=None, address=None, limit=None,
+                        offset=0):
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            return []
+        return self.store.select(*key, since, until, sort, order, min_rating,
+                                 max_rating, address, limit, offset)
+
+    def get_rating_rows_batch(self, keys, sort=RATING, order=ASC,
+                              limit=BATCH_RATINGS_LIMIT):
+        return {key: self.store.select(*key, sort=sort, order=order,
+                                       limit=limit) for key in keys}
+
+    def get_key(self, product_name, estimation_name):
+        """Метод возвращает пару (ID товара, ID фильтра).
+        :param product_name: название товара;
+        :param estimation_name: название фильтра.
+        :return: пара ID или None, если товара или фильтра нет."""
+
+        product_id = self.products.get(product_name)
+        e = self.estimations.get(estimation_name)
+        if product_id is None or e is None:
+            return None
+        return (product_id, e[ID])
+
+    def get_statistics(self, product_name, estimation_name, since=None,
+                       until=None):
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            return None
+        try:
+            return self.get_cached_statistics(key, (since, until))
+        except KeyError:
+            pass
+        columns = self.store.columns.get(key)
+        if columns is None:
+            return None
+        statistics = compute_statistics(
+            columns.ratings, columns.dates, columns.addresses,
+            self.store.address_list, since.timestamp() if since else None,
+            until.timestamp() if until else None)
+        self.cache_statistics(key, (since, until), statistics)
+        return statistics
+
+    def get_summary(self, product_name, estimation_name):
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            return None
+        return self.store.summary(*key)
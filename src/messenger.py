@@ -3,24 +3,105 @@
 
 import json
 import struct
-from const import ENCODING
+import zlib
+from importlib.util import find_spec
+from const import (COMPRESSION_LEVEL, COMPRESSION_THRESHOLD, ENCODING,
+                   MAX_PACKAGE_LENGTH, ZLIB, ZSTD)
+
+# Модуль zstandard импортируется при первом сжатии или распаковке сообщения,
+# чтобы не замедлять запуск программ, которым сжатие zstd не понадобится
+zstandard = None
+
+# Префикс сообщения - 4 байта. В двух старших битах записан номер способа
+# сжатия сообщения, в остальных - длина сообщения
+CODEC_SHIFT = 30
+LENGTH_MASK = (1 << CODEC_SHIFT) - 1
+# Номера способов сжатия сообщения (0 - сообщение не сжато)
+CODEC_NUMBERS = {ZLIB: 1, ZSTD: 2}
+CODEC_NAMES = {number: name for name, number in CODEC_NUMBERS.items()}
+
+
+def get_zstandard():
+    """Функция импортирует модуль zstandard при первом обращении.
+    :return: модуль zstandard."""
+
+    global zstandard
+    if zstandard is None:
+        import zstandard as module
+        zstandard = module
+    return zstandard
+
+
+def compress(codec, data):
+    """Функция сжимает данные.
+    :param codec: способ сжатия (ZLIB или ZSTD);
+    :param data: данные.
+    :return: сжатые данные."""
+
+    if codec == ZSTD:
+        return get_zstandard().ZstdCompressor().compress(data)
+    return zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def decompress(codec, data, max_length):
+    """Функция распаковывает данные.
+    :param codec: способ сжатия (ZLIB или ZSTD);
+    :param data: сжатые данные;
+    :param max_length: максимальный размер распакованных данных.
+    :return: распакованные данные."""
+
+    if codec == ZSTD:
+        if get_zstandard().frame_content_size(data) > max_length:
+            raise ValueError('Слишком большое сообщение')
+        return zstandard.ZstdDecompressor().decompress(
+            data, max_output_size=max_length)
+    # Распаковываем не больше max_length + 1 байт, чтобы не тратить память
+    # на слишком большие сообщения
+    result = zlib.decompressobj().decompress(data, max_length + 1)
+    if len(result) > max_length:
+        raise ValueError('Слишком большое сообщение')
+    return result
+
+
+def get_codecs():
+    """Функция возвращает способы сжатия, доступные в этой программе, в
+    порядке предпочтения.
+    :return: список способов сжатия."""
+
+    if find_spec('zstandard') is not None:
+        return [ZSTD, ZLIB]
+    return [ZLIB]
 
 
 class Messenger:
     """Класс для отправки и получения сообщений между клиентом и сервером."""
 
-    def __init__(self):
-        """Конструктор."""
+    def __init__(self, max_length=MAX_PACKAGE_LENGTH):
+        """Конструктор.
+        :param max_length: максимальный размер принимаемого сообщения в
+        байтах. Сообщения большего размера отклоняются до их чтения."""
 
-        pass
+        # Способы сжатия сообщений, которые поддерживает эта программа
+        self.codecs = get_codecs()
+        self.max_length = max_length
 
-    def get_msg(self, sock):
-        """Метод принимает и декодирует сообщение.
-        :param sock: сокет, откуда получается сообщение.
-        :return: полученное сообщение-словарь."""
+    def choose_codec(self, peer_codecs):
+        """Метод выбирает способ сжатия сообщений, который поддерживают обе
+        стороны.
+        :param peer_codecs: список способов сжатия, которые поддерживает
+        другая сторона.
+        :return: способ сжатия или None, если общего способа нет."""
+
+        for codec in self.codecs:
+            if codec in (peer_codecs or []):
+                return codec
+        return None
+
+    def decode_msg(self, encoded_msg):
+        """Метод декодирует сообщение.
+        :param encoded_msg: сообщение, прочитанное методом receive_all_msg.
+        :return: сообщение-словарь."""
 
-        # Получаем закодированное сообщение-словарь
-        encoded_msg = self.receive_all_msg(sock)
         if not isinstance(encoded_msg, bytes):
             # Если encoded_msg не является закодированным объектом, это ошибка
             raise ValueError
@@ -31,16 +112,34 @@ class Messenger:
         # Получаем бинарный файл, присланный вместе с сообщением-словарем
         return msg
 
+    def get_msg(self, sock):
+        """Метод принимает и декодирует сообщение.
+        :param sock: сокет, откуда получается сообщение.
+        :return: полученное сообщение-словарь."""
+
+        # Получаем закодированное сообщение-словарь
+        return self.decode_msg(self.receive_all_msg(sock))
+
     def receive_all_msg(self, sock):
         """Метод для чтения всего сообщения.
         :param sock: сокет, откуда получается сообщение.
         :return: полученное сообщение."""
 
-        # Получаем длину сообщения-словаря
+        # Получаем длину сообщения-словаря и способ его сжатия
         raw_msg_len = self.receive_given_size_msg(sock, 4)
-        msg_len = struct.unpack('>I', raw_msg_len)[0]
+        if raw_msg_len is None:
+            return None
+        prefix = struct.unpack('>I', raw_msg_len)[0]
+        codec = CODEC_NAMES.get(prefix >> CODEC_SHIFT)
+        msg_len = prefix & LENGTH_MASK
+        if msg_len > self.max_length:
+            # Слишком большое сообщение не читаем
+            raise ValueError('Слишком большое сообщение')
         # Получаем словарь-сообщение и бинарный файл
-        return self.receive_given_size_msg(sock, msg_len)
+        data = self.receive_given_size_msg(sock, msg_len)
+        if data is not None and codec is not None:
+            data = decompress(codec, data, self.max_length)
+        return data
 
     def receive_given_size_msg(self, sock, n):
         """Метод для чтения сообщения заданного размера.
@@ -48,29 +147,72 @@ class Messenger:
         :param n: размер сообщения, которое нужно прочесть.
         :return: прочтенное сообщение."""
 
-        data = b''
+        data = bytearray()
         while len(data) < n:
             packet = sock.recv(n - len(data))
             if not packet:
                 return None
             data += packet
-        return data
+        return bytes(data)
 
-    def send_msg(self, sock, message):
+    def send_msg(self, sock, message, codec=None):
         """Метод кодирует и отправляет сообщение. Протокол отправки сообщений
-        следующий. Сначала отправляются 4 байта с размером словаря-сообщения,
-        а потом отправляется словарь-сообщение.
+        следующий. Сначала отправляются 4 байта с размером словаря-сообщения
+        и способом его сжатия, а потом отправляется словарь-сообщение.
         :param sock: сокет, куда отправляется сообщение;
-        :param message: словарь-сообщение для отправки."""
+        :param message: словарь-сообщение для отправки;
+        :param codec: способ сжатия, который поддерживает получатель. Если
+        None, то сообщение не сжимается. Сообщения короче
+        COMPRESSION_THRESHOLD байт не сжимаются."""
 
         # Словарь-сообщение преобразовывается в JSON-объект и кодируется
         json_msg = json.dumps(message)
         encoded_msg = json_msg.encode(ENCODING)
+        codec_number = 0
+        if codec in CODEC_NUMBERS and len(encoded_msg) >= \
+                COMPRESSION_THRESHOLD:
+            compressed_msg = compress(codec, encoded_msg)
+            if len(compressed_msg) < len(encoded_msg):
+                encoded_msg = compressed_msg
+                codec_number = CODEC_NUMBERS[codec]
         # Получаем массив из префикса в 4 байт длиной (в котором длина словаря-
         # сообщения) и словаря-сообщения
-        msg = struct.pack('>I', len(encoded_msg)) + encoded_msg
+        prefix = (codec_number << CODEC_SHIFT) | len(encoded_msg)
+        msg = struct.pack('>I', prefix) + encoded_msg
         # Отправляем сообщение
         while msg:
             # Количество отправленных байт
             sent_num = sock.send(msg)
             msg = msg[sent_num:]
+
+
+if __name__ == '__main__':
+
+    # Замер степени сжатия и затрат времени на сжатие ответов GET_RATINGS
+    # разного размера для подбора COMPRESSION_THRESHOLD
+    import random
+    import time
+    from const import ACTION, ADDRESS, CONTENT, DATE, GET_RATINGS, ID, \
+        RATING, STATUS
+
+    addresses = [f'Москва, ул. Тверская, д. {i}' for i in range(50)]
+    for n in (1, 10, 100, 1000, 10000):
+        message = {ACTION: GET_RATINGS, STATUS: 200, CONTENT: [
+            {ID: i, ADDRESS: random.choice(addresses),
+             DATE: f'2021-03-{random.randint(10, 31)} 12:00:00',
+             RATING: round(random.uniform(50, 500), 2)} for i in range(n)]}
+        data = json.dumps(message).encode(ENCODING)
+        for codec in get_codecs():
+            start = time.perf_counter()
+            for _ in range(10):
+                compressed = compress(codec, data)
+            compress_time = (time.perf_counter() - start) / 10
+            start = time.perf_counter()
+            for _ in range(10):
+                decompress(codec, compressed, len(data))
+            decompress_time = (time.perf_counter() - start) / 10
+            print(f'{n:>6} оценок, {codec}: {len(data):>8} -> '
+                  f'{len(compressed):>7} байт '
+                  f'({100 * len(compressed) / len(data):5.1f}%), сжатие '
+                  f'{1000 * compress_time:7.3f} мс, распаковка '
+                  f'{1000 * decompress_time:7.3f} мс')
@@ -1,13 +1,21 @@
 """Модуль содержит модели таблиц из базы данных."""
 
 from datetime import datetime
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy import (Boolean, Column, Date, DateTime, Float, ForeignKey,
+                        Index, Integer, String)
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_method
 from sqlalchemy.orm import relationship
 from const import *
 
 Base = declarative_base()
+# Базовый класс для моделей архивных баз данных (по одной на каждый месяц)
+ArchiveBase = declarative_base()
+# Тип даты оценки. В SQLite дата хранится без микросекунд, то есть строкой в
+# формате DATE_FORMAT, и передается клиенту без преобразований
+RatingDate = DateTime().with_variant(
+    sqlite.DATETIME(truncate_microseconds=True), 'sqlite')
 
 
 class Estimation(Base):
@@ -71,6 +79,16 @@ class Rating(Base):
     """Модель таблицы с оценками товаров по разным фильтрам."""
 
     __tablename__ = 'rating'
+    __table_args__ = (
+        # Индекс для выборки оценок товара по фильтру за период времени
+        Index('ix_rating_product_estimation_date', 'product_id',
+              'estimation_id', 'date'),
+        # Индексы для сортировки оценок товара по фильтру
+        Index('ix_rating_product_estimation_rating', 'product_id',
+              'estimation_id', 'rating'),
+        Index('ix_rating_product_estimation_address', 'product_id',
+              'estimation_id', 'address'),
+    )
     id = Column(Integer, autoincrement=True, primary_key=True)
     # Ссылка на товар
     product_id = Column(Integer, ForeignKey('product.id'), nullable=False)
@@ -82,7 +100,10 @@ class Rating(Base):
     # Адрес магазина, в котором приобретен товар
     address = Column(String, nullable=False)
     # Дата оценки товара
-    date = Column(DateTime, nullable=False, default=datetime.now)
+    date = Column(RatingDate, nullable=False, default=datetime.now,
+                  index=True)
+    # Признак удаленной оценки (используется при мягком удалении)
+    deleted = Column(Boolean, nullable=False, default=False, index=True)
 
     def __init__(self, product, estimation, rating, address):
         """Конструктор.
@@ -103,4 +124,79 @@ class Rating(Base):
         """Метод возвращает словарь из данных оценки товара."""
 
         return {ID: self.id, ADDRESS: self.address, RATING: self.rating,
-                DATE: self.date.strftime('%Y-%m-%d %H:%M:%S')}
+                DATE: self.date.strftime(DATE_FORMAT)}
+
+
+class RatingDay(Base):
+    """Модель таблицы с дневными сводками оценок товаров по фильтрам.
+    Сводка обновляется в той же транзакции, что и добавление или удаление
+    оценки, и используется для построения истории оценок без чтения самих
+    оценок. Сводки не удаляются при переносе оценок в архив, поэтому
+    история охватывает и архивные оценки."""
+
+    __tablename__ = 'rating_day'
+    # Ссылки на товар и фильтр
+    product_id = Column(Integer, ForeignKey('product.id'), primary_key=True)
+    estimation_id = Column(Integer, ForeignKey('estimation.id'),
+                           primary_key=True)
+    # День оценок
+    day = Column(Date, primary_key=True)
+    # Количество, сумма, минимум и максимум оценок за день
+    count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    min_rating = Column(Float, nullable=False)
+    max_rating = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f'<RatingDay({self.product_id}, {self.estimation_id}, {self.day})>'
+
+
+class RatingKey(Base):
+    """Модель таблицы с ключами идемпотентности добавленных оценок. Ключ
+    записывается в той же транзакции, что и оценка, поэтому повтор запроса
+    с тем же ключом находит уже добавленную оценку одним поиском по
+    первичному ключу."""
+
+    __tablename__ = 'rating_key'
+    # Ключ, присланный клиентом вместе с оценкой
+    key = Column(String, primary_key=True)
+    # ID оценки, добавленной с этим ключом
+    rating_id = Column(Integer, nullable=False)
+    # Время добавления ключа (по нему удаляются устаревшие ключи)
+    created = Column(DateTime, nullable=False, default=datetime.now,
+                     index=True)
+
+    def __repr__(self):
+        return f'<RatingKey({self.key}, {self.rating_id})>'
+
+
+class ArchivedRating(ArchiveBase):
+    """Модель таблицы с устаревшими оценками товаров в архивной базе
+    данных."""
+
+    __tablename__ = 'rating'
+    id = Column(Integer, primary_key=True)
+    # ID товара
+    product_id = Column(Integer, nullable=False)
+    # ID фильтра, по которому оценивался товар
+    estimation_id = Column(Integer, nullable=False)
+    # Оценка товара по выбранному фильтру
+    rating = Column(Float)
+    # Адрес магазина, в котором приобретен товар
+    address = Column(String, nullable=False)
+    # Дата оценки товара
+    date = Column(DateTime, nullable=False)
+
+    def __init__(self, rating):
+        """Конструктор.
+        :param rating: переносимая в архив оценка - объект типа Rating."""
+
+        self.id = rating.id
+        self.product_id = rating.product_id
+        self.estimation_id = rating.estimation_id
+        self.rating = rating.rating
+        self.address = rating.address
+        self.date = rating.date
+
+    def __repr__(self):
+        return f'<ArchivedRating({self.product_id}, {self.estimation_id}, {self.rating})>'
@@ -0,0 +1,120 @@
+"""Модуль содержит функции для расчета статистики оценок товара. Если
+установлен NumPy, расчеты выполняются векторно, иначе - на чистом Python."""
+
+import bisect
+import math
+from array import array
+from const import *
+
+# Модуль NumPy (False, если NumPy не установлен). Импортируется при первом
+# расчете статистики, так как импорт NumPy заметно замедляет запуск сервера
+numpy_module = None
+
+
+def get_numpy():
+    """Функция импортирует NumPy при первом обращении.
+    :return: модуль numpy или None, если NumPy не установлен."""
+
+    global numpy_module
+    if numpy_module is None:
+        try:
+            import numpy
+            numpy_module = numpy
+        except ImportError:
+            numpy_module = False
+    return numpy_module or None
+
+
+def compute_statistics(ratings, dates, addresses, address_list, since=None,
+                       until=None, bins=HISTOGRAM_BINS):
+    """Функция рассчитывает статистику оценок товара.
+    :param ratings: массив array('d') оценок, отсортированных по возрастанию;
+    :param dates: массив array('q') дат оценок в секундах от начала эпохи;
+    :param addresses: массив array('i') номеров адресов магазинов;
+    :param address_list: список адресов магазинов по номерам;
+    :param since, until: начало и конец (не включительно) периода времени в
+    секундах от начала эпохи. Если None, то период не ограничен;
+    :param bins: количество интервалов гистограммы.
+    :return: словарь со статистикой или None, если оценок нет."""
+
+    np = get_numpy()
+    if np is not None:
+        ratings = np.frombuffer(ratings, dtype=np.float64)
+        addresses = np.frombuffer(addresses, dtype=np.int32)
+        if since is not None or until is not None:
+            dates = np.frombuffer(dates, dtype=np.int64)
+            mask = np.ones(len(dates), dtype=bool)
+            if since is not None:
+                mask &= dates >= since
+            if until is not None:
+                mask &= dates < until
+            ratings = ratings[mask]
+            addresses = addresses[mask]
+        if not len(ratings):
+            return None
+        mean = float(ratings.mean())
+        std = float(ratings.std())
+        # Минимальная оценка в каждом магазине
+        store_min = np.full(len(address_list), np.inf)
+        np.minimum.at(store_min, addresses, ratings)
+        stores = [(address_list[i], float(store_min[i]))
+                  for i in np.flatnonzero(np.isfinite(store_min))]
+        search = ratings.searchsorted
+    else:
+        if since is not None or until is not None:
+            rows = [k for k in range(len(dates)) if
+                    (since is None or dates[k] >= since) and
+                    (until is None or dates[k] < until)]
+            ratings = array('d', (ratings[k] for k in rows))
+            addresses = array('i', (addresses[k] for k in rows))
+        if not len(ratings):
+            return None
+        mean = math.fsum(ratings) / len(ratings)
+        std = math.sqrt(math.fsum((x - mean) ** 2 for x in ratings) /
+                        len(ratings))
+        # Оценки отсортированы, поэтому первая оценка магазина минимальна
+        store_min = {}
+        for address, rating in zip(addresses, ratings):
+            if address not in store_min:
+                store_min[address] = rating
+        stores = [(address_list[i], rating)
+                  for i, rating in store_min.items()]
+
+        def search(values):
+            return [bisect.bisect_left(ratings, value) for value in values]
+
+    # Гистограмма с интервалами равной ширины. Так как оценки отсортированы,
+    # количество оценок в интервалах находится двоичным поиском
+    low = float(ratings[0])
+    high = float(ratings[-1])
+    width = (high - low) / bins or 1.0
+    edges = [low + i * width for i in range(bins)] + \
+        [high if high > low else low + bins * width]
+    bounds = list(search(edges[1:-1])) + [len(ratings)]
+    counts = [int(bounds[0])] + [int(bounds[i] - bounds[i - 1])
+                                 for i in range(1, bins)]
+    stores.sort(key=lambda x: x[1])
+    return {COUNT: len(ratings),
+            MIN: low,
+            MAX: high,
+            MEAN: mean,
+            STD: std,
+            MEDIAN: percentile(ratings, 50),
+            P10: percentile(ratings, 10),
+            P90: percentile(ratings, 90),
+            HISTOGRAM: {EDGES: edges, COUNT: counts},
+            STORES: [{ADDRESS: address, MIN: rating}
+                     for address, rating in stores]}
+
+
+def percentile(ratings, q):
+    """Функция вычисляет перцентиль отсортированных оценок с линейной
+    интерполяцией между соседними оценками.
+    :param ratings: оценки, отсортированные по возрастанию;
+    :param q: перцентиль от 0 до 100.
+    :return: значение перцентиля."""
+
+    position = (len(ratings) - 1) * q / 100
+    i = int(position)
+    j = min(i + 1, len(ratings) - 1)
+    return float(ratings[i] + (ratings[j] - ratings[i]) * (position - i))
@@ -0,0 +1,378 @@
+"""Модуль содержит запросы SQLAlchemy Core для частых операций с базой данных
+сервера. Каждый запрос строится и компилируется один раз, а затем
+выполняется с разными значениями параметров и возвращает кортежи, а не
+объекты ORM. Поэтому при обработке запросов клиентов время не тратится на
+построение объектов Query, компиляцию SQL и карту идентичности сессии."""
+
+from sqlalchemy import and_, bindparam, func, or_, select, text, union_all
+from models import Estimation, Product, Rating, RatingDay, RatingKey
+from const import *
+
+# Поля, по которым можно сортировать оценки
+SORT_COLUMNS = {ADDRESS: Rating.address, DATE: Rating.date,
+                RATING: Rating.rating}
+# Номера полей сортировки в строке оценки, которую возвращает запрос оценок
+SORT_INDEXES = {ADDRESS: 1, DATE: 3, RATING: 2}
+# Символ для экранирования % и _ в шаблонах LIKE
+LIKE_ESCAPE = '/'
+# Первый элемент ключа запроса оценок сразу нескольких товаров
+BATCH = 'batch'
+
+# Последние оценки товаров в каждом магазине (ID оценки растет со временем
+# добавления оценки)
+LATEST = Rating.__table__.alias('latest')
+
+# Запросы без условий, которые меняются от вызова к вызову
+STATEMENTS = {
+    'estimation': select([Estimation.id, Estimation.min_value,
+                          Estimation.max_value]).where(
+        Estimation.name == bindparam('name')),
+    'estimations': select([Estimation.id, Estimation.name,
+                           Estimation.min_value,
+                           Estimation.max_value]).order_by(Estimation.id),
+    'product_id': select([Product.id]).where(
+        Product.name == bindparam('name')),
+    'products': select([Product.id, Product.name]).order_by(Product.id),
+    # Пары ID для всех сочетаний названий товаров и фильтров из списков
+    'keys': select([Product.id, Product.name, Estimation.id,
+                    Estimation.name]).where(and_(
+        Product.name.in_(bindparam('products', expanding=True)),
+        Estimation.name.in_(bindparam('estimations', expanding=True)))),
+    # Последние цены всех товаров во всех магазинах по фильтру
+    'latest_prices': select([Rating.product_id, Rating.address,
+                             Rating.rating]).where(Rating.id.in_(
+        select([func.max(LATEST.c.id)]).where(and_(
+            LATEST.c.estimation_id == bindparam('estimation_id'),
+            LATEST.c.deleted == False)).group_by(LATEST.c.product_id,
+                                                 LATEST.c.address))),
+    # Последние цены одного товара во всех магазинах по фильтру
+    'latest_product_prices': select([Rating.product_id, Rating.address,
+                                     Rating.rating]).where(Rating.id.in_(
+        select([func.max(LATEST.c.id)]).where(and_(
+            LATEST.c.product_id == bindparam('product_id'),
+            LATEST.c.estimation_id == bindparam('estimation_id'),
+            LATEST.c.deleted == False)).group_by(LATEST.c.address))),
+    'insert_rating': Rating.__table__.insert().values(
+        product_id=bindparam('product_id'),
+        estimation_id=bindparam('estimation_id'),
+        rating=bindparam('rating'), address=bindparam('address'),
+        date=bindparam('date'), deleted=False),
+    # Дневная сводка обновляется при добавлении оценки: новая сводка
+    # создается, а существующая дополняется оценкой. В SQLAlchemy 1.3 нет
+    # INSERT ... ON CONFLICT для SQLite, поэтому запрос записан текстом
+    'add_rating_day': text(
+        'INSERT INTO rating_day (product_id, estimation_id, day, count, '
+        'total, min_rating, max_rating) VALUES (:product_id, '
+        ':estimation_id, :day, 1, :rating, :rating, :rating) '
+        'ON CONFLICT (product_id, estimation_id, day) DO UPDATE SET '
+        'count = count + 1, total = total + excluded.total, '
+        'min_rating = min(min_rating, excluded.min_rating), '
+        'max_rating = max(max_rating, excluded.max_rating)'),
+    # Пересчет дневной сводки по оставшимся оценкам после удаления оценок.
+    # Дни передаются строками 'YYYY-MM-DD', а дата оценки хранится строкой
+    # в формате DATE_FORMAT, поэтому строки можно сравнивать
+    'delete_rating_day': text(
+        'DELETE FROM rating_day WHERE product_id = :product_id AND '
+        'estimation_id = :estimation_id AND day = :day'),
+    'rollup_rating_day': text(
+        'INSERT INTO rating_day (product_id, estimation_id, day, count, '
+        'total, min_rating, max_rating) SELECT product_id, estimation_id, '
+        ':day, count(*), sum(rating), min(rating), max(rating) FROM rating '
+        'WHERE product_id = :product_id AND estimation_id = :estimation_id '
+        'AND date >= :day AND date < :next_day AND deleted = 0 AND '
+        'rating IS NOT NULL GROUP BY product_id, estimation_id'),
+    # Дневные сводки товара по фильтру за период (границы включительно)
+    'rating_days': select([RatingDay.day, RatingDay.count, RatingDay.total,
+                           RatingDay.min_rating,
+                           RatingDay.max_rating]).where(and_(
+        RatingDay.product_id == bindparam('product_id'),
+        RatingDay.estimation_id == bindparam('estimation_id'),
+        RatingDay.day >= bindparam('first'),
+        RatingDay.day <= bindparam('last'))).order_by(RatingDay.day),
+    'rating_key': select([RatingKey.rating_id]).where(
+        RatingKey.key == bindparam('idempotency_key')),
+    'insert_rating_key': RatingKey.__table__.insert().values(
+        key=bindparam('idempotency_key'), rating_id=bindparam('rating_id'),
+        created=bindparam('created')),
+}
+
+
+def escape_like(text):
+    """Функция экранирует в строке символы, имеющие особый смысл в шаблонах
+    LIKE.
+    :param text: строка.
+    :return: экранированная строка."""
+
+    return text.replace(LIKE_ESCAPE, 2 * LIKE_ESCAPE).replace(
+        '%', LIKE_ESCAPE + '%').replace('_', LIKE_ESCAPE + '_')
+
+
+def ratings_query(sort=RATING, order=ASC, since=False, until=False,
+                  min_rating=False, max_rating=False, address=False,
+                  after=False):
+    """Функция строит запрос оценок товара по фильтру (параметры
+    product_id и estimation_id). В запрос добавляются только нужные условия
+    отбора, а их значения передаются при выполнении запроса.
+    :param sort: поле, по которому сортируются оценки;
+    :param order: направление сортировки;
+    :param since, until, min_rating, max_rating, address: True, если нужно
+    условие отбора с параметром с таким же названием. Для адреса параметр -
+    шаблон LIKE;
+    :param after: True, если выборка продолжается после оценки, у которой
+    значение поля сортировки равно параметру last_value, а ID - параметру
+    last_id.
+    :return: запрос с параметрами limit и offset. Если limit = -1, то
+    количество оценок не ограничено."""
+
+    column = SORT_COLUMNS[sort]
+    conditions = [Rating.product_id == bindparam('product_id'),
+                  Rating.estimation_id == bindparam('estimation_id'),
+                  Rating.deleted == False]
+    if since:
+        conditions.append(Rating.date >= bindparam('since'))
+    if until:
+        conditions.append(Rating.date < bindparam('until'))
+    if min_rating:
+        conditions.append(Rating.rating >= bindparam('min_rating'))
+    if max_rating:
+        conditions.append(Rating.rating <= bindparam('max_rating'))
+    if address:
+        conditions.append(Rating.address.like(bindparam('address'),
+                                              escape=LIKE_ESCAPE))
+    if after:
+        value = bindparam('last_value', type_=column.type)
+        rating_id = bindparam('last_id')
+        if order == DESC:
+            conditions.append(or_(column < value, and_(
+                column == value, Rating.id < rating_id)))
+        else:
+            conditions.append(or_(column > value, and_(
+                column == value, Rating.id > rating_id)))
+    query = select([Rating.id, Rating.address, Rating.rating,
+                    Rating.date]).where(and_(*conditions))
+    if order == DESC:
+        query = query.order_by(column.desc(), Rating.id.desc())
+    else:
+        query = query.order_by(column, Rating.id)
+    return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+
+def ratings_batch_query(sort=RATING, order=ASC, count=1):
+    """Функция строит запрос первых оценок сразу для нескольких пар (товар,
+    фильтр). Для каждой пары строится подзапрос с LIMIT, который читает по
+    индексу только нужные оценки, а подзапросы объединяются UNION ALL.
+    :param sort: поле, по которому сортируются оценки;
+    :param order: направление сортировки;
+    :param count: количество пар. ID товара и фильтра i-ой пары передаются
+    в параметрах product_id_i и estimation_id_i.
+    :return: запрос с параметром limit - количество оценок для каждой пары.
+    Строки результата - (ID товара, ID фильтра, ID оценки, адрес, оценка,
+    дата), упорядоченные по парам."""
+
+    column = SORT_COLUMNS[sort]
+    if order == DESC:
+        ordering = (column.desc(), Rating.id.desc())
+    else:
+        ordering = (column, Rating.id)
+    pairs = []
+    for i in range(count):
+        pair = select([Rating.product_id, Rating.estimation_id, Rating.id,
+                       Rating.address, Rating.rating, Rating.date]).where(
+            and_(Rating.product_id == bindparam(f'product_id_{i}'),
+                 Rating.estimation_id == bindparam(f'estimation_id_{i}'),
+                 Rating.deleted == False)).order_by(*ordering).limit(
+            bindparam('limit')).alias(f'pair_{i}')
+        pairs.append(select([pair]))
+    query = union_all(*pairs)
+    # Порядок строк подзапросов в объединении не гарантирован, поэтому
+    # строки сортируются еще раз (их не больше limit для каждой пары)
+    columns = query.c
+    if order == DESC:
+        return query.order_by(columns.product_id, columns.estimation_id,
+                              columns[column.name].desc(), columns.id.desc())
+    return query.order_by(columns.product_id, columns.estimation_id,
+                          columns[column.name], columns.id)
+
+
+class CompiledQueries:
+    """Класс для выполнения запросов, скомпилированных один раз."""
+
+    def __init__(self, dialect):
+        """Конструктор.
+        :param dialect: диалект SQL базы данных."""
+
+        self.dialect = dialect
+        # Словарь ключ запроса -> скомпилированный запрос
+        self.compiled = {}
+
+    def get(self, key):
+        """Метод возвращает скомпилированный запрос, компилируя его при
+        первом обращении.
+        :param key: название запроса из STATEMENTS, кортеж аргументов
+        функции ratings_query или кортеж из BATCH и аргументов функции
+        ratings_batch_query.
+        :return: скомпилированный запрос."""
+
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            if isinstance(key, tuple) and key[0] == BATCH:
+                statement = ratings_batch_query(*key[1:])
+            elif isinstance(key, tuple):
+                statement = ratings_query(*key)
+            else:
+                statement = STATEMENTS[key]
+            compiled = statement.compile(dialect=self.dialect)
+            self.compiled[key] = compiled
+        return compiled
+
+    def execute(self, connection, key, **params):
+        """Метод выполняет скомпилированный запрос.
+        :param connection: соединение с базой данных;
+        :param key: ключ запроса (см. метод get);
+        :param params: значения параметров запроса.
+        :return: результат выполнения запроса."""
+
+        return connection.execute(self.get(key), params)
+
+    def fetch(self, connection, key, **params):
+        """Метод выполняет скомпилированный запрос курсором драйвера базы
+        данных, минуя обработку результатов SQLAlchemy. Значения параметров
+        передаются драйверу без преобразований, а строки результата -
+        обычные кортежи.
+        :param connection: соединение с базой данных;
+        :param key: ключ запроса (см. метод get);
+        :param params: значения параметров запроса.
+        :return: список кортежей."""
+
+        compiled = self.get(key)
+        # Параметры, которых нет в params, берутся из самого запроса
+        values = [params[name] if name in params else
+                  compiled.binds[name].effective_value
+                  for name in compiled.positiontup]
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute(compiled.string, values)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+if __name__ == '__main__':
+
+    # Сравнение времени одного вызова частых операций через ORM и через
+    # скомпилированные запросы, а также памяти, выделяемой при ответе на
+    # запрос GET_RATINGS
+    import json
+    import os
+    import random
+    import tempfile
+    import timeit
+    import tracemalloc
+    from datetime import datetime
+    from database import Database
+
+    def measure(function, number):
+        """Функция возвращает лучшее время одного вызова в микросекундах."""
+
+        return 1e6 * min(timeit.repeat(function, number=number,
+                                       repeat=5)) / number
+
+    def measure_memory(function):
+        """Функция возвращает количество блоков памяти, выделенных при вызове
+        и занятых его результатом, и пиковый объем памяти в байтах, который
+        понадобился для вызова."""
+
+        function()  # первый вызов компилирует запросы и заполняет кэши
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        base = tracemalloc.get_traced_memory()[0]
+        result = function()
+        peak = tracemalloc.get_traced_memory()[1] - base
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        del result
+        blocks = sum(stat.count_diff for stat in
+                     after.compare_to(before, 'filename'))
+        return blocks, peak
+
+    with tempfile.TemporaryDirectory() as path:
+        db = Database(os.path.join(path, 'db.sqlite3'),
+                      estimations=(('Стоимость', 0, None),),
+                      products=[f'Товар {i}' for i in range(100)])
+        for i in range(10000):
+            db.add_rating(f'Товар {i % 10}', 'Стоимость',
+                          round(random.uniform(50, 500), 2),
+                          f'Москва, ул. Тверская, д. {i % 50}')
+        session = db.session
+        p = session.query(Product).filter_by(name='Товар 1').first()
+        e = session.query(Estimation).filter_by(name='Стоимость').first()
+
+        def orm_add_rating():
+            session.add(Rating(p, e, 100.0, 'Москва'))
+            session.commit()
+
+        def orm_get_ratings():
+            return [rating.get() for rating in session.query(
+                Rating).filter_by(product_id=p.id, estimation_id=e.id,
+                                  deleted=False).order_by(
+                Rating.rating, Rating.id).limit(RATINGS_PAGE_SIZE).all()]
+
+        def core_add_rating():
+            db.execute('insert_rating', product_id=p.id, estimation_id=e.id,
+                       rating=100.0, address='Москва', date=datetime.now())
+            session.commit()
+
+        cases = (
+            ('поиск товара по названию',
+             lambda: session.query(Product).filter_by(
+                 name='Товар 1').first().id,
+             lambda: db.get_product_id('Товар 1'), 2000),
+            ('поиск фильтра по названию',
+             lambda: session.query(Estimation).filter_by(
+                 name='Стоимость').first(),
+             lambda: db.get_estimation_row('Стоимость'), 2000),
+            ('get_products',
+             lambda: [product.get() for product in
+                      session.query(Product).all()],
+             db.get_products, 500),
+            ('get_estimations',
+             lambda: [e.get() for e in session.query(Estimation).all()],
+             db.get_estimations, 2000),
+            (f'get_ratings ({RATINGS_PAGE_SIZE} оценок)', orm_get_ratings,
+             lambda: db.get_ratings('Товар 1', 'Стоимость',
+                                    limit=RATINGS_PAGE_SIZE), 100),
+            ('add_rating', orm_add_rating, core_add_rating, 200),
+        )
+        for name, orm, core, number in cases:
+            orm_time = measure(orm, number)
+            core_time = measure(core, number)
+            print(f'{name:<28} ORM {orm_time:9.1f} мкс, запросы '
+                  f'{core_time:9.1f} мкс ({orm_time / core_time:4.1f}x)')
+
+        # Первые оценки товаров из списка покупок: по запросу на товар и
+        # одним запросом
+        pairs = [(f'Товар {i}', 'Стоимость') for i in range(20)]
+        loop_time = measure(lambda: [
+            db.get_ratings(*pair, limit=BATCH_RATINGS_LIMIT)
+            for pair in pairs], 100)
+        batch_time = measure(lambda: db.get_ratings_batch(pairs), 100)
+        print(f'{"get_ratings_batch (20 пар)":<28} цикл {loop_time:8.1f} мкс, '
+              f'один запрос {batch_time:8.1f} мкс '
+              f'({loop_time / batch_time:4.1f}x)')
+
+        # Ответ GET_RATINGS: оценки и закодированное сообщение
+        def response(ratings):
+            return ratings, json.dumps({ACTION: GET_RATINGS, STATUS: 200,
+                                        CONTENT: ratings})
+
+        print(f'Память на ответ GET_RATINGS ({RATINGS_PAGE_SIZE} оценок):')
+        for name, function in (
+                ('ORM и Rating.get()', lambda: response(orm_get_ratings())),
+                ('строки, словари', lambda: response(db.get_ratings(
+                    'Товар 1', 'Стоимость', limit=RATINGS_PAGE_SIZE))),
+                ('строки, компактный вид', lambda: response(db.get_ratings(
+                    'Товар 1', 'Стоимость', limit=RATINGS_PAGE_SIZE,
+                    compact=True)))):
+            blocks, peak = measure_memory(function)
+            print(f'    {name:<24} {blocks:6} блоков, пик {peak:8} байт')
+        session.close()
@@ -0,0 +1,204 @@
+"""Модуль содержит классы хранилища оценок в памяти для быстрого чтения.
+Оценки хранятся по столбцам в типизированных массивах, что занимает на
+порядок меньше памяти, чем объекты ORM."""
+
+import bisect
+import string
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from const import *
+
+# Таблица перевода латинских букв в нижний регистр. Оператор LIKE в SQLite
+# не учитывает регистр только латинских букв, и фильтр по адресу в хранилище
+# должен отбирать те же оценки, что и запрос к базе данных
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+@lru_cache(maxsize=65536)
+def format_date(timestamp):
+    """Функция преобразует дату оценки в строку для клиента. Результаты
+    кэшируются, так как у многих оценок даты совпадают.
+    :param timestamp: дата в секундах от начала эпохи.
+    :return: строка с датой в формате DATE_FORMAT."""
+
+    return datetime.fromtimestamp(timestamp).strftime(DATE_FORMAT)
+
+
+class RatingColumns:
+    """Класс для оценок товара по одному фильтру. Оценки хранятся в
+    массивах-столбцах, отсортированных по возрастанию оценки, а при равных
+    оценках - по возрастанию ID (так же, как их сортирует база данных)."""
+
+    __slots__ = ('ids', 'ratings', 'dates', 'addresses')
+
+    def __init__(self):
+        """Конструктор."""
+
+        self.ids = array('q')  # ID оценок
+        self.ratings = array('d')  # оценки
+        self.dates = array('q')  # даты оценок в секундах от начала эпохи
+        self.addresses = array('i')  # номера адресов магазинов
+
+    def __len__(self):
+        return len(self.ids)
+
+    def insert(self, rating_id, rating, date, address_id):
+        """Метод вставляет оценку с сохранением порядка сортировки.
+        :param rating_id: ID оценки;
+        :param rating: оценка;
+        :param date: дата оценки в секундах от начала эпохи;
+        :param address_id: номер адреса магазина."""
+
+        i = bisect.bisect_right(self.ratings, rating)
+        # Среди равных оценок сохраняем порядок по возрастанию ID
+        while i > 0 and self.ratings[i - 1] == rating and \
+                self.ids[i - 1] > rating_id:
+            i -= 1
+        self.ids.insert(i, rating_id)
+        self.ratings.insert(i, rating)
+        self.dates.insert(i, date)
+        self.addresses.insert(i, address_id)
+
+    def remove(self, rating_id, rating):
+        """Метод удаляет оценку.
+        :param rating_id: ID оценки;
+        :param rating: оценка, по которой оценка находится двоичным поиском.
+        :return: True, если оценка удалена, иначе False."""
+
+        i = bisect.bisect_left(self.ratings, rating)
+        j = bisect.bisect_right(self.ratings, rating)
+        for k in range(i, j):
+            if self.ids[k] == rating_id:
+                del self.ids[k]
+                del self.ratings[k]
+                del self.dates[k]
+                del self.addresses[k]
+                return True
+        return False
+
+    def rating_range(self, min_rating=None, max_rating=None):
+        """Метод находит границы среза с оценками из заданного диапазона.
+        :param min_rating, max_rating: пределы значений оценок. Если None, то
+        предела нет.
+        :return: кортеж из начала и конца среза."""
+
+        i = 0 if min_rating is None else bisect.bisect_left(self.ratings,
+                                                            min_rating)
+        j = len(self.ratings) if max_rating is None else bisect.bisect_right(
+            self.ratings, max_rating)
+        return i, max(i, j)
+
+
+class RatingStore:
+    """Класс хранилища оценок в памяти, сгруппированных по парам
+    (ID товара, ID фильтра)."""
+
+    def __init__(self):
+        """Конструктор."""
+
+        # Словарь (ID товара, ID фильтра) -> RatingColumns
+        self.columns = {}
+        # Список адресов магазинов и словарь адрес -> номер адреса
+        self.address_list = []
+        self.address_ids = {}
+
+    def __len__(self):
+        return sum(len(columns) for columns in self.columns.values())
+
+    def add(self, product_id, estimation_id, rating_id, rating, date,
+            address):
+        """Метод добавляет оценку в хранилище.
+        :param product_id: ID товара;
+        :param estimation_id: ID фильтра;
+        :param rating_id: ID оценки;
+        :param rating: оценка;
+        :param date: дата оценки - объект datetime;
+        :param address: адрес магазина."""
+
+        address_id = self.address_ids.get(address)
+        if address_id is None:
+            address_id = len(self.address_list)
+            self.address_list.append(address)
+            self.address_ids[address] = address_id
+        columns = self.columns.get((product_id, estimation_id))
+        if columns is None:
+            columns = self.columns[(product_id, estimation_id)] = \
+                RatingColumns()
+        columns.insert(rating_id, rating, int(date.timestamp()), address_id)
+
+    def remove(self, product_id, estimation_id, rating_id, rating):
+        """Метод удаляет оценку из хранилища.
+        :param product_id: ID товара;
+        :param estimation_id: ID фильтра;
+        :param rating_id: ID оценки;
+        :param rating: оценка."""
+
+        columns = self.columns.get((product_id, estimation_id))
+        if columns is not None and columns.remove(rating_id, rating) and \
+                not columns:
+            del self.columns[(product_id, estimation_id)]
+
+    def remove_product(self, product_id):
+        """Метод удаляет все оценки товара.
+        :param product_id: ID товара."""
+
+        for key in [key for key in self.columns if key[0] == product_id]:
+            del self.columns[key]
+
+    def select(self, product_id, estimation_id, since=None, until=None,
+               sort=RATING, order=ASC, min_rating=None, max_rating=None,
+               address=None, limit=None, offset=0):
+        """Метод возвращает оценки товара по фильтру. Параметры такие же, как
+        у метода Database.get_rating_rows. Сортировка по оценке выполняется
+        срезом, по другим полям - сортировкой выбранных оценок.
+        :return: список кортежей (ID, адрес, оценка, дата)."""
+
+        columns = self.columns.get((product_id, estimation_id))
+        if columns is None:
+            return []
+        i, j = columns.rating_range(min_rating, max_rating)
+        rows = range(i, j) if order != DESC else range(j - 1, i - 1, -1)
+        if since or until or address:
+            # Фильтры по дате и адресу проверяются только для среза
+            since = since.timestamp() if since else None
+            until = until.timestamp() if until else None
+            if address:
+                address = address.translate(ASCII_LOWER)
+            dates = columns.dates
+            rows = [k for k in rows if
+                    (since is None or dates[k] >= since) and
+                    (until is None or dates[k] < until) and
+                    (not address or address in
+                     self.address_list[columns.addresses[k]].translate(
+                         ASCII_LOWER))]
+        if sort == DATE:
+            rows = sorted(rows, key=lambda k: (columns.dates[k],
+                                               columns.ids[k]),
+                          reverse=order == DESC)
+        elif sort == ADDRESS:
+            rows = sorted(rows, key=lambda k: (
+                self.address_list[columns.addresses[k]], columns.ids[k]),
+                          reverse=order == DESC)
+        stop = None if limit is None else offset + limit
+        ids = columns.ids
+        ratings = columns.ratings
+        dates = columns.dates
+        addresses = columns.addresses
+        address_list = self.address_list
+        return [(ids[k], address_list[addresses[k]], ratings[k],
+                 format_date(dates[k])) for k in rows[offset:stop]]
+
+    def summary(self, product_id, estimation_id):
+        """Метод возвращает сводку оценок товара по фильтру.
+        :param product_id: ID товара;
+        :param estimation_id: ID фильтра.
+        :return: словарь с количеством, минимальной, максимальной и средней
+        оценками или None, если оценок нет."""
+
+        columns = self.columns.get((product_id, estimation_id))
+        if not columns:
+            return None
+        ratings = columns.ratings
+        return {COUNT: len(ratings), MIN: ratings[0], MAX: ratings[-1],
+                MEAN: sum(ratings) / len(ratings)}
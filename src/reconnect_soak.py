@@ -0,0 +1,121 @@
+"""Программа для проверки переподключения клиента к серверу. Сервер
+несколько раз завершается и запускается заново, а клиент каждый раз должен
+переподключиться и ответить на запрос. Количество потоков и открытых файлов
+клиента не должно расти от переподключения к переподключению. Если клиент
+не переподключился или потоков и файлов стало больше, программа
+завершается с кодом 1.
+
+Запуск: python reconnect_soak.py [-p порт] [--cycles количество]"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import const as cn
+from client import Client
+from utilities import determine_port
+
+# Папка с модулями программы
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+# Количество перезапусков сервера по умолчанию
+CYCLES = 20
+# Время, за которое клиент должен переподключиться и получить ответ, в
+# секундах
+MAX_RECONNECT_TIME = 2 * cn.MAX_RECONNECT_DELAY
+# Допустимое превышение количества потоков и открытых файлов клиента над
+# первым замером
+MAX_EXTRA_THREADS = 0
+MAX_EXTRA_FILES = 1
+
+
+def count_files():
+    """Функция возвращает количество открытых файлов процесса.
+    :return: количество файлов или None, если его нельзя определить."""
+
+    for path in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(path):
+            return len(os.listdir(path))
+    return None
+
+
+def determine_cycles():
+    """Функция определяет из командной строки количество перезапусков
+    сервера.
+    :return: количество перезапусков."""
+
+    if '--cycles' in sys.argv:
+        return int(sys.argv[sys.argv.index('--cycles') + 1])
+    return CYCLES
+
+
+def start_server(port, cwd):
+    """Функция запускает сервер с хранилищем в памяти.
+    :param port: порт сервера;
+    :param cwd: рабочая папка сервера.
+    :return: процесс сервера."""
+
+    return subprocess.Popen(
+        [sys.executable, os.path.join(SRC_PATH, 'server.py'), '-p',
+         str(port), '--storage', 'memory'], cwd=cwd,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    """Функция перезапускает сервер и проверяет клиента."""
+
+    port = determine_port()
+    cycles = determine_cycles()
+    # Ответы сервера на запросы клиента
+    answered = threading.Event()
+    client = Client(on_message=lambda msg: answered.set())
+    failed = False
+    first = None
+    with tempfile.TemporaryDirectory() as cwd:
+        server = start_server(port, cwd)
+        client.connect()
+        try:
+            for cycle in range(cycles):
+                answered.clear()
+                client.create_msg({cn.ACTION: cn.GET_FILTERS_AND_PRODUCTS})
+                start = time.perf_counter()
+                if not answered.wait(MAX_RECONNECT_TIME):
+                    print(f'Цикл {cycle + 1}: клиент не получил ответ')
+                    failed = True
+                    break
+                reconnect_time = time.perf_counter() - start
+                counts = threading.active_count(), count_files()
+                if first is None:
+                    first = counts
+                print(f'Цикл {cycle + 1}: ответ через '
+                      f'{1000 * reconnect_time:.0f} мс, потоков '
+                      f'{counts[0]}, открытых файлов {counts[1]}')
+                if counts[0] > first[0] + MAX_EXTRA_THREADS or \
+                        counts[1] is not None and \
+                        counts[1] > first[1] + MAX_EXTRA_FILES:
+                    failed = True
+                # Завершаем сервер без закрытия соединений и запускаем заново.
+                # Следующий запрос отправляется, когда клиент заметит разрыв
+                # соединения, иначе запрос может уйти в старое соединение
+                server.kill()
+                server.wait()
+                deadline = time.monotonic() + MAX_RECONNECT_TIME
+                while client.connected.is_set() and \
+                        time.monotonic() < deadline:
+                    time.sleep(0.01)
+                server = start_server(port, cwd)
+        finally:
+            client.close()
+            server.kill()
+            server.wait()
+    if threading.active_count() != 1:
+        print('Потоки клиента не завершились')
+        failed = True
+    if failed:
+        print('Клиент не прошел проверку переподключения')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""Программа воспроизводит на новом сервере сообщения, записанные сервером
+в журнал (параметр сервера --capture), и выводит распределение времени
+ответа по типам запросов. Так любое изменение сервера можно проверить на
+нагрузке, снятой с настоящих клиентов.
+
+Сообщения каждого записанного соединения отправляются по отдельному
+соединению в том же порядке. Следующее сообщение соединения отправляется
+после последнего ответа на предыдущее. С параметром --speed сообщения
+отправляются не раньше, чем были получены сервером при записи (с
+ускорением в заданное количество раз), и время ответа отсчитывается от
+этого момента, а не от фактической отправки. Поэтому задержка сервера не
+уменьшает нагрузку и не скрывается из распределения. С параметром --fast
+сообщения отправляются без пауз. Если ответ на сообщение не получен за
+REPLY_TIMEOUT секунд (например, сервер не отвечает на запросы неизвестного
+ему типа), запрос считается ошибкой и отправляется следующее сообщение. С
+параметром --concurrency N каждое записанное соединение воспроизводится N
+раз одновременно. Ключи идемпотентности оценок в копиях изменяются, чтобы
+копии добавляли свои оценки.
+
+Сервер запускается во временной папке без ограничения частоты запросов. С
+параметром --database сервер начинает работу с копией заданной базы данных
+(например, резервной копии, созданной программой backup.py), иначе - с
+новой базой данных. Параметры --storage, --soft-delete и --memory-store
+передаются серверу.
+
+Запуск: python replay.py журнал [-p порт] [--speed коэффициент | --fast]
+[--concurrency N] [--database путь] [--storage memory] [--soft-delete]
+[--memory-store]"""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import const as cn
+from capture import read_capture
+from messenger import Messenger
+from price_statistics import percentile
+from utilities import determine_port
+
+# Папка с модулями программы
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+# Время ожидания запуска сервера в секундах
+SERVER_START_TIMEOUT = 30
+# Задержка начала воспроизведения после подключения к серверу в секундах
+START_DELAY = 0.5
+# Параметры сервера, которые передаются ему без изменений
+SERVER_FLAGS = ('--soft-delete', '--memory-store')
+# Статусы ответов, которые не считаются ошибками
+OK_STATUSES = (200, 202, 304)
+# Время ожидания ответа на сообщение в секундах
+REPLY_TIMEOUT = 10
+# Статус запроса, ответ на который не получен за REPLY_TIMEOUT секунд
+TIMEOUT = 'timeout'
+
+
+def determine_option(option, default, kind=float):
+    """Функция определяет значение параметра из командной строки.
+    :param option: название параметра;
+    :param default: значение по умолчанию;
+    :param kind: тип значения.
+    :return: значение параметра."""
+
+    if option in sys.argv:
+        return kind(sys.argv[sys.argv.index(option) + 1])
+    return default
+
+
+def load_sessions(path):
+    """Функция читает журнал и группирует сообщения по соединениям.
+    :param path: папка журнала или путь к файлу журнала.
+    :return: пара (время первого сообщения в микросекундах, список
+    соединений). Соединение - список пар (время сообщения в микросекундах,
+    сообщение - байты JSON)."""
+
+    sessions = {}
+    first = None
+    for timestamp, serial, data in read_capture(path):
+        if first is None:
+            first = timestamp
+        sessions.setdefault(serial, []).append((timestamp, data))
+    return first, list(sessions.values())
+
+
+def rekey(msg, copy):
+    """Функция изменяет ключи идемпотентности оценок в копии сообщения.
+    :param msg: сообщение-словарь;
+    :param copy: номер копии соединения."""
+
+    if msg.get(cn.ACTION) != cn.ADD_RATING:
+        return
+    content = msg.get(cn.CONTENT)
+    ratings = content if isinstance(content, list) else [content]
+    suffix = f'-{copy}'
+    for rating in ratings:
+        key = rating.get(cn.IDEMPOTENCY_KEY) if isinstance(rating, dict) \
+            else None
+        if isinstance(key, str):
+            rating[cn.IDEMPOTENCY_KEY] = \
+                key[:cn.MAX_IDEMPOTENCY_KEY_LENGTH - len(suffix)] + suffix
+
+
+def replay_session(records, copy, address, first, start, speed, results):
+    """Функция воспроизводит сообщения одного соединения.
+    :param records: список пар (время сообщения в микросекундах, сообщение);
+    :param copy: номер копии соединения;
+    :param address: адрес сервера (IP адрес и порт);
+    :param first: время первого сообщения журнала в микросекундах;
+    :param start: время начала воспроизведения по time.perf_counter();
+    :param speed: ускорение воспроизведения (None - без пауз);
+    :param results: список, в который добавляются тройки (тип запроса,
+    время ответа в секундах, статус ответа, TIMEOUT, если ответ не получен,
+    или None, если соединение разорвано)."""
+
+    messenger = Messenger(cn.MAX_RESPONSE_LENGTH)
+    sock = socket.create_connection(address)
+    sock.settimeout(REPLY_TIMEOUT)
+    # Все соединения начинают воспроизведение одновременно
+    delay = start - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+    try:
+        for number, (timestamp, data) in enumerate(records):
+            msg = json.loads(data)
+            action = msg.get(cn.ACTION)
+            # По идентификатору запроса находим ответы на него
+            msg[cn.REQUEST_ID] = number
+            if copy:
+                rekey(msg, copy)
+            if speed is None:
+                due = time.perf_counter()
+            else:
+                due = start + (timestamp - first) / 1e6 / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                messenger.send_msg(sock, msg)
+                while True:
+                    response = messenger.get_msg(sock)
+                    if response.get(cn.REQUEST_ID) != number:
+                        # Ответ на более ранний запрос, например, второй
+                        # ответ на запрос BACKUP
+                        continue
+                    status = response.get(cn.STATUS)
+                    if status != 200 or not response.get(cn.MORE):
+                        break
+            except TimeoutError:
+                # Сервер не ответил на запрос. Поздний ответ будет пропущен
+                # по идентификатору запроса
+                results.append((action, time.perf_counter() - due, TIMEOUT))
+                continue
+            except (OSError, ValueError):
+                # Сервер закрыл соединение
+                results.append((action, time.perf_counter() - due, None))
+                return
+            results.append((action, time.perf_counter() - due, status))
+    finally:
+        sock.close()
+
+
+def report(results, elapsed):
+    """Функция выводит распределение времени ответа по типам запросов.
+    :param results: список троек (тип запроса, время ответа в секундах,
+    статус ответа);
+    :param elapsed: время воспроизведения в секундах."""
+
+    actions = {}
+    for action, seconds, status in results:
+        actions.setdefault(action, []).append((seconds, status))
+    print(f'{"Запрос":<28}{"всего":>8}{"ошибок":>8}{"p50, мс":>10}'
+          f'{"p90, мс":>10}{"p99, мс":>10}{"max, мс":>10}')
+    for action in sorted(actions, key=str):
+        rows = actions[action]
+        latencies = sorted(seconds for seconds, _ in rows)
+        errors = sum(status not in OK_STATUSES for _, status in rows)
+        print(f'{str(action):<28}{len(rows):>8}{errors:>8}'
+              f'{1000 * percentile(latencies, 50):>10.2f}'
+              f'{1000 * percentile(latencies, 90):>10.2f}'
+              f'{1000 * percentile(latencies, 99):>10.2f}'
+              f'{1000 * latencies[-1]:>10.2f}')
+    print(f'Запросов: {len(results)} за {elapsed:.2f} с '
+          f'({len(results) / elapsed:.0f} в секунду)')
+
+
+def start_server(port, cwd, database=None):
+    """Функция запускает новый сервер и ждет, пока он начнет принимать
+    подключения.
+    :param port: порт сервера;
+    :param cwd: рабочая папка сервера;
+    :param database: путь к базе данных, копия которой станет базой данных
+    сервера, или None.
+    :return: процесс сервера."""
+
+    if database is not None:
+        os.mkdir(os.path.join(cwd, 'database'))
+        shutil.copyfile(database, os.path.join(cwd, 'database',
+                                               'db.sqlite3'))
+    args = [sys.executable, os.path.join(SRC_PATH, 'server.py'), '-p',
+            str(port), '--read-rate', '0', '--write-rate', '0',
+            '--storage', determine_option('--storage', 'sqlite', str)]
+    args += [flag for flag in SERVER_FLAGS if flag in sys.argv]
+    server = subprocess.Popen(args, cwd=cwd, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((cn.DEFAULT_IP_ADDRESS, port)).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.1)
+    server.kill()
+    server.wait()
+    print('Сервер не запустился')
+    sys.exit(1)
+
+
+def main():
+    """Функция воспроизводит журнал на новом сервере."""
+
+    if len(sys.argv) < 2 or not os.path.exists(sys.argv[1]):
+        print(__doc__.rsplit('\n\n', 1)[-1])
+        sys.exit(1)
+    first, sessions = load_sessions(sys.argv[1])
+    if not sessions:
+        print('Журнал пуст')
+        sys.exit(1)
+    speed = None if '--fast' in sys.argv else \
+        determine_option('--speed', 1.0)
+    concurrency = determine_option('--concurrency', 1, int)
+    database = determine_option('--database', None, str)
+    port = determine_port()
+    print(f'Соединений: {len(sessions)} x {concurrency}, сообщений: '
+          f'{sum(map(len, sessions)) * concurrency}')
+    results = []
+    with tempfile.TemporaryDirectory() as cwd:
+        server = start_server(port, cwd, database)
+        try:
+            start = time.perf_counter() + START_DELAY
+            threads = [threading.Thread(
+                target=replay_session,
+                args=(records, copy, (cn.DEFAULT_IP_ADDRESS, port), first,
+                      start, speed, results))
+                for records in sessions for copy in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.kill()
+            server.wait()
+    report(results, elapsed)
+
+
+if __name__ == '__main__':
+    main()
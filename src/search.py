@@ -0,0 +1,140 @@
+"""Модуль содержит класс индекса для быстрого поиска товаров по названию."""
+
+import bisect
+
+
+def normalize(text):
+    """Функция приводит текст к виду, в котором он хранится в индексе: без
+    учета регистра и с заменой буквы 'ё' на 'е'.
+    :param text: текст.
+    :return: нормализованный текст."""
+
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def get_trigrams(text):
+    """Функция возвращает множество триграмм нормализованного текста.
+    :param text: нормализованный текст.
+    :return: множество триграмм."""
+
+    text = f'  {text} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductIndex:
+    """Класс индекса названий товаров в памяти. Поддерживает поиск по
+    префиксу любого слова названия и нечеткий поиск по триграммам."""
+
+    def __init__(self, products=()):
+        """Конструктор.
+        :param products: список пар (ID товара, название товара)."""
+
+        # Названия товаров по ID
+        self.names = {}
+        # Отсортированный список пар (слово, ID товара) для поиска по префиксу
+        self.words = []
+        # Словарь триграмма -> множество ID товаров для нечеткого поиска
+        self.trigrams = {}
+        for product_id, name in products:
+            self.add(product_id, name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, product_id, name):
+        """Метод добавляет товар в индекс.
+        :param product_id: ID товара;
+        :param name: название товара."""
+
+        if product_id in self.names:
+            self.remove(product_id)
+        self.names[product_id] = name
+        text = normalize(name)
+        for word in set(text.split()):
+            bisect.insort(self.words, (word, product_id))
+        for trigram in get_trigrams(text):
+            self.trigrams.setdefault(trigram, set()).add(product_id)
+
+    def remove(self, product_id):
+        """Метод удаляет товар из индекса.
+        :param product_id: ID товара."""
+
+        name = self.names.pop(product_id, None)
+        if name is None:
+            return
+        text = normalize(name)
+        for word in set(text.split()):
+            i = bisect.bisect_left(self.words, (word, product_id))
+            if i < len(self.words) and self.words[i] == (word, product_id):
+                del self.words[i]
+        for trigram in get_trigrams(text):
+            ids = self.trigrams.get(trigram)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self.trigrams[trigram]
+
+    def search(self, query, limit):
+        """Метод ищет товары по префиксу, а если найдено меньше limit товаров,
+        дополняет результат нечеткими совпадениями.
+        :param query: строка поиска;
+        :param limit: максимальное количество найденных товаров.
+        :return: список пар (ID товара, название товара)."""
+
+        text = normalize(query)
+        if not text or limit < 1:
+            return []
+        found = self.search_prefix(text, limit)
+        if len(found) < limit:
+            for product_id in self.search_fuzzy(text, limit):
+                if product_id not in found:
+                    found.append(product_id)
+                    if len(found) == limit:
+                        break
+        return [(product_id, self.names[product_id]) for product_id in found]
+
+    def search_prefix(self, text, limit):
+        """Метод ищет товары, в названиях которых есть слова, начинающиеся
+        со слов строки поиска.
+        :param text: нормализованная строка поиска;
+        :param limit: максимальное количество найденных товаров.
+        :return: список ID товаров, отсортированный по названию."""
+
+        result = None
+        for word in text.split():
+            # Все пары со словами, начинающимися с word, идут в списке подряд
+            ids = set()
+            i = bisect.bisect_left(self.words, (word,))
+            while (i < len(self.words) and
+                   self.words[i][0].startswith(word)):
+                ids.add(self.words[i][1])
+                i += 1
+            result = ids if result is None else result & ids
+            if not result:
+                return []
+        return sorted(result, key=lambda x: normalize(self.names[x]))[:limit]
+
+    def search_fuzzy(self, text, limit):
+        """Метод ищет товары с названиями, похожими на строку поиска.
+        :param text: нормализованная строка поиска;
+        :param limit: максимальное количество найденных товаров.
+        :return: список ID товаров в порядке убывания похожести."""
+
+        # Отбираем кандидатов по количеству общих триграмм
+        counts = {}
+        for trigram in get_trigrams(text):
+            for product_id in self.trigrams.get(trigram, ()):
+                counts[product_id] = counts.get(product_id, 0) + 1
+        candidates = sorted(counts, key=counts.get, reverse=True)[:10 * limit]
+        # Упорядочиваем кандидатов по похожести названия на строку поиска.
+        # difflib нужен только для нечеткого поиска, поэтому импортируется
+        # здесь, а не при запуске сервера
+        from difflib import SequenceMatcher
+        scores = {}
+        for product_id in candidates:
+            scores[product_id] = SequenceMatcher(
+                None, text, normalize(self.names[product_id])).ratio()
+        found = [product_id for product_id in candidates
+                 if scores[product_id] >= 0.5]
+        found.sort(key=scores.get, reverse=True)
+        return found[:limit]
@@ -1,13 +1,25 @@
 """Программа-сервер."""
 
-import select
+import ipaddress
+import math
+import selectors
 import socket
+import sys
+import time
+from collections import deque
 from datetime import datetime
 import const as cn
-from database import Database
+from storage import create_storage
+from capture import TrafficCapture
+from connections import ConnectionRegistry
+from limiter import RateLimiter
 from messenger import Messenger
 from utilities import *
 
+# Фильтры и товары, которые добавляются в новую базу данных
+ESTIMATIONS = (('Стоимость', 0, None), ('Качество', 0, 10))
+PRODUCTS = ('Сыр', 'Хлеб', 'Молоко')
+
 
 class Server():
     """Класс для работы с сервером."""
@@ -20,28 +32,169 @@ class Server():
         self.listen_addr = determine_address()
         # Инициализация сокета для соединения по TCP протоколу
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Порт можно занять сразу после аварийного завершения сервера, не
+        # дожидаясь закрытия старых соединений
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.bind((self.listen_addr, self.listen_port))
-        # Слушается порт
+        # Слушается порт. Новые подключения принимаются без ожидания, когда
+        # селектор сообщит о них
         self.sock.listen(cn.MAX_CONNECTIONS)
-        self.sock.settimeout(0.1)
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
         printf('Сервер запущен')
-        # Объект для работы с базой данных
-        self.db = Database()
-        # Добавляем несколько фильтров и товаров в базу данных
-        self.init_db()
+        # Объект для работы с базой данных. С параметром --storage memory
+        # все данные хранятся только в памяти. С флагом --soft-delete оценки
+        # при удалении только помечаются, а удаляются при фоновом сжатии. С
+        # флагом --memory-store оценки читаются из хранилища в памяти. В
+        # новую базу данных добавляется несколько фильтров и товаров
+        try:
+            self.db = create_storage(
+                determine_storage(),
+                soft_delete=determine_flag('--soft-delete'),
+                memory_store=determine_flag('--memory-store'),
+                estimations=ESTIMATIONS, products=PRODUCTS)
+        except ValueError:
+            sys.exit(1)
+        # Время последнего сжатия базы данных
+        self.compacted_at = time.monotonic()
+        # Количество дней хранения оценок в основной базе данных и время
+        # последнего переноса устаревших оценок в архив
+        self.retention_days = determine_retention_days()
+        self.archived_at = time.monotonic()
+        # Время последнего удаления устаревших ключей идемпотентности
+        self.keys_expired_at = time.monotonic()
         # Объект для приема/отправки сообщений
         self.messenger = Messenger()
+        # Соединения с клиентами. Соединение, в котором не было активности
+        # дольше заданного параметром --idle-timeout времени, закрывается
+        self.connections = ConnectionRegistry()
+        self.idle_timeout = determine_idle_timeout()
+        self.reaped_at = time.monotonic()
+        # Количество соединений, закрытых из-за простоя
+        self.reaped = 0
+        # Ограничение частоты запросов на чтение и на запись от каждого
+        # соединения и IP адреса. Ограничения задаются параметрами
+        # --read-rate, --write-rate (запросов в секунду, 0 - без
+        # ограничения) и --ip-rate-factor
+        self.limiter = RateLimiter(
+            {cn.READ: determine_rate('--read-rate', cn.READ_RATE),
+             cn.WRITE: determine_rate('--write-rate', cn.WRITE_RATE)},
+            determine_rate('--ip-rate-factor', cn.IP_RATE_FACTOR))
+        # Очереди принятых запросов клиентов: словарь сокет клиента ->
+        # очередь сообщений. Клиенты в словаре расположены в порядке, в
+        # котором будут обработаны их следующие запросы
+        self.queues = {}
+        # Количество запросов во всех очередях
+        self.queued = 0
+        # Количество запросов, отклоненных из-за переполнения очереди
+        self.overloaded = 0
+        # Время обработки последних запросов в секундах
+        self.latencies = deque(maxlen=cn.LATENCY_SAMPLES)
+        # Резервное копирование базы данных (последнее или выполняющееся),
+        # сокет клиента, запросившего копирование, и идентификатор запроса.
+        # Количество страниц, копируемых за один шаг, задается параметром
+        # --backup-pages
+        self.backup = None
+        self.backup_sock = None
+        self.backup_request_id = None
+        self.backup_pages = determine_backup_pages()
+        # Журнал сообщений от клиентов для воспроизведения нагрузки
+        # программой replay.py. Ведется, если задан параметр --capture
+        capture_path = determine_capture()
+        self.capture = None
+        if capture_path is not None:
+            self.capture = TrafficCapture(capture_path)
+            printf(f'Сообщения от клиентов записываются в {capture_path}')
+
+    def admit_msg(self, msg, sock, tasks):
+        """Метод проверяет частоту запросов клиента и ставит сообщение в
+        очередь клиента. Если клиент присылает запросы слишком часто или
+        очередь переполнена, клиенту сразу отправляется ответ со статусом
+        429.
+        :param msg: словарь-сообщение от клиента;
+        :param sock: сокет клиента, от кого получено сообщение;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
 
-    def init_db(self):
-        """Метод добавляет несколько фильтров и товаров в базу данных."""
+        action = msg.get(cn.ACTION)
+        if action == cn.HELLO:
+            # Согласование параметров соединения не работает с базой данных
+            return self.process_msg(msg, sock, tasks)
+        queue = self.queues.get(sock)
+        length = len(queue) if queue else 0
+        # Когда общая очередь заполнена, отклоняются запросы только тех
+        # клиентов, у которых в очереди не меньше запросов, чем в среднем.
+        # Иначе места в очереди доставались бы тем клиентам, сообщения от
+        # которых читаются первыми
+        if (length >= cn.MAX_CLIENT_QUEUED_REQUESTS or
+                self.queued >= cn.MAX_QUEUED_REQUESTS and
+                length * len(self.queues) >= self.queued):
+            self.overloaded += 1
+            retry_after = cn.OVERLOAD_RETRY_AFTER
+        else:
+            kind = cn.WRITE if action in cn.WRITE_ACTIONS else cn.READ
+            content = msg.get(cn.CONTENT)
+            # Оценки, присланные списком, добавляются по одной, поэтому
+            # каждая оценка списка считается отдельным запросом
+            cost = len(content) if isinstance(content, list) else 1
+            retry_after = self.limiter.take(
+                sock, self.connections.get(sock).ip, kind, max(1, cost))
+        if retry_after:
+            response = {cn.ACTION: action, cn.STATUS: 429,
+                        cn.RETRY_AFTER: math.ceil(retry_after * 100) / 100}
+            if msg.get(cn.REQUEST_ID) is not None:
+                response[cn.REQUEST_ID] = msg[cn.REQUEST_ID]
+            tasks.append({cn.SOCKET: sock, cn.MSG: response})
+            return
+        if queue is None:
+            queue = self.queues[sock] = deque()
+        queue.append(msg)
+        self.queued += 1
 
-        # Фильтры
-        self.db.add_estimation('Стоимость', 0)
-        self.db.add_estimation('Качество', 0, 10)
-        # Товары
-        self.db.add_product('Сыр')
-        self.db.add_product('Хлеб')
-        self.db.add_product('Молоко')
+    def accept_clients(self):
+        """Метод принимает все ожидающие подключения клиентов."""
+
+        while True:
+            try:
+                client_sock, address = self.sock.accept()
+            except OSError:
+                # Ожидающих подключений больше нет
+                return
+            # С клиентом сервер работает в блокирующем режиме
+            client_sock.setblocking(True)
+            connection = self.connections.add(client_sock, address,
+                                              time.monotonic())
+            self.selector.register(client_sock, selectors.EVENT_READ,
+                                   connection)
+            printf(f'Подключился клиент с адресом {connection.name}')
+
+    def close_client(self, sock):
+        """Метод закрывает соединение с клиентом и удаляет данные клиента.
+        :param sock: сокет клиента."""
+
+        connection = self.connections.get(sock)
+        if connection is not None:
+            self.connections.remove(connection)
+            self.selector.unregister(sock)
+            printf(f'Клиент с адресом {connection.name} отключился')
+        self.queued -= len(self.queues.pop(sock, ()))
+        self.limiter.forget(sock)
+        sock.close()
+
+    def get_readable(self, timeout):
+        """Метод ждет сообщений от клиентов и принимает новые подключения.
+        :param timeout: время ожидания в секундах.
+        :return: список объектов Connection для соединений, из которых
+        можно прочитать сообщения."""
+
+        readable = []
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj is self.sock:
+                self.accept_clients()
+            else:
+                readable.append(key.data)
+        return readable
 
     def process_add_estimation(self, msg, sock, tasks):
         """Метод обрабатывает запрос на добавление нового фильтра.
@@ -101,24 +254,160 @@ class Server():
 
         # Получаем информацию из сообщения
         content = msg.get(cn.CONTENT)
+        if isinstance(content, list):
+            # Клиент прислал сразу несколько оценок
+            return self.process_add_ratings(content, sock, tasks)
         product_name = content.get(cn.PRODUCT)
         estimation_name = content.get(cn.FILTER)
         address = content.get(cn.ADDRESS)
         rating = content.get(cn.RATING)
         date = content.get(cn.DATE)
+        # Ключ идемпотентности: повтор запроса с тем же ключом не добавляет
+        # оценку второй раз, а получает такой же ответ
+        key = content.get(cn.IDEMPOTENCY_KEY)
         # Заготовка ответа
         response = {cn.ACTION: cn.ADD_RATING,
                     cn.STATUS: 400}
-        if product_name and estimation_name and address and rating and date:
+        if (product_name and estimation_name and address and rating and
+                date and is_valid_key(key)):
             # Добавляем оценку
-            self.db.add_rating(product_name, estimation_name, rating, address)
+            self.db.add_rating(product_name, estimation_name, rating, address,
+                               key)
             # Получаем оценки товара по фильтру
-            ratings = self.db.get_ratings(product_name, estimation_name)
+            ratings = self.db.get_ratings(
+                product_name, estimation_name,
+                limit=cn.MAX_RATINGS_PER_RESPONSE)
             response[cn.STATUS] = 200
             response[cn.CONTENT] = ratings
         # Добавляем задачу отправки ответа клиенту
         tasks.append({cn.SOCKET: sock, cn.MSG: response})
 
+    def process_add_ratings(self, ratings, sock, tasks):
+        """Метод обрабатывает запрос на добавление списка оценок, например,
+        оценок, которые клиент сохранил, пока не было соединения с сервером.
+        Оценки с неполными данными пропускаются. Оценки, уже добавленные с
+        тем же ключом идемпотентности, не добавляются, но учитываются в
+        ответе, чтобы повтор запроса получил такой же ответ.
+        :param ratings: список данных оценок;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        count = 0
+        for content in ratings:
+            if not isinstance(content, dict):
+                continue
+            product_name = content.get(cn.PRODUCT)
+            estimation_name = content.get(cn.FILTER)
+            address = content.get(cn.ADDRESS)
+            rating = content.get(cn.RATING)
+            key = content.get(cn.IDEMPOTENCY_KEY)
+            if (product_name and estimation_name and address and rating and
+                    content.get(cn.DATE) and is_valid_key(key)):
+                self.db.add_rating(product_name, estimation_name, rating,
+                                   address, key)
+                count += 1
+        # Все оценки в ответ не отправляются, клиент запросит их сам
+        response = {cn.ACTION: cn.ADD_RATING,
+                    cn.STATUS: 200 if count else 400,
+                    cn.CONTENT: {cn.COUNT: count}}
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
+    def process_backup(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на резервное копирование базы данных.
+        Копирование выполняется в отдельном потоке небольшими шагами, между
+        которыми сервер обрабатывает другие запросы. Клиент сразу получает
+        ответ со статусом 202, а когда копирование закончится, - второй
+        ответ со статусом 200 (или 500, если копию создать не удалось).
+        Копирование можно запросить только с того же компьютера, на котором
+        работает сервер.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        content = msg.get(cn.CONTENT) or {}
+        pages = content.get(cn.PAGES, self.backup_pages)
+        connection = None if sock is None else self.connections.get(sock)
+        # Заготовка ответа
+        response = {cn.ACTION: cn.BACKUP, cn.STATUS: 400}
+        if connection is not None and \
+                not ipaddress.ip_address(connection.ip).is_loopback:
+            response[cn.STATUS] = 403
+        elif self.backup is not None and self.backup.state == cn.RUNNING:
+            # Одновременно выполняется только одно копирование
+            response[cn.STATUS] = 409
+            response[cn.CONTENT] = self.backup.get_stats()
+        elif isinstance(pages, int) and not isinstance(pages, bool) and \
+                (pages > 0 or pages == -1):
+            backup = self.db.create_backup(pages)
+            if backup is not None:
+                self.backup = backup.start(self.latencies)
+                self.backup_sock = sock
+                self.backup_request_id = msg.get(cn.REQUEST_ID)
+                response[cn.STATUS] = 202
+                response[cn.CONTENT] = backup.get_stats()
+                printf(f'Начато резервное копирование в {backup.path}')
+        # Добавляем задачу отправки ответа клиенту
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
+    def process_delete_rating(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на удаление оценки или списка оценок.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        # Получаем информацию из сообщения
+        content = msg.get(cn.CONTENT, {})
+        rating_id = content.get(cn.ID)
+        # Заготовка ответа
+        response = {cn.ACTION: cn.DELETE_RATING,
+                    cn.STATUS: 400,
+                    cn.CONTENT: {cn.ID: rating_id}}
+        if isinstance(rating_id, list):
+            # Удаляем список оценок в одной транзакции
+            deleted_ids = self.db.delete_ratings(rating_id)
+            if deleted_ids:
+                response[cn.STATUS] = 200
+                response[cn.CONTENT] = {cn.ID: deleted_ids}
+        elif rating_id is not None and self.db.delete_rating(rating_id):
+            # Оценка удалена
+            response[cn.STATUS] = 200
+        # Добавляем задачу отправки ответа клиенту
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
+    def process_get_cheapest_basket(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на поиск магазинов, в которых покупка
+        списка товаров обойдется дешевле всего.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        content = msg.get(cn.CONTENT) or {}
+        product_names = content.get(cn.ITEMS)
+        estimation_name = content.get(cn.FILTER, cn.PRICE_FILTER)
+        response = {cn.ACTION: cn.GET_CHEAPEST_BASKET,
+                    cn.STATUS: 400}
+        try:
+            if (not isinstance(product_names, list) or
+                    not 0 < len(product_names) <= cn.MAX_BATCH_ITEMS or
+                    not all(isinstance(name, str) for name in product_names)):
+                raise ValueError
+            max_stores = int(content.get(cn.LIMIT, 1))
+            if not 0 < max_stores <= cn.MAX_BASKET_STORES:
+                raise ValueError
+        except (TypeError, ValueError):
+            tasks.append({cn.SOCKET: sock, cn.MSG: response})
+            return
+        basket = self.db.get_cheapest_basket(product_names, estimation_name,
+                                             max_stores)
+        if basket is not None:
+            response[cn.STATUS] = 200
+            response[cn.CONTENT] = basket
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
     def process_get_estimations_and_products(self, msg, sock, tasks):
         """Метод обрабатывает запрос на получение всех фильтров и товаров.
         :param msg: сообщение от клиента;
@@ -126,6 +415,14 @@ class Server():
         :param tasks: список задач по отправке сообщений из сервера
         клиентам."""
 
+        content = msg.get(cn.CONTENT) or {}
+        version = self.db.get_catalog_version()
+        if content.get(cn.IF_VERSION) == version:
+            # Фильтры и товары у клиента не устарели
+            tasks.append({cn.SOCKET: sock,
+                          cn.MSG: self.not_modified(
+                              cn.GET_FILTERS_AND_PRODUCTS, version)})
+            return
         # Получаем данные о фильтрах
         estimations = self.db.get_estimations()
         # Получаем названия товаров
@@ -133,10 +430,67 @@ class Server():
         task = {cn.SOCKET: sock,
                 cn.MSG: {cn.ACTION: cn.GET_FILTERS_AND_PRODUCTS,
                          cn.STATUS: 200,
+                         cn.VERSION: version,
                          cn.CONTENT: {cn.FILTER: estimations,
                                       cn.PRODUCT: products}}}
         tasks.append(task)
 
+    def process_get_price_history(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на получение истории оценок (цен)
+        товара по фильтру за период.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        content = msg.get(cn.CONTENT) or {}
+        response = {cn.ACTION: cn.GET_PRICE_HISTORY,
+                    cn.STATUS: 400}
+        try:
+            since = parse_date(content.get(cn.SINCE))
+            until = parse_date(content.get(cn.UNTIL))
+            max_points = int(content.get(cn.LIMIT, cn.HISTORY_POINTS))
+            if not 0 < max_points <= cn.MAX_HISTORY_POINTS:
+                raise ValueError
+        except (TypeError, ValueError):
+            tasks.append({cn.SOCKET: sock, cn.MSG: response})
+            return
+        history = self.db.get_price_history(
+            content.get(cn.PRODUCT), content.get(cn.FILTER, cn.PRICE_FILTER),
+            since, until, max_points)
+        if history is not None:
+            response[cn.STATUS] = 200
+            response[cn.CONTENT] = history
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
+    def process_get_statistics(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на получение статистики оценок товара по
+        заданному фильтру.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        # Получаем информацию из сообщения
+        content = msg.get(cn.CONTENT, {})
+        # Заготовка ответа
+        response = {cn.ACTION: cn.GET_STATISTICS,
+                    cn.STATUS: 400}
+        try:
+            # Период времени, за который нужна статистика
+            since = parse_date(content.get(cn.SINCE))
+            until = parse_date(content.get(cn.UNTIL))
+        except (TypeError, ValueError):
+            tasks.append({cn.SOCKET: sock, cn.MSG: response})
+            return
+        statistics = self.db.get_statistics(
+            content.get(cn.PRODUCT), content.get(cn.FILTER), since, until)
+        if statistics:
+            response[cn.STATUS] = 200
+            response[cn.CONTENT] = statistics
+        # Добавляем задачу отправки ответа клиенту
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
     def process_get_ratings(self, msg, sock, tasks):
         """Метод обрабатывает запрос на получение оценок товаров по заданному
         фильтру.
@@ -152,15 +506,189 @@ class Server():
         # Заготовка ответа
         response = {cn.ACTION: cn.GET_RATINGS,
                     cn.STATUS: 400}
+        try:
+            # Период времени, за который нужны оценки
+            since = parse_date(content.get(cn.SINCE))
+            until = parse_date(content.get(cn.UNTIL))
+            # Сортировка и фильтры оценок
+            sort = content.get(cn.SORT, cn.RATING)
+            order = content.get(cn.ORDER, cn.ASC)
+            min_rating = content.get(cn.MIN)
+            max_rating = content.get(cn.MAX)
+            if (sort not in (cn.ADDRESS, cn.DATE, cn.RATING) or
+                    order not in (cn.ASC, cn.DESC)):
+                raise ValueError
+            if min_rating is not None:
+                min_rating = float(min_rating)
+            if max_rating is not None:
+                max_rating = float(max_rating)
+            # Страница оценок
+            limit = content.get(cn.LIMIT)
+            offset = int(content.get(cn.OFFSET, 0))
+            if limit is not None:
+                limit = int(limit)
+            response[cn.OFFSET] = offset
+        except (TypeError, ValueError):
+            tasks.append({cn.SOCKET: sock, cn.MSG: response})
+            return
+        # В компактном виде каждая оценка передается списком значений полей
+        # RATING_COLUMNS, а не словарем
+        compact = bool(content.get(cn.COMPACT))
+        fields = {cn.COLUMNS: cn.RATING_COLUMNS} if compact else {}
+        version = self.db.get_ratings_version(product_name, estimation_name)
+        if version is not None:
+            if content.get(cn.IF_VERSION) == version:
+                # Оценки не изменились с тех пор, как клиент их получил
+                tasks.append({cn.SOCKET: sock,
+                              cn.MSG: self.not_modified(cn.GET_RATINGS,
+                                                        version)})
+                return
+            fields[cn.VERSION] = version
+        if content.get(cn.STREAM):
+            # Оценки отправляются частями, которые читаются из базы данных
+            # по мере отправки
+            chunks = self.db.iter_ratings(
+                product_name, estimation_name, cn.STREAM_CHUNK_SIZE,
+                since=since, until=until, sort=sort, order=order,
+                min_rating=min_rating, max_rating=max_rating,
+                address=content.get(cn.ADDRESS), compact=compact)
+            tasks.append({cn.SOCKET: sock,
+                          cn.STREAM: self.stream_chunks(cn.GET_RATINGS,
+                                                        chunks, fields)})
+            return
+        # Ответ целиком не может содержать больше MAX_RATINGS_PER_RESPONSE
+        # оценок
+        if limit is None or limit > cn.MAX_RATINGS_PER_RESPONSE:
+            limit = cn.MAX_RATINGS_PER_RESPONSE
         # Получаем оценки товара по фильтру
-        ratings = self.db.get_ratings(product_name, estimation_name)
+        ratings = self.db.get_ratings(
+            product_name, estimation_name, since, until, sort, order,
+            min_rating, max_rating, content.get(cn.ADDRESS), limit, offset,
+            compact)
         if ratings:
             # Формируем ответ
             response[cn.STATUS] = 200
             response[cn.CONTENT] = ratings
+            response.update(fields)
+        # Добавляем задачу отправки ответа клиенту
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
+    def process_get_ratings_batch(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на получение первых оценок сразу для
+        нескольких пар (товар, фильтр), например, для сравнения цен товаров
+        из списка покупок. Оценки всех пар возвращаются одним ответом.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        content = msg.get(cn.CONTENT) or {}
+        items = content.get(cn.ITEMS)
+        sort = content.get(cn.SORT, cn.RATING)
+        order = content.get(cn.ORDER, cn.ASC)
+        response = {cn.ACTION: cn.GET_RATINGS_BATCH,
+                    cn.STATUS: 400}
+        try:
+            if (not isinstance(items, list) or
+                    not 0 < len(items) <= cn.MAX_BATCH_ITEMS or
+                    sort not in (cn.ADDRESS, cn.DATE, cn.RATING) or
+                    order not in (cn.ASC, cn.DESC)):
+                raise ValueError
+            pairs = [(item[cn.PRODUCT], item[cn.FILTER]) for item in items]
+            if not all(isinstance(name, str) for pair in pairs
+                       for name in pair):
+                raise ValueError
+            limit = int(content.get(cn.LIMIT, cn.BATCH_RATINGS_LIMIT))
+            if limit < 1:
+                raise ValueError
+        except (KeyError, TypeError, ValueError):
+            tasks.append({cn.SOCKET: sock, cn.MSG: response})
+            return
+        # Ответ не может содержать больше MAX_RATINGS_PER_RESPONSE оценок
+        limit = min(limit, cn.MAX_RATINGS_PER_RESPONSE // len(pairs))
+        compact = bool(content.get(cn.COMPACT))
+        results = self.db.get_ratings_batch(pairs, sort, order, limit,
+                                            compact)
+        response[cn.STATUS] = 200
+        response[cn.CONTENT] = []
+        for (product_name, estimation_name), result in zip(pairs, results):
+            item = {cn.PRODUCT: product_name, cn.FILTER: estimation_name,
+                    cn.STATUS: 400}
+            if result is not None:
+                item[cn.STATUS] = 200
+                item[cn.VERSION], item[cn.CONTENT] = result
+            response[cn.CONTENT].append(item)
+        if compact:
+            response[cn.COLUMNS] = cn.RATING_COLUMNS
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
+    def process_get_server_stats(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на получение статистики работы
+        сервера.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        stats = self.limiter.get_stats()
+        stats[cn.CLIENTS] = len(self.connections)
+        stats[cn.REAPED] = self.reaped
+        stats[cn.QUEUED] = self.queued
+        stats[cn.OVERLOADED] = self.overloaded
+        if self.backup is not None:
+            stats[cn.BACKUP] = self.backup.get_stats()
+        tasks.append({cn.SOCKET: sock,
+                      cn.MSG: {cn.ACTION: cn.GET_SERVER_STATS,
+                               cn.STATUS: 200,
+                               cn.CONTENT: stats}})
+
+    def process_search_products(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на поиск товаров по названию.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        # Получаем информацию из сообщения
+        content = msg.get(cn.CONTENT, {})
+        query = content.get(cn.PRODUCT)
+        limit = content.get(cn.LIMIT, cn.SEARCH_LIMIT)
+        # Заготовка ответа
+        response = {cn.ACTION: cn.SEARCH_PRODUCTS,
+                    cn.STATUS: 400}
+        if isinstance(query, str) and isinstance(limit, int):
+            limit = min(limit, cn.MAX_SEARCH_LIMIT)
+            response[cn.STATUS] = 200
+            response[cn.CONTENT] = self.db.search_products(query, limit)
         # Добавляем задачу отправки ответа клиенту
         tasks.append({cn.SOCKET: sock, cn.MSG: response})
 
+    def process_hello(self, msg, sock, tasks):
+        """Метод обрабатывает запрос на согласование параметров соединения.
+        Клиент присылает список поддерживаемых способов сжатия сообщений, а
+        сервер выбирает из них способ, которым будет сжимать большие ответы.
+        :param msg: сообщение от клиента;
+        :param sock: сокет клиента;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        content = msg.get(cn.CONTENT, {})
+        codec = self.messenger.choose_codec(content.get(cn.COMPRESSION))
+        self.connections.get(sock).codec = codec
+        tasks.append({cn.SOCKET: sock,
+                      cn.MSG: {cn.ACTION: cn.HELLO,
+                               cn.STATUS: 200,
+                               cn.CONTENT: {cn.COMPRESSION: codec}}})
+
+    def not_modified(self, action, version):
+        """Метод создает короткий ответ о том, что данные у клиента не
+        устарели.
+        :param action: тип ответа;
+        :param version: текущая версия данных.
+        :return: сообщение."""
+
+        return {cn.ACTION: action, cn.STATUS: 304, cn.VERSION: version}
+
     def process_msg(self, msg, sock, tasks):
         """Метод обрабатывает сообщение от клиента.
         :param msg: словарь-сообщение от клиента;
@@ -168,6 +696,25 @@ class Server():
         :param tasks: список задач по отправке сообщений из сервера
         клиентам."""
 
+        n = len(tasks)
+        self.dispatch_msg(msg, sock, tasks)
+        request_id = msg.get(cn.REQUEST_ID)
+        if request_id is not None:
+            # Возвращаем идентификатор запроса в ответах на него
+            for task in tasks[n:]:
+                if cn.MSG in task:
+                    task[cn.MSG][cn.REQUEST_ID] = request_id
+                else:
+                    task[cn.REQUEST_ID] = request_id
+
+    def dispatch_msg(self, msg, sock, tasks):
+        """Метод вызывает обработчик сообщения от клиента в зависимости от
+        типа сообщения.
+        :param msg: словарь-сообщение от клиента;
+        :param sock: сокет клиента, от кого получено сообщение;
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
         action = msg.get(cn.ACTION)
         if action == cn.ADD_FILTER:
             # Запрос на добавление нового фильтра
@@ -178,63 +725,261 @@ class Server():
         if action == cn.ADD_RATING:
             # Запрос на добавление оценки товара
             return self.process_add_rating(msg, sock, tasks)
+        if action == cn.DELETE_RATING:
+            # Запрос на удаление оценки или списка оценок
+            return self.process_delete_rating(msg, sock, tasks)
         if action == cn.GET_FILTERS_AND_PRODUCTS:
             # Запрос на получение всех фильтров и товаров
             return self.process_get_estimations_and_products(msg, sock, tasks)
         if action == cn.GET_RATINGS:
             # Запрос на получение оценок товара по заданному фильтру
             return self.process_get_ratings(msg, sock, tasks)
+        if action == cn.GET_RATINGS_BATCH:
+            # Запрос на получение оценок нескольких товаров
+            return self.process_get_ratings_batch(msg, sock, tasks)
+        if action == cn.HELLO:
+            # Запрос на согласование параметров соединения
+            return self.process_hello(msg, sock, tasks)
+        if action == cn.GET_STATISTICS:
+            # Запрос на получение статистики оценок товара по фильтру
+            return self.process_get_statistics(msg, sock, tasks)
+        if action == cn.GET_CHEAPEST_BASKET:
+            # Запрос на поиск самой дешевой покупки списка товаров
+            return self.process_get_cheapest_basket(msg, sock, tasks)
+        if action == cn.GET_PRICE_HISTORY:
+            # Запрос на получение истории оценок товара по фильтру
+            return self.process_get_price_history(msg, sock, tasks)
+        if action == cn.SEARCH_PRODUCTS:
+            # Запрос на поиск товаров по названию
+            return self.process_search_products(msg, sock, tasks)
+        if action == cn.GET_SERVER_STATS:
+            # Запрос на получение статистики работы сервера
+            return self.process_get_server_stats(msg, sock, tasks)
+        if action == cn.BACKUP:
+            # Запрос на резервное копирование базы данных
+            return self.process_backup(msg, sock, tasks)
 
-    def read_messages(self, clients_read, all_clients, tasks):
+    def read_messages(self, clients_read, tasks):
         """Метод читает сообщения от клиентов.
-        :param clients_read: список сокетов клиентов, сообщения от которых
-        нужно прочитать;
-        :param all_clients: список всех сокетов клиентов;
+        :param clients_read: список объектов Connection для клиентов,
+        сообщения от которых нужно прочитать;
         :param tasks: список задач по отправке сообщений из сервера
         клиентам."""
 
-        for sock in clients_read:
+        for connection in clients_read:
+            sock = connection.sock
             try:
-                # Сообщение от клиента и его IP адрес
-                ip_address = get_socket_param(sock)
-                msg = self.messenger.get_msg(sock)
-                printf(f'Клиент с адресом {ip_address} прислал сообщение: '
-                       f'{msg}')
-                # Обрабатываем сообщение
-                self.process_msg(msg, sock, tasks)
+                data = self.messenger.receive_all_msg(sock)
+                msg = self.messenger.decode_msg(data)
+                if self.capture is not None:
+                    self.capture.add(connection.serial, data)
+                self.connections.touch(connection, time.monotonic())
+                printf(f'Клиент с адресом {connection.name} прислал '
+                       f'сообщение: {msg}')
+                # Ставим сообщение в очередь на обработку
+                self.admit_msg(msg, sock, tasks)
             except Exception:
                 # Не удалось прочесть сообщение от клиента, потому что клиент
-                # вышел из сети
-                all_clients.remove(sock)
-                printf(f'Клиент с адресом {ip_address} отключился')
-
-    def write_responses(self, clients_write, all_clients, tasks):
-        """Метод отправляет ответы клиентам, которым это нужно.
-        :param clients_write: список сокетов клиентов, ожидающих получения
-        сообщения;
-        :param all_clients: список сокетов всех клиентов;
+                # вышел из сети. Закрываем сокет, чтобы клиент, приславший
+                # слишком большое или испорченное сообщение, узнал об
+                # отключении
+                self.close_client(sock)
+
+    def process_queues(self, tasks):
+        """Метод обрабатывает запросы из очередей клиентов: по одному
+        запросу от каждого клиента по кругу, но не больше
+        MAX_REQUESTS_PER_PASS запросов за вызов. Поэтому клиент, приславший
+        много запросов, не задерживает запросы других клиентов.
         :param tasks: список задач по отправке сообщений из сервера
         клиентам."""
 
-        while tasks:
-            # Берем первую в списке задачу
-            task = tasks[0]
-            # Сокет клиента и его IP адрес
+        for _ in range(cn.MAX_REQUESTS_PER_PASS):
+            if not self.queues:
+                return
+            # Первый клиент в словаре после обработки запроса перемещается
+            # в конец
+            sock = next(iter(self.queues))
+            queue = self.queues.pop(sock)
+            msg = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.queues[sock] = queue
+            started = time.monotonic()
+            try:
+                self.process_msg(msg, sock, tasks)
+            except Exception:
+                # Запрос клиента не удалось обработать, отключаем клиента
+                self.close_client(sock)
+                continue
+            # Запоминаем время обработки запроса, чтобы знать, насколько
+            # резервное копирование замедляет обработку запросов
+            finished = time.monotonic()
+            self.latencies.append(finished - started)
+            backup = self.backup
+            if backup is not None and backup.started < finished and (
+                    backup.finished is None or backup.finished > started):
+                # Обработка запроса пересеклась с копированием
+                backup.add_latency(finished - started)
+
+    def report_backup(self, tasks):
+        """Метод отправляет итоги резервного копирования клиенту, который
+        его запросил, когда копирование закончится.
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        backup = self.backup
+        if backup is None or backup.state == cn.RUNNING or \
+                self.backup_sock is None:
+            return
+        sock = self.backup_sock
+        self.backup_sock = None
+        stats = backup.get_stats()
+        printf(f'Резервное копирование закончено: {stats}')
+        if self.connections.get(sock) is None:
+            # Клиент уже отключился
+            return
+        response = {cn.ACTION: cn.BACKUP,
+                    cn.STATUS: 200 if backup.state == cn.DONE else 500,
+                    cn.CONTENT: stats}
+        if self.backup_request_id is not None:
+            response[cn.REQUEST_ID] = self.backup_request_id
+        tasks.append({cn.SOCKET: sock, cn.MSG: response})
+
+    def run_archiving(self):
+        """Метод периодически переносит устаревшие оценки в архивные базы
+        данных."""
+
+        if not self.retention_days:
+            return
+        now = time.monotonic()
+        if now - self.archived_at < cn.ARCHIVE_INTERVAL:
+            return
+        self.archived_at = now
+        n = self.db.archive_ratings(self.retention_days)
+        if n:
+            printf(f'В архив перенесено оценок: {n}')
+
+    def run_key_expiry(self):
+        """Метод периодически удаляет ключи идемпотентности оценок, которые
+        хранятся дольше IDEMPOTENCY_KEY_TTL секунд."""
+
+        now = time.monotonic()
+        if now - self.keys_expired_at < cn.KEY_EXPIRY_INTERVAL:
+            return
+        self.keys_expired_at = now
+        n = self.db.expire_rating_keys()
+        if n:
+            printf(f'Удалено устаревших ключей идемпотентности: {n}')
+
+    def run_reaping(self):
+        """Метод периодически закрывает соединения, в которых не было
+        активности дольше idle_timeout секунд, и удаляет ненужные ведра
+        токенов."""
+
+        now = time.monotonic()
+        if now - self.reaped_at < cn.REAP_INTERVAL:
+            return
+        self.reaped_at = now
+        self.limiter.prune()
+        if not self.idle_timeout:
+            return
+        for connection in self.connections.get_idle(now, self.idle_timeout):
+            if connection.sock in self.queues:
+                # У клиента есть необработанные запросы
+                continue
+            printf(f'Соединение с клиентом с адресом {connection.name} '
+                   f'закрыто из-за простоя')
+            self.close_client(connection.sock)
+            self.reaped += 1
+
+    def run_compaction(self):
+        """Метод периодически удаляет из базы данных оценки, помеченные
+        удаленными."""
+
+        if not self.db.soft_delete:
+            return
+        now = time.monotonic()
+        if now - self.compacted_at < cn.COMPACTION_INTERVAL:
+            return
+        self.compacted_at = now
+        n = self.db.compact()
+        if n:
+            printf(f'Из базы данных удалено помеченных оценок: {n}')
+
+    def stream_chunks(self, action, chunks, fields=None):
+        """Метод создает сообщения с частями ответа. В каждом сообщении поле
+        MORE показывает, будут ли еще части. Последняя часть может быть
+        пустой.
+        :param action: тип ответа;
+        :param chunks: генератор списков с частями ответа;
+        :param fields: словарь с дополнительными полями каждого сообщения.
+        :return: генератор сообщений."""
+
+        for chunk in chunks:
+            more = len(chunk) == cn.STREAM_CHUNK_SIZE
+            msg = {cn.ACTION: action, cn.STATUS: 200, cn.CONTENT: chunk,
+                   cn.MORE: more}
+            if fields:
+                msg.update(fields)
+            yield msg
+            if not more:
+                return
+
+    def write_responses(self, tasks):
+        """Метод отправляет ответы клиентам, которым это нужно. Из задачи с
+        ответом, передаваемым по частям, за один вызов отправляется одна
+        часть, поэтому в памяти находится не больше одной части ответа, а
+        другие клиенты не ждут окончания передачи.
+        :param tasks: список задач по отправке сообщений из сервера
+        клиентам."""
+
+        # Сокеты, которым уже отправлено сообщение при этом вызове. Ответы
+        # одному клиенту отправляются строго по очереди
+        served = set()
+        # Сокеты, соединения с которыми закрыты. Ответы им не нужны
+        closed = set()
+        # Задачи, которые останутся после этого вызова
+        remaining = []
+        for task in tasks:
+            # Сокет клиента
             sock = task[cn.SOCKET]
-            ip_address = get_socket_param(sock)
+            if sock in closed or sock.fileno() < 0:
+                continue
+            if sock in served:
+                remaining.append(task)
+                continue
+            served.add(sock)
             # Сообщение для отправки
-            msg = task[cn.MSG]
+            stream = task.get(cn.STREAM)
+            if stream is None:
+                msg = task[cn.MSG]
+            else:
+                try:
+                    msg = next(stream, None)
+                except Exception:
+                    # Не удалось получить очередную часть ответа
+                    msg = {cn.ACTION: cn.GET_RATINGS, cn.STATUS: 400}
+                    stream.close()
+                if msg is not None and msg.get(cn.STATUS) == 200 and \
+                        msg.get(cn.MORE):
+                    remaining.append(task)
+                if msg is None:
+                    continue
+                if task.get(cn.REQUEST_ID) is not None:
+                    msg[cn.REQUEST_ID] = task[cn.REQUEST_ID]
+            connection = self.connections.get(sock)
             try:
-                # Отправляем сообщение
-                self.messenger.send_msg(sock, msg)
-                printf(f'Клиенту с адресом {ip_address} отправлено сообщение:'
-                       f' {msg}')
+                # Отправляем сообщение, сжимая его, если клиент это умеет
+                self.messenger.send_msg(sock, msg, connection.codec)
+                self.connections.touch(connection, time.monotonic())
+                printf(f'Клиенту с адресом {connection.name} отправлено '
+                       f'сообщение: {msg}')
             except Exception:
-                # Сообщение не удалось отправить, так как клиент отключился
-                all_clients.remove(sock)
-                printf(f'Клиент с адресом {ip_address} отключился')
-            finally:
-                del tasks[0]
+                # Сообщение не удалось отправить, так как клиент отключился.
+                # Остальные ответы этому клиенту не нужны
+                self.close_client(sock)
+                closed.add(sock)
+        tasks[:] = remaining
 
 
 def run():
@@ -242,31 +987,31 @@ def run():
 
     # Создаем объект-сервер
     server = Server()
-    all_clients = []  # список для всех клиентов
     # Список задач по отправке сообщений. Каждая задача - словарь в формате
     # {sock: сокет клиента, MSG: сообщение-словарь, которое нужно отправить}
     tasks = []
-    while True:
-        try:
-            client_sock, _ = server.sock.accept()
-            ip_address = get_socket_param(client_sock)
-            printf(f'Подключился клиент с адресом {ip_address}')
-        except OSError:
-            pass
-        else:
-            # Добавляем клиента
-            all_clients.append(client_sock)
-        finally:
-            clients_read = []  # список сокетов для клиентов, ожидающих чтения
-            clients_write = []  # список сокетов для клиентов, ожидающих записи
-            try:
-                clients_read, clients_write, errors = select.select(
-                    all_clients, all_clients, [], 0)
-            except Exception:
-                pass
-            server.read_messages(clients_read, all_clients, tasks)
+    try:
+        while True:
+            # Пока есть неотправленные ответы или необработанные запросы, не
+            # ждем сообщений и подключений
+            clients_read = server.get_readable(
+                0 if tasks or server.queues else 0.1)
+            server.read_messages(clients_read, tasks)
+            server.process_queues(tasks)
+            server.report_backup(tasks)
             if tasks:
-                server.write_responses(clients_write, all_clients, tasks)
+                server.write_responses(tasks)
+            # Фоновое сжатие базы данных, перенос устаревших оценок в архив,
+            # удаление устаревших ключей идемпотентности и закрытие
+            # простаивающих соединений
+            server.run_compaction()
+            server.run_archiving()
+            server.run_key_expiry()
+            server.run_reaping()
+    finally:
+        # Дописываем журнал сообщений
+        if server.capture is not None:
+            server.capture.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+"""Программа для замера времени запуска сервера и клиента. Замеряются время
+импорта модулей (по данным python -X importtime) и время от запуска сервера до
+ответа на первый запрос с новой и с уже подготовленной базой данных. Если
+какое-то время превышает допустимое, программа завершается с кодом 1.
+
+Запуск: python startup_benchmark.py [-p порт]"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import const as cn
+from messenger import Messenger
+from utilities import determine_port
+
+# Папка с модулями программы
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+# Допустимое время импорта модулей в секундах
+MAX_IMPORT_TIME = {'server': 0.15, 'client': 0.1, 'database': 0.4}
+# Допустимое время от запуска сервера до ответа на первый запрос в секундах
+MAX_STARTUP_TIME = 1.0
+# Количество самых долгих импортов, которые выводятся в отчете
+TOP_IMPORTS = 10
+# Количество повторов каждого замера (в отчет идет лучший результат)
+REPEATS = 3
+
+
+def measure_import(module):
+    """Функция замеряет время импорта модуля в отдельном процессе.
+    :param module: название модуля.
+    :return: кортеж из времени импорта модуля в секундах и списка пар
+    (время в секундах, название) вложенных импортов."""
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SRC_PATH, capture_output=True, text=True, check=True)
+    imports = []
+    total = 0.0
+    for line in result.stderr.splitlines():
+        # Строки имеют вид "import time: self | cumulative | name"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative) / 1e6, name.strip()))
+        if name.strip() == module:
+            total = int(cumulative) / 1e6
+    return total, imports
+
+
+def measure_startup(port, cwd):
+    """Функция запускает сервер и замеряет время до ответа на первый запрос.
+    :param port: порт сервера;
+    :param cwd: рабочая папка сервера, в которой находится база данных.
+    :return: время в секундах."""
+
+    messenger = Messenger()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(SRC_PATH, 'server.py'), '-p',
+         str(port)], cwd=cwd, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError('Сервер завершил работу при запуске')
+            try:
+                sock = socket.create_connection((cn.DEFAULT_IP_ADDRESS, port))
+            except ConnectionRefusedError:
+                time.sleep(0.005)
+                continue
+            with sock:
+                messenger.send_msg(sock, {cn.ACTION: cn.HELLO,
+                                          cn.CONTENT: {cn.COMPRESSION: []}})
+                messenger.get_msg(sock)
+            return time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    """Функция выполняет замеры и проверяет допустимое время."""
+
+    failed = False
+    for module, max_time in MAX_IMPORT_TIME.items():
+        results = [measure_import(module) for _ in range(REPEATS)]
+        total, imports = min(results, key=lambda x: x[0])
+        failed |= total > max_time
+        print(f'Импорт {module}: {1000 * total:.1f} мс (допустимо '
+              f'{1000 * max_time:.0f} мс)')
+        for cumulative, name in sorted(imports, reverse=True)[1:TOP_IMPORTS]:
+            print(f'    {1000 * cumulative:8.1f} мс  {name}')
+    port = determine_port()
+    with tempfile.TemporaryDirectory() as cwd:
+        # Первый запуск создает базу данных, следующие используют готовую
+        times = [measure_startup(port, cwd) for _ in range(REPEATS + 1)]
+    for name, value in (('новая база данных', times[0]),
+                        ('готовая база данных', min(times[1:]))):
+        failed |= value > MAX_STARTUP_TIME
+        print(f'Запуск сервера ({name}): {1000 * value:.1f} мс (допустимо '
+              f'{1000 * MAX_STARTUP_TIME:.0f} мс)')
+    if failed:
+        print('Время запуска превышает допустимое')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
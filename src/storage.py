@@ -0,0 +1,573 @@
+"""Модуль содержит базовый класс хранилища данных сервера. Хранилище
+определяет набор методов, которые использует сервер, и может быть реализовано
+поверх SQLite (класс Database) или полностью в памяти (класс
+MemoryDatabase)."""
+
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import timedelta
+from basket import PriceIndex, basket_plan, cheapest_split, cheapest_store
+from history import DAY_FORMAT, build_history
+from search import ProductIndex
+from const import *
+
+# Названия хранилищ, которые можно выбрать при запуске сервера
+STORAGE_SQLITE = 'sqlite'
+STORAGE_MEMORY = 'memory'
+# Ключ версии набора данных с фильтрами и товарами
+CATALOG = 'catalog'
+
+
+def create_storage(name=STORAGE_SQLITE, **kwargs):
+    """Функция создает хранилище данных сервера.
+    :param name: название хранилища (STORAGE_SQLITE или STORAGE_MEMORY);
+    :param kwargs: параметры конструктора хранилища.
+    :return: объект хранилища."""
+
+    if name == STORAGE_MEMORY:
+        from memory_database import MemoryDatabase
+        return MemoryDatabase(**kwargs)
+    if name == STORAGE_SQLITE:
+        from database import Database
+        return Database(**kwargs)
+    raise ValueError(f'Неизвестное хранилище {name}')
+
+
+def rating_data(row):
+    """Функция преобразует строку оценки в данные оценки для клиента.
+    :param row: кортеж (ID, адрес, оценка, дата) - поля RATING_COLUMNS.
+    :return: словарь с данными оценки."""
+
+    return {ID: row[0], ADDRESS: row[1], RATING: row[2], DATE: row[3]}
+
+
+def limit_rating(rating, min_value, max_value):
+    """Функция ограничивает оценку пределами значений оценки по фильтру.
+    :param rating: оценка;
+    :param min_value, max_value: пределы значений оценки. Если None, то
+    предела нет.
+    :return: оценка в заданных пределах."""
+
+    if min_value is not None and rating < min_value:
+        # Оценка по фильтру не может быть меньше минимального значения
+        rating = min_value
+    if max_value is not None and rating > max_value:
+        # Оценка по фильтру не может быть больше максимального значения
+        rating = max_value
+    return rating
+
+
+class Storage(ABC):
+    """Базовый класс хранилища данных сервера. Абстрактные методы
+    составляют протокол хранилища, который реализуют Database и
+    MemoryDatabase. Остальные методы построены на абстрактных и общие для
+    всех хранилищ."""
+
+    def __init__(self, soft_delete=False):
+        """Конструктор.
+        :param soft_delete: если True, то оценки при удалении только
+        помечаются удаленными, а физически удаляются методом compact."""
+
+        self.soft_delete = soft_delete
+        # Индекс названий товаров для быстрого поиска
+        self.product_index = ProductIndex()
+        # Кэш статистики оценок: словарь (ID товара, ID фильтра) -> словарь
+        # (начало периода, конец периода) -> статистика. Очищается при
+        # изменении оценок товара по фильтру
+        self.statistics_cache = {}
+        # Пары ((ID товара, ID фильтра), (начало периода, конец периода))
+        # статистик из кэша в порядке от давно запрошенной к последней
+        # запрошенной. Когда статистик становится больше
+        # STATISTICS_CACHE_SIZE, из кэша удаляется давно запрошенная
+        self.statistics_order = OrderedDict()
+        # Версии наборов данных. При каждом изменении набора данных ему
+        # выдается новая версия, большая всех выданных ранее. Версии
+        # отсчитываются от времени запуска в микросекундах, поэтому после
+        # перезапуска сервера версии не повторяются
+        self.start_version = self.last_version = time.time_ns() // 1000
+        # Словарь набор данных -> версия. Набор данных - CATALOG (фильтры и
+        # товары), пара (ID товара, ID фильтра) (оценки товара по фильтру)
+        # или пара (ID товара, None) (все оценки товара)
+        self.versions = {}
+        # Индексы последних цен: словарь ID фильтра -> PriceIndex. Индекс
+        # строится при первом поиске самой дешевой покупки по фильтру
+        self.price_indexes = {}
+
+    @abstractmethod
+    def add_estimation(self, estimation_name, min_value=None, max_value=None):
+        """Метод добавляет фильтр.
+        :param estimation_name: название фильтра;
+        :param min_value, max_value: минимальная и максимальная оценки товара
+        по фильтру. Если None, то предела нет.
+        :return: данные добавленного фильтра или None, если фильтр с таким
+        названием уже есть."""
+
+    @abstractmethod
+    def add_product(self, product_name):
+        """Метод добавляет товар.
+        :param product_name: название товара.
+        :return: данные добавленного товара или None, если товар с таким
+        названием уже есть."""
+
+    @abstractmethod
+    def add_rating(self, product_name, estimation_name, rating, address,
+                   key=None):
+        """Метод добавляет оценку товара. Если товара нет, то он
+        добавляется.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра, по которому оценивается
+        товар;
+        :param rating: оценка по фильтру. Оценка ограничивается пределами
+        значений оценки по фильтру;
+        :param address: адрес магазина, в котором приобретен оцениваемый
+        товар;
+        :param key: ключ идемпотентности оценки. Если оценка с таким ключом
+        уже добавлена, то новая оценка не добавляется.
+        :return: ID добавленной (или ранее добавленной с тем же ключом)
+        оценки или None, если фильтра нет."""
+
+    @abstractmethod
+    def archive_ratings(self, days, batch_size=ARCHIVE_BATCH_SIZE):
+        """Метод убирает из хранилища оценки старше заданного
+        количества дней. Дневные сводки оценок остаются.
+        :param days: количество дней, в течение которых оценки хранятся в
+        хранилище;
+        :param batch_size: максимальное количество оценок, убираемых за один
+        вызов.
+        :return: количество убранных оценок."""
+
+    def cache_statistics(self, key, window, statistics):
+        """Метод сохраняет статистику оценок в кэше и удаляет из кэша
+        давно запрошенную статистику, если кэш переполнен.
+        :param key: пара (ID товара, ID фильтра);
+        :param window: пара (начало периода, конец периода);
+        :param statistics: статистика оценок."""
+
+        self.statistics_cache.setdefault(key, {})[window] = statistics
+        self.statistics_order[(key, window)] = None
+        while len(self.statistics_order) > STATISTICS_CACHE_SIZE:
+            (old_key, old_window), _ = self.statistics_order.popitem(
+                last=False)
+            cache = self.statistics_cache[old_key]
+            del cache[old_window]
+            if not cache:
+                del self.statistics_cache[old_key]
+
+    def catalog_changed(self):
+        """Метод выдает новую версию набору данных с фильтрами и товарами."""
+
+        self.last_version += 1
+        self.versions[CATALOG] = self.last_version
+
+    @abstractmethod
+    def change_estimation(self, estimation_name, min_value=None,
+                          max_value=None):
+        """Метод изменяет пределы значений оценки по фильтру.
+        :param estimation_name: название фильтра;
+        :param min_value, max_value: новые предельные значения оценки по
+        фильтру. Если None, то предела нет."""
+
+    @abstractmethod
+    def compact(self, batch_size=COMPACTION_BATCH_SIZE):
+        """Метод физически удаляет оценки, помеченные удаленными.
+        :param batch_size: максимальное количество оценок, удаляемых за один
+        вызов (чтобы сжатие не блокировало надолго обработку запросов).
+        :return: количество удаленных оценок."""
+
+    @abstractmethod
+    def create_backup(self, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+        """Метод готовит резервное копирование хранилища без
+        остановки сервера. Копирование запускается методом start
+        возвращенного объекта.
+        :param pages: количество страниц, копируемых за один шаг;
+        :param pause: пауза между шагами в секундах.
+        :return: объект OnlineBackup или None, если хранилище нельзя
+        скопировать."""
+
+    @abstractmethod
+    def delete_product(self, product_name):
+        """Метод удаляет товар вместе со всеми его оценками и их
+        ключами идемпотентности.
+        :param product_name: название товара.
+        :return: True, если товар удален, иначе False."""
+
+    def delete_rating(self, rating_id):
+        """Метод удаляет оценку товара.
+        :param rating_id: ID оценки товара.
+        :return: True, если оценка удалена, иначе False."""
+
+        return bool(self.delete_ratings([rating_id]))
+
+    @abstractmethod
+    def delete_ratings(self, rating_ids):
+        """Метод удаляет несколько оценок товаров вместе с их
+        ключами идемпотентности и обновляет дневные сводки оценок. Если
+        soft_delete = True, то оценки только помечаются удаленными.
+        :param rating_ids: список ID оценок.
+        :return: список ID удаленных оценок."""
+
+    @abstractmethod
+    def expire_rating_keys(self, max_age=IDEMPOTENCY_KEY_TTL,
+                           batch_size=KEY_EXPIRY_BATCH_SIZE):
+        """Метод удаляет ключи идемпотентности оценок старше
+        max_age секунд.
+        :param max_age: время хранения ключа в секундах;
+        :param batch_size: максимальное количество ключей, удаляемых за один
+        вызов.
+        :return: количество удаленных ключей."""
+
+    def get_catalog_version(self):
+        """Метод возвращает версию набора данных с фильтрами и товарами.
+        :return: версия."""
+
+        return self.versions.get(CATALOG, self.start_version)
+
+    def get_cheapest_basket(self, product_names, estimation_name,
+                            max_stores=1):
+        """Метод ищет, где покупка списка товаров обойдется дешевле всего: в
+        одном магазине и в наборе не больше чем из max_stores магазинов.
+        Цены товаров берутся из последних оценок товаров по фильтру в
+        каждом магазине.
+        :param product_names: список названий товаров;
+        :param estimation_name: название фильтра с ценами;
+        :param max_stores: максимальное количество магазинов в наборе.
+        :return: словарь с самой дешевой покупкой в одном магазине (SINGLE),
+        в наборе магазинов (SPLIT, если max_stores больше 1) и списком
+        товаров, цен которых нет (MISSING), или None, если фильтра нет."""
+
+        product_names = list(dict.fromkeys(product_names))
+        keys = self.get_keys([(product_name, estimation_name)
+                              for product_name in product_names])
+        estimation_id = self.get_estimation_id(estimation_name)
+        if estimation_id is None:
+            return None
+        index = self.get_price_index(estimation_id)
+        names = []
+        prices = []
+        missing = []
+        for product_name, key in zip(product_names, keys):
+            product_prices = key and index.prices.get(key[0])
+            if product_prices:
+                names.append(product_name)
+                prices.append(product_prices)
+            else:
+                missing.append(product_name)
+        result = {SINGLE: None, MISSING: missing}
+        single = cheapest_store(prices)
+        if single is not None:
+            result[SINGLE] = basket_plan([single[1]], names, prices)
+        if max_stores > 1:
+            split = cheapest_split(prices, max_stores)
+            result[SPLIT] = split and basket_plan(split[1], names, prices)
+        return result
+
+    @abstractmethod
+    def get_estimation_id(self, estimation_name):
+        """Метод возвращает ID фильтра.
+        :param estimation_name: название фильтра.
+        :return: ID или None, если фильтра нет."""
+
+    @abstractmethod
+    def get_estimation_limits(self, estimation_name):
+        """Метод возвращает пределы значений оценки по
+        фильтру.
+        :param estimation_name: название фильтра.
+        :return: кортеж из минимального и максимального значений оценки.
+        Если фильтра нет или у оценки нет предела, то вместо него None."""
+
+    @abstractmethod
+    def get_estimations(self):
+        """Метод возвращает все фильтры.
+        :return: список данных фильтров с названиями и пределами значений
+        оценки."""
+
+    @abstractmethod
+    def get_key(self, product_name, estimation_name):
+        """Метод возвращает пару (ID товара, ID фильтра).
+        :param product_name: название товара;
+        :param estimation_name: название фильтра.
+        :return: пара ID или None, если товара или фильтра нет."""
+
+    def get_key_version(self, key):
+        """Метод возвращает версию набора оценок товара по фильтру.
+        :param key: пара (ID товара, ID фильтра).
+        :return: версия."""
+
+        return max(self.versions.get(key, self.start_version),
+                   self.versions.get((key[0], None), self.start_version))
+
+    def get_keys(self, pairs):
+        """Метод возвращает пары ID для списка пар названий.
+        :param pairs: список пар (название товара, название фильтра).
+        :return: список пар (ID товара, ID фильтра) в том же порядке. Для
+        пар, у которых нет товара или фильтра, - None."""
+
+        return [self.get_key(product_name, estimation_name)
+                for product_name, estimation_name in pairs]
+
+    @abstractmethod
+    def get_latest_prices(self, estimation_id, product_id=None):
+        """Метод возвращает последние оценки товаров по
+        фильтру в каждом магазине.
+        :param estimation_id: ID фильтра;
+        :param product_id: ID товара. Если None, то возвращаются оценки всех
+        товаров.
+        :return: список кортежей (ID товара, адрес магазина, оценка)."""
+
+    def get_price_index(self, estimation_id):
+        """Метод возвращает индекс последних цен по фильтру. Индекс строится
+        при первом обращении, а цены товаров, оценки которых были удалены,
+        загружаются заново.
+        :param estimation_id: ID фильтра.
+        :return: объект PriceIndex."""
+
+        index = self.price_indexes.get(estimation_id)
+        if index is None:
+            index = PriceIndex()
+            index.load(self.get_latest_prices(estimation_id))
+            self.price_indexes[estimation_id] = index
+        for product_id in list(index.stale):
+            index.load(self.get_latest_prices(estimation_id, product_id),
+                       product_id)
+        return index
+
+    def get_price_history(self, product_name, estimation_name, since=None,
+                          until=None, max_points=HISTORY_POINTS):
+        """Метод возвращает историю оценок (цен) товара по фильтру за
+        период: не больше max_points точек с минимумом, средним и максимумом
+        оценок за день, неделю или месяц. История строится по дневным
+        сводкам, поэтому время ответа не зависит от количества оценок.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра;
+        :param since, until: начало и конец (не включительно) периода
+        времени. Период округляется до целых дней. Если None, то период не
+        ограничен;
+        :param max_points: максимальное количество точек.
+        :return: словарь с историей (см. функцию build_history) или None,
+        если товара или фильтра нет."""
+
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            return None
+        first = since.date() if since else None
+        last = (until - timedelta(seconds=1)).date() if until else None
+        rows = self.get_rating_days(
+            key, first.strftime(DAY_FORMAT) if first else None,
+            last.strftime(DAY_FORMAT) if last else None)
+        return build_history(rows, first, last, max_points)
+
+    @abstractmethod
+    def get_products(self):
+        """Метод возвращает все товары.
+        :return: список данных товаров."""
+
+    @abstractmethod
+    def get_rating_days(self, key, first=None, last=None):
+        """Метод возвращает дневные сводки оценок товара по
+        фильтру за период.
+        :param key: пара (ID товара, ID фильтра);
+        :param first, last: первый и последний дни периода - строки в
+        формате DAY_FORMAT. Если None, то период не ограничен.
+        :return: список кортежей (день, количество, сумма, минимум,
+        максимум), упорядоченный по дням."""
+
+    @abstractmethod
+    def get_rating_id_by_key(self, key):
+        """Метод находит оценку, добавленную с ключом
+        идемпотентности.
+        :param key: ключ идемпотентности.
+        :return: ID оценки или None, если оценки с таким ключом нет."""
+
+    @abstractmethod
+    def get_rating_rows(self, product_name, estimation_name, since=None,
+                        until=None, sort=RATING, order=ASC, min_rating=None,
+                        max_rating=None, address=None, limit=None, offset=0):
+        """Метод возвращает оценки товара по фильтру в виде
+        кортежей, без создания словарей.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра;
+        :param since, until: начало и конец (не включительно) периода времени,
+        за который нужны оценки. Если None, то период не ограничен;
+        :param sort: поле, по которому сортируются оценки (RATING, DATE или
+        ADDRESS). При равных значениях оценки сортируются по ID;
+        :param order: направление сортировки (ASC или DESC);
+        :param min_rating, max_rating: пределы значений оценок. Если None, то
+        предела нет;
+        :param address: подстрока, которую должен содержать адрес магазина.
+        Регистр не учитывается только у латинских букв;
+        :param limit: максимальное количество оценок. Если None, то
+        возвращаются все оценки;
+        :param offset: количество пропускаемых первых оценок.
+        :return: список кортежей (ID, адрес, оценка, дата). Если товара или
+        фильтра нет, то список пуст."""
+
+    @abstractmethod
+    def get_rating_rows_batch(self, keys, sort=RATING, order=ASC,
+                              limit=BATCH_RATINGS_LIMIT):
+        """Метод возвращает первые оценки сразу для
+        нескольких пар (товар, фильтр).
+        :param keys: список пар (ID товара, ID фильтра);
+        :param sort: поле, по которому сортируются оценки;
+        :param order: направление сортировки;
+        :param limit: количество оценок для каждой пары.
+        :return: словарь пара ID -> список кортежей (ID, адрес, оценка,
+        дата)."""
+
+    def get_ratings(self, product_name, estimation_name, since=None,
+                    until=None, sort=RATING, order=ASC, min_rating=None,
+                    max_rating=None, address=None, limit=None, offset=0,
+                    compact=False):
+        """Метод возвращает оценки товара по фильтру. Параметры отбора и
+        сортировки такие же, как у метода get_rating_rows.
+        :param compact: если True, то оценки возвращаются кортежами
+        (ID, адрес, оценка, дата), иначе - словарями.
+        :return: список данных оценок."""
+
+        rows = self.get_rating_rows(product_name, estimation_name, since,
+                                    until, sort, order, min_rating,
+                                    max_rating, address, limit, offset)
+        if compact:
+            return rows
+        return [rating_data(row) for row in rows]
+
+    def get_ratings_batch(self, pairs, sort=RATING, order=ASC,
+                          limit=BATCH_RATINGS_LIMIT, compact=False):
+        """Метод возвращает первые оценки сразу для нескольких пар (товар,
+        фильтр).
+        :param pairs: список пар (название товара, название фильтра);
+        :param sort: поле, по которому сортируются оценки;
+        :param order: направление сортировки;
+        :param limit: количество оценок для каждой пары;
+        :param compact: если True, то оценки возвращаются кортежами, иначе -
+        словарями.
+        :return: список в порядке пар. Для каждой пары - пара (версия
+        оценок, список данных оценок) или None, если товара или фильтра
+        нет."""
+
+        keys = self.get_keys(pairs)
+        rows = self.get_rating_rows_batch(
+            [key for key in keys if key is not None], sort, order, limit)
+        result = []
+        for key in keys:
+            if key is None:
+                result.append(None)
+                continue
+            ratings = rows.get(key, [])
+            if not compact:
+                ratings = [rating_data(row) for row in ratings]
+            result.append((self.get_key_version(key), ratings))
+        return result
+
+    def get_ratings_version(self, product_name, estimation_name):
+        """Метод возвращает версию набора оценок товара по фильтру.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра.
+        :return: версия или None, если товара или фильтра нет."""
+
+        key = self.get_key(product_name, estimation_name)
+        if key is None:
+            return None
+        return self.get_key_version(key)
+
+    def get_cached_statistics(self, key, window):
+        """Метод находит статистику оценок в кэше.
+        :param key: пара (ID товара, ID фильтра);
+        :param window: пара (начало периода, конец периода).
+        :return: статистика. Если статистики нет в кэше, то возбуждается
+        исключение KeyError."""
+
+        self.statistics_order.move_to_end((key, window))
+        return self.statistics_cache[key][window]
+
+    @abstractmethod
+    def get_statistics(self, product_name, estimation_name, since=None,
+                       until=None):
+        """Метод возвращает статистику оценок товара по фильтру:
+        перцентили, стандартное отклонение, гистограмму и минимальные оценки
+        по магазинам. Статистика кэшируется методом cache_statistics до
+        изменения оценок.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра;
+        :param since, until: начало и конец (не включительно) периода времени.
+        Если None, то период не ограничен.
+        :return: словарь со статистикой или None, если оценок нет."""
+
+    @abstractmethod
+    def get_summary(self, product_name, estimation_name):
+        """Метод возвращает сводку оценок товара по фильтру.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра.
+        :return: словарь с количеством, минимальной, максимальной и средней
+        оценками или None, если оценок нет."""
+
+    def rating_added(self, product_id, estimation_id, rating, address):
+        """Метод вызывается при добавлении оценки товара. В отличие от
+        ratings_changed, новая цена сразу записывается в индекс последних
+        цен, и цены товара не нужно загружать заново.
+        :param product_id: ID товара;
+        :param estimation_id: ID фильтра;
+        :param rating: оценка;
+        :param address: адрес магазина."""
+
+        index = self.price_indexes.get(estimation_id)
+        stale = index is None or product_id in index.stale
+        self.ratings_changed(product_id, estimation_id)
+        if not stale:
+            # Новая оценка - последняя оценка товара в этом магазине
+            index.stale.discard(product_id)
+            index.set(product_id, address, rating)
+
+    def ratings_changed(self, product_id, estimation_id=None):
+        """Метод вызывается при изменении оценок товара. Метод удаляет из
+        кэша статистику оценок, выдает новую версию набору оценок и
+        помечает устаревшими цены товара в индексах последних цен.
+        :param product_id: ID товара;
+        :param estimation_id: ID фильтра. Если None, то изменились оценки
+        по всем фильтрам."""
+
+        for index_estimation_id, index in self.price_indexes.items():
+            if estimation_id in (None, index_estimation_id):
+                index.stale.add(product_id)
+        self.last_version += 1
+        self.versions[(product_id, estimation_id)] = self.last_version
+        if estimation_id is not None:
+            keys = [(product_id, estimation_id)]
+        else:
+            keys = [key for key in self.statistics_cache
+                    if key[0] == product_id]
+        for key in keys:
+            for window in self.statistics_cache.pop(key, ()):
+                del self.statistics_order[(key, window)]
+
+    def iter_ratings(self, product_name, estimation_name,
+                     chunk_size=STREAM_CHUNK_SIZE, **kwargs):
+        """Метод возвращает оценки товара по фильтру частями, запрашивая
+        каждую следующую часть только когда она понадобится.
+        :param product_name: название товара;
+        :param estimation_name: название фильтра;
+        :param chunk_size: количество оценок в части;
+        :param kwargs: параметры отбора и сортировки оценок и параметр
+        compact, как у метода get_ratings (кроме limit и offset).
+        :return: генератор списков с данными оценок. Последний список
+        короче chunk_size (возможно, пустой)."""
+
+        offset = 0
+        while True:
+            chunk = self.get_ratings(product_name, estimation_name,
+                                     limit=chunk_size, offset=offset,
+                                     **kwargs)
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            offset += chunk_size
+
+    def search_products(self, query, limit=SEARCH_LIMIT):
+        """Метод ищет товары по началу слов названия без учета регистра, а
+        также по похожим названиям.
+        :param query: строка поиска;
+        :param limit: максимальное количество найденных товаров.
+        :return: список данных найденных товаров."""
+
+        return [{ID: product_id, PRODUCT: name} for product_id, name in
+                self.product_index.search(query, limit)]
@@ -0,0 +1,116 @@
+"""Программа для проверки перехода на текущую версию схемы базы данных с
+базы данных, созданной первой версией сервера (без версии схемы, без
+столбца deleted и индексов оценок). Программа создает такую базу данных,
+открывает ее классом Database и проверяет столбцы, индексы, версию схемы,
+оценки и дневные сводки оценок. Если что-то не так, программа завершается
+с кодом 1.
+
+Запуск: python upgrade_check.py"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import const as cn
+from database import Database
+
+# Схема базы данных первой версии сервера
+BASELINE_SCHEMA = (
+    'CREATE TABLE estimation (id INTEGER NOT NULL, name VARCHAR NOT NULL, '
+    'min_value FLOAT, max_value FLOAT, PRIMARY KEY (id), UNIQUE (name))',
+    'CREATE TABLE product (id INTEGER NOT NULL, name VARCHAR NOT NULL, '
+    'PRIMARY KEY (id), UNIQUE (name))',
+    'CREATE TABLE rating (id INTEGER NOT NULL, product_id INTEGER NOT NULL, '
+    'estimation_id INTEGER NOT NULL, rating FLOAT, address VARCHAR NOT NULL, '
+    'date DATETIME NOT NULL, PRIMARY KEY (id), '
+    'FOREIGN KEY(product_id) REFERENCES product (id), '
+    'FOREIGN KEY(estimation_id) REFERENCES estimation (id))',
+)
+# Данные в базе данных первой версии. Даты - с микросекундами, как их
+# записывала первая версия сервера
+BASELINE_DATA = (
+    "INSERT INTO estimation VALUES (1, 'Стоимость', 0, NULL)",
+    "INSERT INTO product VALUES (1, 'Сыр')",
+    "INSERT INTO rating VALUES (1, 1, 1, 10.0, 'ул. Ленина', "
+    "'2021-03-10 12:00:00.123456')",
+    "INSERT INTO rating VALUES (2, 1, 1, 14.0, 'ул. Ленина', "
+    "'2021-03-10 18:30:00.654321')",
+    "INSERT INTO rating VALUES (3, 1, 1, 12.0, 'пр. Мира', "
+    "'2021-03-11 09:15:00.000001')",
+)
+# Индексы оценок, которые должны быть после перехода
+RATING_INDEXES = ('ix_rating_date', 'ix_rating_deleted',
+                  'ix_rating_product_estimation_address',
+                  'ix_rating_product_estimation_date',
+                  'ix_rating_product_estimation_rating')
+
+
+def create_baseline(path):
+    """Функция создает базу данных первой версии сервера.
+    :param path: путь к базе данных."""
+
+    connection = sqlite3.connect(path)
+    for statement in BASELINE_SCHEMA + BASELINE_DATA:
+        connection.execute(statement)
+    connection.commit()
+    connection.close()
+
+
+def check(path):
+    """Функция открывает базу данных первой версии и проверяет ее.
+    :param path: путь к базе данных.
+    :return: список найденных ошибок."""
+
+    errors = []
+    db = Database(path)
+    columns = {row[1] for row in db.session.execute(
+        'PRAGMA table_info(rating)')}
+    if 'deleted' not in columns:
+        errors.append('нет столбца rating.deleted')
+    indexes = {row[1] for row in db.session.execute(
+        'PRAGMA index_list(rating)')}
+    for name in RATING_INDEXES:
+        if name not in indexes:
+            errors.append(f'нет индекса {name}')
+    version = db.session.execute('PRAGMA user_version').scalar()
+    if version != cn.SCHEMA_VERSION:
+        errors.append(f'версия схемы {version}, а не {cn.SCHEMA_VERSION}')
+    ratings = db.get_ratings('Сыр', 'Стоимость', sort=cn.DATE)
+    if [rating[cn.ID] for rating in ratings] != [1, 2, 3] or \
+            ratings[0][cn.DATE] != '2021-03-10 12:00:00':
+        errors.append(f'неверные оценки: {ratings}')
+    history = db.get_price_history('Сыр', 'Стоимость')
+    counts = [point[cn.COUNT] for point in history[cn.POINTS]]
+    if counts != [2, 1]:
+        errors.append(f'неверные дневные сводки: {history}')
+    # Удаление оценки пользуется столбцом deleted и дневными сводками
+    db.delete_ratings([3])
+    if len(db.get_ratings('Сыр', 'Стоимость')) != 2:
+        errors.append('оценка не удалена')
+    db.session.close()
+    return errors
+
+
+def main():
+    """Функция проверяет переход с базы данных первой версии сервера."""
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        path = os.path.join(dir_path, 'db.sqlite3')
+        create_baseline(path)
+        errors = check(path)
+        if not errors:
+            # Повторное открытие подготовленной базы данных ничего не меняет
+            db = Database(path)
+            if len(db.get_ratings('Сыр', 'Стоимость')) != 2:
+                errors.append('оценки изменились при повторном открытии')
+            db.session.close()
+    if errors:
+        for error in errors:
+            print(error)
+        sys.exit(1)
+    print('База данных первой версии переведена на версию схемы '
+          f'{cn.SCHEMA_VERSION}')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,18 @@ import os
 import sys
 import time
 import threading
+import uuid
+from datetime import datetime
 import const as cn
 
 
+def create_key():
+    """Функция создает ключ идемпотентности для оценки.
+    :return: случайная строка из 32 шестнадцатеричных цифр."""
+
+    return uuid.uuid4().hex
+
+
 def delete_file(path):
     """Функция удаляет файл и директорию, в которой находился этот файл.
     :param path: путь к удаляемому файлу."""
@@ -38,6 +47,46 @@ def determine_address():
         sys.exit(1)
 
 
+def determine_backup_pages():
+    """Функция определяет из командной строки, сколько страниц базы данных
+    копируется за один шаг резервного копирования. Например:
+    server.py --backup-pages 64
+    :return: количество страниц (-1 - вся база данных за один шаг)."""
+
+    try:
+        if '--backup-pages' in sys.argv:
+            pages = int(sys.argv[sys.argv.index('--backup-pages') + 1])
+            if pages == 0 or pages < -1:
+                raise ValueError
+            return pages
+        return cn.BACKUP_PAGES
+    except:
+        sys.exit(1)
+
+
+def determine_capture():
+    """Функция определяет из командной строки папку журнала, в который
+    сервер записывает сообщения от клиентов. Например:
+    server.py --capture capture
+    :return: путь к папке или None, если сообщения не записываются."""
+
+    try:
+        if '--capture' in sys.argv:
+            return sys.argv[sys.argv.index('--capture') + 1]
+        return None
+    except IndexError:
+        sys.exit(1)
+
+
+def determine_flag(flag):
+    """Функция определяет, указан ли флаг в командной строке. Например:
+    server.py -p 8078 -a 192.168.1.2 --soft-delete
+    :param flag: название флага.
+    :return: True, если флаг указан, иначе False."""
+
+    return flag in sys.argv
+
+
 def determine_port():
     """Функция определяет порт для подключения. Строка для сервера и клиента
     должна быть записана в формате:
@@ -60,16 +109,72 @@ def determine_port():
         sys.exit(1)
 
 
-def find_socket(sockets, ip_address):
-    """Функция находит сокет по IP адресу.
-    :param sockets: список сокетов;
-    :param ip_address: IP адрес.
-    :return: найденный сокет или None, если сокет не найден."""
+def determine_idle_timeout():
+    """Функция определяет из командной строки, через сколько секунд простоя
+    сервер закрывает соединение с клиентом. Например:
+    server.py --idle-timeout 600
+    :return: время в секундах (0 - соединения не закрываются)."""
+
+    try:
+        if '--idle-timeout' in sys.argv:
+            timeout = int(sys.argv[sys.argv.index('--idle-timeout') + 1])
+            if timeout < 0:
+                raise ValueError
+            return timeout
+        return cn.IDLE_TIMEOUT
+    except:
+        sys.exit(1)
+
+
+def determine_rate(option, default):
+    """Функция определяет из командной строки ограничение частоты запросов.
+    Например:
+    server.py --read-rate 20 --write-rate 5
+    :param option: название параметра;
+    :param default: значение по умолчанию.
+    :return: количество запросов в секунду (0 - без ограничения)."""
+
+    try:
+        if option in sys.argv:
+            rate = float(sys.argv[sys.argv.index(option) + 1])
+            if rate < 0:
+                raise ValueError
+            return rate
+        return default
+    except:
+        sys.exit(1)
+
+
+def determine_retention_days():
+    """Функция определяет из командной строки, сколько дней оценки хранятся
+    в основной базе данных сервера, прежде чем попасть в архив. Например:
+    server.py --retention-days 365
+    :return: количество дней или None, если оценки не переносятся в
+    архив."""
+
+    try:
+        if '--retention-days' in sys.argv:
+            days = int(sys.argv[sys.argv.index('--retention-days') + 1])
+            if days < 1:
+                raise ValueError
+            return days
+        return None
+    except:
+        sys.exit(1)
+
 
-    for sock in sockets:
-        if ip_address == get_socket_param(sock):
-            return sock
-    return None
+def determine_storage():
+    """Функция определяет из командной строки хранилище данных сервера.
+    Например:
+    server.py --storage memory
+    :return: название хранилища: sqlite (по умолчанию) или memory."""
+
+    try:
+        if '--storage' in sys.argv:
+            return sys.argv[sys.argv.index('--storage') + 1]
+        return 'sqlite'
+    except IndexError:
+        sys.exit(1)
 
 
 def get_socket_param(sock):
@@ -83,7 +188,30 @@ def get_socket_param(sock):
 def get_time():
     """Функция получает текущее время."""
 
-    return time.strftime('%Y-%m-%d %H:%M:%S')
+    return time.strftime(cn.DATE_FORMAT)
+
+
+def is_valid_key(key):
+    """Функция проверяет ключ идемпотентности из сообщения.
+    :param key: ключ.
+    :return: True, если ключ не задан или является строкой допустимой
+    длины, иначе False."""
+
+    return key is None or (isinstance(key, str) and
+                           0 < len(key) <= cn.MAX_IDEMPOTENCY_KEY_LENGTH)
+
+
+def parse_date(text):
+    """Функция преобразует дату из сообщения в объект datetime.
+    :param text: дата в формате '%Y-%m-%d %H:%M:%S' или '%Y-%m-%d'.
+    :return: объект datetime или None, если дата не задана."""
+
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, cn.DATE_FORMAT)
+    except ValueError:
+        return datetime.strptime(text, '%Y-%m-%d')
 
 
 def printf(text):